@@ -0,0 +1,291 @@
+"""音频回调的微基准：不打开声卡，直接反复调用回调测量耗时与内存分配。
+
+运行：
+    python -m audio.benchmarks
+    python -m audio.benchmarks --resampler
+    python -m audio.benchmarks --compact
+    python -m audio.benchmarks --import-time [预算秒数]
+    python -m audio.benchmarks --round-trip 麦克风设备编号 [--output 输出设备编号]
+不带参数时对比新旧混音路径，当前路径每块新增内存超过 CALLBACK_MAX_ALLOC_BYTES 时以非零状态退出；
+--resampler 对比麦克风逐块重采样的两种实现；--compact 对比 float32 与紧凑存储的回调耗时，
+超过 COMPACT_MAX_SLOWDOWN 或内存超限时以非零状态退出；--import-time 在新进程中导入界面模块，
+加载了 torch/demucs 或耗时超过预算时以非零状态退出；--round-trip 会实际打开声卡，
+对比双流与全双工模式下麦克风的往返延迟。
+"""
+
+import argparse
+import collections
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from audio.engine import AudioEngine
+from audio.player import AudioPlayer
+from audio.ring_buffer import MicRingBuffer
+from utils.audio_utils import StreamingResampler, compact_audio, resample_audio
+
+# 紧凑存储的回调平均耗时最多允许为 float32 的倍数
+COMPACT_MAX_SLOWDOWN = 1.5
+# 回调期间允许的内存峰值增量。切片产生的数组视图对象（每个约百字节）无法避免，
+# 而任何一块样本缓冲区（1024 帧单声道 float32 即 4 KB）都会超出这个值
+CALLBACK_MAX_ALLOC_BYTES = 2048
+# 导入界面模块（窗口出现之前）允许的耗时，秒
+IMPORT_TIME_BUDGET = 2.0
+# 启动时不应加载的模块，首次分离时才导入
+DEFERRED_MODULES = ("torch", "torchaudio", "demucs")
+
+# 在新进程中执行，保证 sys.modules 干净；无图形环境的 Python 缺少 tkinter 时用空模块代替，
+# 只测量本程序自身的导入
+_IMPORT_PROBE = """
+import json, sys, time, types
+try:
+    import tkinter
+except ImportError:
+    class _Stub(types.ModuleType):
+        def __getattr__(self, name):
+            return type(name, (), {})
+    for name in ("tkinter", "tkinter.filedialog", "tkinter.messagebox", "tkinter.ttk"):
+        sys.modules[name] = _Stub(name)
+start = time.perf_counter()
+import ui.tkinter_ui
+elapsed = time.perf_counter() - start
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def _legacy_fill(player, mic_queue, outdata, frames):
+    """旧版混音路径（含限长 deque 麦克风队列）的等价实现，仅作为对照。"""
+    with player.engine.lock:
+        if not player.playing or player.paused:
+            outdata[:] = np.zeros((frames, player.channels), dtype='float32')
+            return
+        end = player.position + frames
+        mixed = (player.accomp_volume * player.accomp[player.position:end]
+                 + player.vocal_volume * player.vocals[player.position:end])
+        if mic_queue:
+            mic_block = mic_queue.popleft()
+            if mic_block.shape[0] < frames:
+                pad = np.zeros((frames - mic_block.shape[0], player.channels), dtype='float32')
+                mic_block = np.concatenate([mic_block, pad], axis=0)
+            if mic_block.shape[1] < player.channels:
+                mic_block = np.repeat(mic_block, player.channels, axis=1)
+            mixed += player.engine.mic_volume * mic_block[:frames]
+        outdata[:len(mixed)] = mixed
+        player.position = end
+
+
+def _make_player(seconds, sample_rate, frames, dtype="float32"):
+    rng = np.random.default_rng(0)
+    n = int(seconds * sample_rate)
+    vocals = compact_audio(rng.standard_normal((n, 2), dtype=np.float32) * 0.1, dtype)
+    accomp = compact_audio(rng.standard_normal((n, 2), dtype=np.float32) * 0.1, dtype)
+    engine = AudioEngine(blocksize=frames)
+    engine.sample_rate = sample_rate
+    player = AudioPlayer(vocals, accomp, sample_rate, engine=engine)
+    player.playing = True
+    engine.track = player
+    # 模拟已开启麦克风：每块都有一个单声道输入块
+    engine.mic_stream = object()
+    engine.mic_channels = 1
+    return player, rng
+
+
+def _run_blocks(fill, feed, player, outdata, frames, times):
+    for i in range(len(times)):
+        feed()
+        if player.position + frames >= player.num_frames:
+            player.position = 0
+        start = time.perf_counter()
+        fill(outdata, frames)
+        times[i] = time.perf_counter() - start
+
+
+def _measure(fill, feed, player, frames, blocks):
+    outdata = np.zeros((frames, player.channels), dtype=np.float32)
+    times = np.empty(blocks)
+    _run_blocks(fill, feed, player, outdata, frames, times)
+    # tracemalloc 会拖慢 Python 代码，内存分配单独再跑一轮统计；计时数组在开始统计前分配
+    alloc_times = np.empty(min(blocks, 500))
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    _run_blocks(fill, feed, player, outdata, frames, alloc_times)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {
+        "mean_us": float(times.mean() * 1e6),
+        "p99_us": float(np.percentile(times, 99) * 1e6),
+        "max_us": float(times.max() * 1e6),
+        # 回调期间新增的内存峰值，分配越少越接近 0
+        "peak_alloc_bytes": int(peak),
+    }
+
+
+def bench_callback(blocks=5000, frames=1024, sample_rate=44100, seconds=30):
+    """对比旧版与当前混音路径，返回 {"legacy": ..., "current": ...}。"""
+    player, rng = _make_player(seconds, sample_rate, frames)
+    mic = rng.standard_normal((frames, 1), dtype=np.float32) * 0.01
+    # 旧版在麦克风回调中就把单声道复制成多声道
+    legacy_mic = np.repeat(mic, player.channels, axis=1)
+    queue = collections.deque(maxlen=5)
+    legacy = _measure(lambda out, n: _legacy_fill(player, queue, out, n),
+                      lambda: queue.append(legacy_mic), player, frames, blocks)
+    player.position = 0
+    engine = player.engine
+    engine.mic_ring = MicRingBuffer(8 * frames, 1, sample_rate, target=2 * frames)
+    current = _measure(engine._fill, lambda: engine.mic_ring.write(mic),
+                       player, frames, blocks)
+    return {"legacy": legacy, "current": current}
+
+
+def bench_compact(blocks=5000, frames=1024, sample_rate=44100, seconds=30):
+    """以 float32、float16、int16 存储的音轨分别测量当前混音路径，返回 {类型: 结果}。"""
+    results = {}
+    for dtype in ("float32", "float16", "int16"):
+        player, rng = _make_player(seconds, sample_rate, frames, dtype)
+        mic = rng.standard_normal((frames, 1), dtype=np.float32) * 0.01
+        engine = player.engine
+        engine.mic_ring = MicRingBuffer(8 * frames, 1, sample_rate, target=2 * frames)
+        results[dtype] = _measure(engine._fill, lambda: engine.mic_ring.write(mic),
+                                  player, frames, blocks)
+    return results
+
+
+def _time_blocks(process, blocks):
+    times = np.empty(len(blocks))
+    for i, block in enumerate(blocks):
+        start = time.perf_counter()
+        process(block)
+        times[i] = time.perf_counter() - start
+    return {"mean_us": float(times.mean() * 1e6), "p99_us": float(np.percentile(times, 99) * 1e6)}
+
+
+def bench_resampler(orig_sr=44100, new_sr=48000, frames=1024, blocks=500, channels=1):
+    """对比逐块调用 resample_audio 与 StreamingResampler 的单块耗时（微秒）。"""
+    rng = np.random.default_rng(0)
+    data = [rng.standard_normal((frames, channels), dtype=np.float32) for _ in range(blocks)]
+    results = {}
+    try:
+        results["resample_audio"] = _time_blocks(
+            lambda b: resample_audio(b, orig_sr, new_sr), data)
+    except ImportError:
+        # 未安装 torch 时只测流式实现
+        results["resample_audio"] = None
+    resampler = StreamingResampler(orig_sr, new_sr, channels)
+    results["streaming"] = _time_blocks(resampler.process, data)
+    return results
+
+
+def measure_round_trip(mic_device, output_device=None, seconds=3.0, sample_rate=48000):
+    """分别以双流和全双工模式播放静音并混入麦克风，返回各自实测的往返延迟。
+
+    延迟取自声卡回调给出的采集与播出时间戳；麦克风音量置零，避免啸叫。
+    """
+    silence = np.zeros((int((seconds + 1) * sample_rate), 2), dtype=np.float32)
+    results = {}
+    for name, duplex in (("two_stream", False), ("duplex", True)):
+        player = AudioPlayer(silence, silence, sample_rate, output_device=output_device,
+                             mic_device=mic_device, mic_enabled=True, latency=0.03, duplex=duplex)
+        player.set_mic_volume(0.0)
+        player.play()
+        try:
+            time.sleep(seconds)
+            active = player.duplex_active
+        finally:
+            player.stop()
+            player.engine.close()
+        rtt = player.round_trip_latency
+        results[name] = {
+            "duplex_active": active,
+            "round_trip_ms": rtt * 1000 if rtt is not None else None,
+        }
+    return results
+
+
+def measure_import_time():
+    """在新进程中导入 ui.tkinter_ui，返回耗时（秒）与已被加载的 DEFERRED_MODULES。"""
+    # 在项目根目录运行，从其他目录启动（如 pytest）时也能找到 ui 包
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", _IMPORT_PROBE % (DEFERRED_MODULES,)],
+        capture_output=True, text=True, cwd=root,
+    )
+    if result.returncode != 0:
+        raise RuntimeError("导入 ui.tkinter_ui 失败：\n" + result.stderr.strip())
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _check_alloc(results):
+    """检查各结果的回调内存增量不超过 CALLBACK_MAX_ALLOC_BYTES，超出时打印并返回 False。"""
+    ok = True
+    for name, result in results.items():
+        if result["peak_alloc_bytes"] > CALLBACK_MAX_ALLOC_BYTES:
+            print(f"{name} 回调新增内存 {result['peak_alloc_bytes']} B，"
+                  f"超过 {CALLBACK_MAX_ALLOC_BYTES} B")
+            ok = False
+    return ok
+
+
+def main(argv=None):
+    """打印微基准结果。"""
+    parser = argparse.ArgumentParser(description="音频回调微基准")
+    parser.add_argument("--resampler", action="store_true", help="对比麦克风重采样的两种实现")
+    parser.add_argument("--compact", action="store_true", help="对比紧凑存储的回调耗时")
+    parser.add_argument("--import-time", type=float, nargs="?", const=IMPORT_TIME_BUDGET,
+                        metavar="SECONDS", help="检查界面模块的导入耗时与延迟加载")
+    parser.add_argument("--round-trip", type=int, metavar="MIC", help="测量该麦克风的往返延迟")
+    parser.add_argument("--output", type=int, default=None, help="输出设备编号")
+    args = parser.parse_args(argv)
+    if args.resampler:
+        for name, result in bench_resampler().items():
+            print(f"{name:>15}: " + ("未安装 torch" if result is None else
+                  f"mean {result['mean_us']:.1f} us, p99 {result['p99_us']:.1f} us"))
+        return
+    if args.compact:
+        results = bench_compact()
+        base = results["float32"]["mean_us"]
+        slow = False
+        for name, result in results.items():
+            ratio = result["mean_us"] / base
+            slow |= ratio > COMPACT_MAX_SLOWDOWN
+            print(f"{name:>8}: mean {result['mean_us']:.1f} us ({ratio:.2f}x), "
+                  f"p99 {result['p99_us']:.1f} us, peak alloc {result['peak_alloc_bytes']} B")
+        if slow:
+            print(f"紧凑存储的回调耗时超过 float32 的 {COMPACT_MAX_SLOWDOWN} 倍")
+        if not _check_alloc(results) or slow:
+            sys.exit(1)
+        return
+    if args.import_time is not None:
+        result = measure_import_time()
+        print(f"import ui.tkinter_ui: {result['seconds'] * 1000:.0f} ms "
+              f"(预算 {args.import_time * 1000:.0f} ms)")
+        failed = False
+        if result["loaded"]:
+            print("启动时加载了 " + "、".join(result["loaded"]))
+            failed = True
+        if result["seconds"] > args.import_time:
+            print("导入耗时超过预算")
+            failed = True
+        if failed:
+            sys.exit(1)
+        return
+    if args.round_trip is not None:
+        for name, result in measure_round_trip(args.round_trip, args.output).items():
+            rtt = result["round_trip_ms"]
+            print(f"{name:>10}: " + (f"{rtt:.1f} ms" if rtt is not None else "未测得"))
+        return
+    results = bench_callback()
+    for name, result in results.items():
+        print(f"{name:>8}: mean {result['mean_us']:.1f} us, p99 {result['p99_us']:.1f} us, "
+              f"max {result['max_us']:.1f} us, peak alloc {result['peak_alloc_bytes']} B")
+    if not _check_alloc({"current": results["current"]}):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
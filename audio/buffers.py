@@ -0,0 +1,236 @@
+"""已准备音频数据的内存预算：统计进程持有的音频缓冲区，超出预算时把最不急需的溢出到磁盘。"""
+
+import os
+import shutil
+import threading
+import uuid
+import weakref
+
+import numpy as np
+
+from utils.audio_utils import ScaledArray, compact_audio, sample_scale
+from utils.settings import BASE_DIR
+
+# 超出预算时依次溢出的槽位；current 正在播放，从不溢出
+SPILL_ORDER = ("prev", "next")
+# 开启紧凑存储时在后台压缩的槽位；current 的数据同时被播放器持有，压缩反而多占内存，
+# 其他槽位的数组被播放器（如已排队接续的下一首）共用时同样跳过
+COMPACT_SLOTS = ("prev", "next")
+# 预取的更后面几首使用以此开头的槽位，压缩方式同 next，并且最先溢出
+AHEAD_PREFIX = "ahead:"
+
+
+def default_spill_dir():
+    """返回默认的溢出目录（位于程序目录下）。"""
+    return os.path.join(BASE_DIR, "audio_spill")
+
+
+def _root(array):
+    """返回实际持有数据的底层数组，视图与原数组只计一次。"""
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
+
+
+def _mb(nbytes):
+    return round(nbytes / (1024 * 1024), 1)
+
+
+class AudioBufferManager:
+    """按字节预算管理当前/下一首/上一首等槽位中的音频数据。
+
+    槽位保存 (索引, 人声, 伴奏, 采样率)。其他地方持有的缓冲区（播放器、
+    正在分离或解码的数组）通过 track 以弱引用登记，只计入用量。
+    内存映射的数组由页缓存承担，不计入预算。
+    """
+
+    def __init__(self, budget_bytes, spill_dir=None, compact="float32"):
+        """budget_bytes 为 0 时不设上限，只统计用量。
+
+        compact 为 "float16" 或 "int16" 时，上一首/下一首在后台转换为该类型保存。
+        """
+        self.budget_bytes = int(budget_bytes)
+        self.compact = compact
+        self.spill_dir = spill_dir or default_spill_dir()
+        self.lock = threading.RLock()
+        self._slots = {}
+        # 登记名 -> 弱引用列表，数组被释放后自动失效
+        self._tracked = {}
+        # 仍被映射、暂时删不掉的溢出文件（Windows），之后再试
+        self._orphans = []
+        # 正在后台压缩的槽位，压缩完成前不溢出
+        self._compacting = set()
+        self.spills = 0
+        self.evictions = 0
+        # 上次运行留下的溢出文件
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    # ---------- 槽位 ---------- #
+
+    def get(self, name):
+        """返回槽位中的数据，没有时返回 None。"""
+        return self._slots.get(name)
+
+    def put(self, name, data):
+        """设置槽位（data 为 None 时清空），随后按预算溢出其他槽位。"""
+        with self.lock:
+            if data is None:
+                self._slots.pop(name, None)
+            else:
+                self._slots[name] = data
+            compact = (data is not None and (name in COMPACT_SLOTS or name.startswith(AHEAD_PREFIX))
+                       and self._compactable(data) and self._frees_memory(name, data))
+            if compact:
+                self._compacting.add(name)
+            else:
+                self._compacting.discard(name)
+            self.enforce()
+        if compact:
+            threading.Thread(target=self._compact, args=(name, data), daemon=True).start()
+
+    def _compactable(self, data):
+        if self.compact not in ("float16", "int16"):
+            return False
+        return any(isinstance(a, np.ndarray) and a.dtype == np.float32
+                   and not isinstance(_root(a), np.memmap) for a in data[1:3])
+
+    def _compact(self, name, data):
+        """在后台压缩槽位数据；期间槽位被替换，或原数组已被播放器等共用时丢弃结果。
+
+        原数组被共用时换上压缩副本并不能释放它，反而让两份同时常驻。
+        """
+        index, vocals, accomp, sr = data
+        try:
+            compacted = (index, compact_audio(vocals, self.compact),
+                         compact_audio(accomp, self.compact), sr)
+        except MemoryError:
+            compacted = None
+        with self.lock:
+            current = self._slots.get(name)
+            if current is data:
+                self._compacting.discard(name)
+                if compacted is not None and self._frees_memory(name, data):
+                    self._slots[name] = compacted
+            self.enforce()
+
+    def names(self, prefix=""):
+        """返回以 prefix 开头的槽位名，按放入的先后排列。"""
+        with self.lock:
+            return [name for name in self._slots if name.startswith(prefix)]
+
+    def track(self, name, *arrays):
+        """登记在槽位之外持有的缓冲区，仅用于统计，同名登记会被替换。"""
+        with self.lock:
+            self._tracked[name] = [weakref.ref(a) for a in arrays if isinstance(a, np.ndarray)]
+            self.enforce()
+
+    # ---------- 统计 ---------- #
+
+    def _roots(self, exclude=None):
+        """按底层数组去重，返回 {id: (数组, 所属名称)}。"""
+        roots = {}
+        for name, data in self._slots.items():
+            if name == exclude:
+                continue
+            for array in data[1:3]:
+                if isinstance(array, np.ndarray):
+                    root = _root(array)
+                    roots.setdefault(id(root), (root, name))
+        for name, refs in self._tracked.items():
+            for ref in refs:
+                array = ref()
+                if array is not None:
+                    root = _root(array)
+                    roots.setdefault(id(root), (root, name))
+        return roots
+
+    def ram_bytes(self):
+        """常驻内存中的音频数据字节数（不含内存映射）。"""
+        with self.lock:
+            return sum(root.nbytes for root, _ in self._roots().values()
+                       if not isinstance(root, np.memmap))
+
+    def usage(self):
+        """返回可直接序列化的用量报告（MB）。"""
+        with self.lock:
+            ram, mapped, by_name = 0, 0, {}
+            for root, name in self._roots().values():
+                if isinstance(root, np.memmap):
+                    mapped += root.nbytes
+                    continue
+                ram += root.nbytes
+                # 预取槽位按路径命名，报告中合并为一项
+                if name.startswith(AHEAD_PREFIX):
+                    name = AHEAD_PREFIX[:-1]
+                by_name[name] = by_name.get(name, 0) + root.nbytes
+            return {
+                "budget_mb": _mb(self.budget_bytes),
+                "ram_mb": _mb(ram),
+                "mapped_mb": _mb(mapped),
+                "by_owner_mb": {name: _mb(n) for name, n in by_name.items()},
+                "spills": self.spills,
+                "evictions": self.evictions,
+            }
+
+    # ---------- 溢出 ---------- #
+
+    def enforce(self):
+        """内存用量超出预算时，依次把预取槽位（后放入的先）和 SPILL_ORDER 中的槽位溢出到磁盘，失败则直接丢弃。"""
+        with self.lock:
+            self._retry_orphans()
+            if not self.budget_bytes:
+                return
+            ahead = self.names(AHEAD_PREFIX)[::-1]
+            for name in ahead + list(SPILL_ORDER):
+                if self.ram_bytes() <= self.budget_bytes:
+                    return
+                data = self._slots.get(name)
+                if data is None or name in self._compacting or not self._frees_memory(name, data):
+                    continue
+                spilled = self._spill(data)
+                if spilled is None:
+                    self._slots.pop(name)
+                    self.evictions += 1
+                else:
+                    self._slots[name] = spilled
+                    self.spills += 1
+
+    def _frees_memory(self, name, data):
+        """槽位的数组在内存中，且没有被其他槽位或登记的缓冲区共用时，溢出才能省下内存。"""
+        others = self._roots(exclude=name)
+        for array in data[1:3]:
+            root = _root(array)
+            if isinstance(root, np.memmap) or id(root) in others:
+                return False
+        return True
+
+    def _spill(self, data):
+        """把数据写成 .npy 并以内存映射重新打开；磁盘失败时返回 None。"""
+        index, vocals, accomp, sr = data
+        try:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            mapped = []
+            for array in (vocals, accomp):
+                path = os.path.join(self.spill_dir, f"{uuid.uuid4().hex}.npy")
+                # 紧凑存储的数据按原类型写出，映射回来后重新附上还原系数
+                np.save(path, np.ascontiguousarray(np.asarray(array)))
+                loaded = np.load(path, mmap_mode="r")
+                if isinstance(array, ScaledArray):
+                    loaded = ScaledArray(loaded, sample_scale(array))
+                mapped.append(loaded)
+                self._remove(path)
+        except OSError:
+            return None
+        return (index, mapped[0], mapped[1], sr)
+
+    def _remove(self, path):
+        # POSIX 上映射建立后即可删除文件，内存映射继续有效；Windows 上稍后再删
+        try:
+            os.remove(path)
+        except OSError:
+            self._orphans.append(path)
+
+    def _retry_orphans(self):
+        orphans, self._orphans = self._orphans, []
+        for path in orphans:
+            self._remove(path)
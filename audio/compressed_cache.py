@@ -0,0 +1,261 @@
+"""分离结果的压缩缓存层：人声与伴奏按固定时长分块编码为 FLAC，附带跳转索引。
+
+原始 .npy 缓存（StemCache）保存常听的歌曲；从中淘汰的条目降级到这里，
+体积约为原来的三分之一到一半。播放时由后台线程只解码播放位置附近的块，
+可以从任意位置开始，无需先解码整首。
+"""
+
+import io
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+import numpy as np
+
+from audio.stream_buffer import ProgressiveStems
+from utils.settings import BASE_DIR
+
+try:
+    import soundfile as sf
+except Exception:
+    sf = None
+
+# 每块的时长；块越小跳转后等待越短，索引和编码开销越大
+CHUNK_SECONDS = 10.0
+# 解码线程保持领先播放位置的块数
+LOOKAHEAD_CHUNKS = 3
+# 正在播放且播放位置附近的块都已解码时，每隔这么久补解一块其余部分，直到整首完成；
+# 没有播放器在读取（尚未开始、已暂停或等待整首）时全速解码
+IDLE_INTERVAL = 0.5
+# 解码线程检查播放位置（跳转）的间隔
+_POLL_SECONDS = 0.02
+# 24 位整数对 float32 分离结果而言误差低于 -140 dB，听感上无损
+_SUBTYPE = "PCM_24"
+_META_FILE = "meta.json"
+_STEMS = ("vocals", "accomp")
+
+
+def default_archive_dir():
+    """返回默认的压缩缓存目录（位于程序目录下）。"""
+    return os.path.join(BASE_DIR, "stem_archive")
+
+
+def _encode(path, data, sr, chunk_frames):
+    """把一个音轨逐块编码写入 path，返回 (还原系数, [(偏移, 字节数), ...])。"""
+    peak = float(np.max(np.abs(data))) if len(data) else 0.0
+    # FLAC 只能存 [-1, 1]，峰值超出时整轨缩小，读取时乘回
+    scale = max(1.0, peak)
+    index = []
+    with open(path, "wb") as f:
+        for start in range(0, len(data), chunk_frames):
+            chunk = np.asarray(data[start:start + chunk_frames], dtype=np.float32)
+            if scale != 1.0:
+                chunk = chunk / np.float32(scale)
+            buf = io.BytesIO()
+            sf.write(buf, chunk, sr, format="FLAC", subtype=_SUBTYPE)
+            payload = buf.getvalue()
+            index.append((f.tell(), len(payload)))
+            f.write(payload)
+    return scale, index
+
+
+class CompressedStemCache:
+    """以与 StemCache 相同的键保存分块 FLAC，超出容量时按 LRU 淘汰。"""
+
+    def __init__(self, cache_dir=None, max_bytes=16 * 1024 ** 3):
+        """创建缓存目录并设置容量上限（字节）；未安装 soundfile 时抛出 ImportError。"""
+        if sf is None:
+            raise ImportError("压缩缓存需要 soundfile")
+        self.cache_dir = cache_dir or default_archive_dir()
+        self.max_bytes = int(max_bytes)
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def contains(self, key):
+        """判断缓存中是否已有该条目。"""
+        return os.path.exists(os.path.join(self._entry_dir(key), _META_FILE))
+
+    def put(self, key, vocals, accomp, sr):
+        """编码并写入一个条目；先写临时目录再原子替换。编码整首需要数秒。"""
+        if self.contains(key):
+            return
+        frames = min(len(vocals), len(accomp))
+        chunk_frames = max(1, int(CHUNK_SECONDS * sr))
+        tmp = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        try:
+            meta = {"sr": int(sr), "frames": int(frames), "channels": int(vocals.shape[1]),
+                    "chunk_frames": chunk_frames, "scale": {}, "index": {}}
+            for name, data in zip(_STEMS, (vocals, accomp)):
+                scale, index = _encode(os.path.join(tmp, f"{name}.flacs"), data[:frames],
+                                       int(sr), chunk_frames)
+                meta["scale"][name] = scale
+                meta["index"][name] = index
+            with open(os.path.join(tmp, _META_FILE), "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+            try:
+                os.replace(tmp, self._entry_dir(key))
+            except OSError:
+                # 其他线程或进程已写入同一条目
+                pass
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def open(self, key, on_finished=None, eager=False):
+        """打开条目并启动后台解码，返回 ChunkedStems；未命中时返回 None。
+
+        on_finished(stems) 在整首解码完成、标记结束之前于解码线程中调用。
+        eager 为 True 时始终全速解码，用于只需要整首结果的预加载。
+        """
+        entry = self._entry_dir(key)
+        meta_path = os.path.join(entry, _META_FILE)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            # 更新访问时间，供 LRU 淘汰使用
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None
+        stems = ChunkedStems(entry, meta, on_finished)
+        stems.eager = eager
+        return stems.start()
+
+    def _entries(self):
+        """列出所有条目及其大小与最近访问时间。"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry, _META_FILE)
+            if name.startswith(".") or not os.path.isfile(meta_path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+                entries.append((os.path.getmtime(meta_path), size, entry))
+            except OSError:
+                continue
+        return entries
+
+    def total_bytes(self):
+        """返回缓存当前占用的字节数。"""
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self):
+        """删除最久未使用的条目，直到总大小不超过上限。"""
+        with self.lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                shutil.rmtree(entry, ignore_errors=True)
+                total -= size
+
+
+class ChunkedStems(ProgressiveStems):
+    """边解码边播放的压缩缓存条目。
+
+    与分离中的 ProgressiveStems 不同，已就绪的部分不必从头连续：播放器每块通过
+    covers 报告播放位置，解码线程优先解码该位置所在及之后 LOOKAHEAD_CHUNKS 块，
+    跳转到任意位置后只需等待一块解码完成。
+    """
+
+    def __init__(self, entry, meta, on_finished=None):
+        """按元数据分配整首的缓冲区（未解码的页不占物理内存），不启动解码。"""
+        super().__init__(int(meta["frames"]), int(meta["channels"]), int(meta["sr"]))
+        self.chunk_frames = int(meta["chunk_frames"])
+        self._entry = entry
+        self._meta = meta
+        self._on_finished = on_finished
+        self._decoded = np.zeros(len(meta["index"]["vocals"]), dtype=bool)
+        # 播放位置及最近一次读取的时间，由音频线程写入、解码线程读取
+        self.cursor = 0
+        self._read_at = 0.0
+        # 为 True 时不按播放进度节流
+        self.eager = False
+
+    def start(self):
+        """启动后台解码线程。"""
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def covers(self, start, end):
+        self.cursor = start
+        self._read_at = time.monotonic()
+        if end <= self.ready:
+            return True
+        decoded = self._decoded
+        return bool(decoded[start // self.chunk_frames:(end - 1) // self.chunk_frames + 1].all())
+
+    def seek_target(self, frame):
+        # 在音频线程中调用，只记录位置，解码线程轮询到后立即转去解码该块
+        self.cursor = frame
+        return frame
+
+    def wait_finished(self, timeout=None):
+        # 有人等整首时不再节流
+        self.eager = True
+        return super().wait_finished(timeout)
+
+    def _paced(self):
+        """有播放器正在读取时才按播放进度节流。"""
+        return not self.eager and time.monotonic() - self._read_at < IDLE_INTERVAL
+
+    def _next_chunk(self):
+        """选出下一个要解码的块；播放位置附近都已就绪时返回 (块号, False)。"""
+        decoded = self._decoded
+        current = min(self.cursor // self.chunk_frames, len(decoded) - 1)
+        pending = np.flatnonzero(~decoded)
+        ahead = pending[pending >= current]
+        if len(ahead) and ahead[0] <= current + LOOKAHEAD_CHUNKS:
+            return int(ahead[0]), True
+        # 其余部分按播放方向补齐，最后回头解码跳过的块
+        return int(ahead[0] if len(ahead) else pending[0]), False
+
+    def _read_chunk(self, name, i):
+        offset, length = self._meta["index"][name][i]
+        with open(os.path.join(self._entry, f"{name}.flacs"), "rb") as f:
+            f.seek(offset)
+            payload = f.read(length)
+        data, _ = sf.read(io.BytesIO(payload), dtype="float32", always_2d=True)
+        scale = self._meta["scale"][name]
+        if scale != 1.0:
+            data *= np.float32(scale)
+        return data
+
+    def _decode(self, i):
+        start = i * self.chunk_frames
+        for name, target in zip(_STEMS, (self.vocals, self.accomp)):
+            data = self._read_chunk(name, i)
+            n = max(0, min(len(data), self.num_frames - start))
+            target[start:start + n] = data[:n]
+        self._decoded[i] = True
+        # ready 仍表示从头连续就绪的帧数，供 wait_for 使用
+        pending = np.flatnonzero(~self._decoded)
+        prefix = pending[0] * self.chunk_frames if len(pending) else self.num_frames
+        self._advance(min(prefix, self.num_frames))
+
+    def _run(self):
+        try:
+            idle = 0.0
+            while not self._decoded.all():
+                i, urgent = self._next_chunk()
+                if not urgent and idle < IDLE_INTERVAL and self._paced():
+                    time.sleep(_POLL_SECONDS)
+                    idle += _POLL_SECONDS
+                    continue
+                idle = 0.0
+                self._decode(i)
+            if self._on_finished is not None:
+                self._on_finished(self)
+        except Exception as e:
+            self.finish(e)
+            return
+        self.finish()
@@ -0,0 +1,107 @@
+"""按区间解码音频文件，以及边解码边播放原始混音的辅助函数。"""
+
+import threading
+
+import numpy as np
+
+from audio.stream_buffer import ProgressiveAudio
+from utils.audio_utils import resample_audio
+
+try:
+    import soundfile as sf
+except Exception:
+    sf = None
+
+# 边解码边播放时每段的长度，以及重采样时两侧多读、随后丢弃的上下文
+DECODE_SEGMENT_SECONDS = 5.0
+DECODE_CONTEXT_SECONDS = 0.05
+
+
+def open_audio(audio_path):
+    """
+    返回 (sr, 总帧数, read(lo, hi))，read 返回 [channels, frames] 的 float32 数组。
+    优先使用 soundfile 按区间读取（无需加载 torch），不支持的格式回退到 torchaudio。
+    """
+    if sf is not None:
+        try:
+            info = sf.info(audio_path)
+            if info.frames > 0:
+                lock = threading.Lock()
+                handle = sf.SoundFile(audio_path)
+
+                def read(lo, hi):
+                    with lock:
+                        handle.seek(lo)
+                        data = handle.read(hi - lo, dtype="float32", always_2d=True)
+                    return np.ascontiguousarray(data.T)
+                return int(info.samplerate), int(info.frames), read
+        except Exception:
+            pass
+
+    import torchaudio
+
+    try:
+        info = torchaudio.info(audio_path)
+        total, sr = int(info.num_frames), int(info.sample_rate)
+    except Exception:
+        total, sr = 0, 0
+    if total > 0:
+        def read(lo, hi):
+            wav, _ = torchaudio.load(audio_path, frame_offset=lo, num_frames=hi - lo)
+            return wav.numpy()
+        return sr, total, read
+
+    # 部分格式无法提前得知长度，只能整首解码后切片
+    wav, sr = torchaudio.load(audio_path)
+    wav = wav.numpy()
+    return sr, wav.shape[1], lambda lo, hi: wav[:, lo:hi]
+
+
+def iter_decoded_segments(audio_path, target_sr=None, channels=2,
+                          segment_seconds=DECODE_SEGMENT_SECONDS,
+                          context_seconds=DECODE_CONTEXT_SECONDS):
+    """
+    逐段解码并重采样原始音频，依次产出 (start, data)，data 形状为 [frames, channels]。
+    首次产出 (sr, total_frames)；帧号以输出采样率计。
+    """
+    sr, total, read = open_audio(audio_path)
+    out_sr = target_sr or sr
+    ratio = out_sr / sr
+    yield out_sr, int(round(total * ratio))
+
+    seg = max(1, int(segment_seconds * sr))
+    ctx = int(context_seconds * sr) if out_sr != sr else 0
+    for start in range(0, total, seg):
+        stop = min(start + seg, total)
+        lo, hi = max(0, start - ctx), min(total, stop + ctx)
+        data = read(lo, hi).T
+        if data.shape[1] < channels:
+            data = np.repeat(data[:, :1], channels, axis=1)
+        elif data.shape[1] > channels:
+            data = data[:, :channels]
+        data = np.ascontiguousarray(data, dtype=np.float32)
+        if out_sr != sr:
+            data = resample_audio(data, sr, out_sr)
+        out_start = int(round(start * ratio))
+        a = out_start - int(round(lo * ratio))
+        b = a + int(round(stop * ratio)) - out_start
+        yield out_start, data[a:b]
+
+
+def decode_progressive(audio_path, target_sr=None, channels=2):
+    """在后台线程中逐段解码原始混音，立即返回 ProgressiveAudio。"""
+    segments = iter_decoded_segments(audio_path, target_sr=target_sr, channels=channels)
+    out_sr, total = next(segments)
+    audio = ProgressiveAudio(total, channels, out_sr)
+
+    def run():
+        try:
+            for start, data in segments:
+                audio.write(start, data)
+        except Exception as e:
+            audio.finish(e)
+            return
+        audio.finish()
+
+    threading.Thread(target=run, daemon=True).start()
+    return audio
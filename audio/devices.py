@@ -0,0 +1,191 @@
+"""音频设备注册表：枚举一次并缓存设备能力，按需或定时在后台刷新。"""
+
+import threading
+
+import sounddevice as sd
+
+_DEFAULT = None
+_DEFAULT_LOCK = threading.Lock()
+
+
+def reinitialize_portaudio():
+    """让 PortAudio 重新扫描音频硬件，成功时返回 True。
+
+    PortAudio 只在初始化时枚举设备，sounddevice 没有公开的重新扫描接口，
+    这里调用它内部的 _terminate/_initialize。所有已打开的音频流都会失效。
+    这两个函数在将来的版本中不存在时不扫描并返回 False，设备列表停留在程序启动时的硬件。
+    """
+    terminate = getattr(sd, "_terminate", None)
+    initialize = getattr(sd, "_initialize", None)
+    if not callable(terminate) or not callable(initialize):
+        return False
+    try:
+        terminate()
+    except Exception:
+        # 未初始化时 terminate 会报错，照常重新初始化
+        pass
+    initialize()
+    return True
+
+
+def default_registry():
+    """返回程序共用的设备注册表，首次调用时枚举设备。"""
+    global _DEFAULT
+    with _DEFAULT_LOCK:
+        if _DEFAULT is None:
+            _DEFAULT = DeviceRegistry()
+        return _DEFAULT
+
+
+class DeviceRegistry:
+    """缓存 sd.query_devices / sd.query_hostapis 的结果及格式探测结论。
+
+    Windows 上 WASAPI/MME 端点较多时每次枚举都很慢；注册表只在 refresh 时枚举，
+    其余查询都读内存中的快照。快照整体替换，读取方无需加锁。
+    """
+
+    def __init__(self):
+        """立即枚举一次设备。"""
+        self.lock = threading.Lock()
+        self._devices = []
+        self._hostapis = []
+        self._defaults = {"input": None, "output": None}
+        # (kind, device, samplerate, channels, dtype) -> 探测时抛出的异常，None 表示支持
+        self._checks = {}
+        self._monitor = None
+        self._stop = threading.Event()
+        self.refresh()
+
+    # ---------- 刷新 ---------- #
+
+    def refresh(self, rescan=False):
+        """重新读取设备列表，列表有变化时返回 True。
+
+        PortAudio 只在初始化时扫描硬件，rescan 为 True 时经 reinitialize_portaudio 重新初始化
+        以发现热插拔的设备；此时所有已打开的音频流都会失效，只能在没有流时使用。
+        """
+        with self.lock:
+            if rescan:
+                reinitialize_portaudio()
+            devices = [dict(d, index=i) for i, d in enumerate(sd.query_devices())]
+            hostapis = [dict(h) for h in sd.query_hostapis()]
+            defaults = {kind: self._resolve_default(kind, devices) for kind in ("input", "output")}
+            changed = (_signature(devices) != _signature(self._devices)
+                       or defaults != self._defaults)
+            self._devices, self._hostapis, self._defaults = devices, hostapis, defaults
+            self._checks = {}
+            return changed
+
+    @staticmethod
+    def _resolve_default(kind, devices):
+        try:
+            info = sd.query_devices(kind=kind)
+        except Exception:
+            return None
+        if "index" in info:
+            return info["index"]
+        # 旧版 sounddevice 不返回编号，按名称和接口匹配
+        for dev in devices:
+            if dev["name"] == info["name"] and dev["hostapi"] == info["hostapi"]:
+                return dev["index"]
+        return None
+
+    def start_monitor(self, interval, on_change=None, refresh=None):
+        """启动后台线程每 interval 秒刷新一次，设备变化时调用 on_change(self)。
+
+        refresh 为无参可调用对象，代替 self.refresh() 执行每次刷新并返回列表是否变化；
+        需要重新扫描硬件时应由音频引擎在其锁内判断并扫描（AudioEngine.refresh_devices_if_idle），
+        默认只刷新缓存的快照。
+        """
+        if self._monitor is not None or not interval:
+            return self
+
+        def run():
+            while not self._stop.wait(interval):
+                try:
+                    changed = refresh() if refresh is not None else self.refresh()
+                    if changed and on_change is not None:
+                        on_change(self)
+                except Exception:
+                    continue
+
+        self._monitor = threading.Thread(target=run, daemon=True)
+        self._monitor.start()
+        return self
+
+    def stop_monitor(self):
+        """停止后台刷新。"""
+        self._stop.set()
+
+    # ---------- 查询 ---------- #
+
+    @property
+    def devices(self):
+        """全部设备的信息字典列表，字段与 sd.query_devices 相同并附带 index。"""
+        return self._devices
+
+    def query(self, device=None, kind=None):
+        """与 sd.query_devices(device, kind) 相同，但只读缓存。
+
+        device 为 None 时返回 kind 的默认设备；设备不存在或不支持 kind 时抛出 ValueError。
+        """
+        devices = self._devices
+        if device is None:
+            device = self._defaults.get(kind) if kind else None
+            if device is None:
+                raise ValueError(f"没有默认的{kind or ''}设备")
+        if not 0 <= device < len(devices):
+            raise ValueError(f"设备 {device} 不存在")
+        info = devices[device]
+        if kind and info[f"max_{kind}_channels"] <= 0:
+            raise ValueError(f"设备 {device} 不是{'输入' if kind == 'input' else '输出'}设备")
+        return info
+
+    def hostapi_name(self, info):
+        """返回设备所属音频接口的名称。"""
+        hostapis = self._hostapis
+        idx = info["hostapi"]
+        return hostapis[idx]["name"] if 0 <= idx < len(hostapis) else ""
+
+    def labels(self, kind):
+        """返回 kind 方向所有设备的 [(界面标签, 编号)]。"""
+        key = f"max_{kind}_channels"
+        return [(f"{dev['index']}: {dev['name']} ({self.hostapi_name(dev)})", dev["index"])
+                for dev in self._devices if dev[key] > 0]
+
+    def default_samplerate(self, device=None, kind="output", fallback=None):
+        """设备的默认采样率，查询失败或数值异常时返回 fallback。"""
+        try:
+            sr = int(self.query(device, kind).get("default_samplerate") or 0)
+        except (ValueError, TypeError):
+            return fallback
+        if sr <= 0 or sr > 192000:
+            return fallback
+        return sr
+
+    def _check(self, kind, device, samplerate, channels, dtype):
+        key = (kind, device, samplerate, channels, dtype)
+        checks = self._checks
+        if key not in checks:
+            check = sd.check_output_settings if kind == "output" else sd.check_input_settings
+            try:
+                check(device=device, samplerate=samplerate, channels=channels, dtype=dtype)
+                checks[key] = None
+            except Exception as e:
+                checks[key] = e
+        error = checks[key]
+        if error is not None:
+            raise error
+
+    def check_output(self, device, samplerate, channels, dtype="float32"):
+        """同 sd.check_output_settings，结论缓存到下次刷新。"""
+        self._check("output", device, samplerate, channels, dtype)
+
+    def check_input(self, device, samplerate, channels, dtype="float32"):
+        """同 sd.check_input_settings，结论缓存到下次刷新。"""
+        self._check("input", device, samplerate, channels, dtype)
+
+
+def _signature(devices):
+    return [(d["name"], d["hostapi"], d["max_input_channels"], d["max_output_channels"])
+            for d in devices]
@@ -0,0 +1,533 @@
+"""常驻的音频输出引擎：整个程序运行期间保持一个输出流，歌曲作为音源挂载与卸载。"""
+
+import collections
+import threading
+import time as _time
+
+import numpy as np
+import sounddevice as sd
+
+from audio.devices import default_registry
+from audio.health import CallbackStats
+from audio.ring_buffer import MicRingBuffer
+from utils.audio_utils import StreamingResampler
+
+
+class AudioEngine:
+    """持有输出流与麦克风流，音频回调把当前音源与麦克风混合后写入声卡。
+
+    切歌只是在回调中替换音源引用，不会重新打开声卡；
+    只有切换设备、采样率或声道数变化时才重开音频流。
+    """
+
+    def __init__(self, output_device=None, mic_device=None, mic_enabled=False,
+                 latency=0.05, duplex=False, blocksize=1024, devices=None):
+        """保存设备设置；音频流在第一次挂载音源时才打开。
+
+        devices 为 DeviceRegistry，省略时使用程序共用的注册表。
+        """
+        self._devices = devices
+        self.output_device = output_device
+        self.mic_device = mic_device
+        self.mic_enabled = mic_enabled
+        self.latency = latency
+        self.duplex = duplex
+        self.blocksize = blocksize
+        self.sample_rate = None
+        self.channels = 2
+        self.stream = None
+        self.duplex_active = False
+        # 暂停或空闲时为重新扫描设备关闭了音频流；恢复播放或开启麦克风时按原格式重开
+        self._suspended = False
+        self.mic_stream = None
+        # 双流模式下麦克风回调写入、输出回调读取的环形缓冲区，start_mic 时创建
+        self.mic_ring = None
+        self.mic_channels = self.channels
+        self.mic_input_sr = None
+        # 麦克风采样率与输出不同时使用的有状态重采样器
+        self._mic_resampler = None
+        self.mic_volume = 1.0
+        # 当前音源，只由音频回调修改；界面线程通过命令队列挂载/卸载
+        self.track = None
+        # 排队的下一首及其与当前歌曲结尾重叠的交叉淡化帧数（0 为无缝衔接）
+        self.next_track = None
+        self._next_fade = 0
+        self._commands = collections.deque()
+        # 麦克风从采集到播出的实测往返延迟（秒，滑动平均），尚未测得时为 None
+        self.round_trip_latency = None
+        # 回调耗时占块时长比例的滑动平均，供后台任务判断是否需要让路
+        self.callback_load = 0.0
+        # 输出与麦克风回调的耗时直方图和欠载/溢出计数，见 health()
+        self.output_stats = CallbackStats()
+        self.mic_stats = CallbackStats()
+        self._scratch = None
+        self._ensure_scratch(self.blocksize)
+        # 只用于串行化设备切换等控制操作，音频回调从不获取此锁
+        self.lock = threading.RLock()
+
+    @property
+    def devices(self):
+        """设备查询与格式探测都读这里的缓存，不再每次枚举声卡。"""
+        if self._devices is None:
+            self._devices = default_registry()
+        return self._devices
+
+    def _ensure_scratch(self, frames):
+        """按块长分配回调用的缓冲区；仅在宿主给出更大的块时重新分配。"""
+        if self._scratch is not None and self._scratch.shape[0] >= frames:
+            return
+        self._scratch = np.zeros((frames, self.channels), dtype=np.float32)
+        # 交叉淡化时下一首的输出及两路等功率增益
+        self._next_scratch = np.zeros((frames, self.channels), dtype=np.float32)
+        # 增益与单声道麦克风都用一维数组逐声道运算：(n, 1) 广播到多声道时 NumPy 会分配中间缓冲区
+        self._gain_out = np.zeros(frames, dtype=np.float32)
+        self._gain_in = np.zeros(frames, dtype=np.float32)
+        self._mic_scratch = np.zeros(frames, dtype=np.float32)
+        self._steps = np.arange(frames, dtype=np.float32)
+
+    # ---------- 音频线程 ---------- #
+
+    def _mic_callback(self, indata, frames, time, status):
+        """把麦克风数据写入环形缓冲区。
+
+        声道数在 start_mic 中已规整为 1 或输出声道数，混音时直接广播，无需复制声道。
+        """
+        start = _time.perf_counter()
+        ring = self.mic_ring
+        if ring is not None:
+            resampler = self._mic_resampler
+            data = resampler.process(indata) if resampler is not None else indata
+            # 附带采集时间，输出端据此测量往返延迟
+            ring.write(data, time.inputBufferAdcTime)
+        self.mic_stats.record(_time.perf_counter() - start, status)
+
+    def _callback(self, outdata, frames, time, status):
+        """主回调：混合当前音源与麦克风数据。"""
+        self._run_block(outdata, frames, time, status, None)
+
+    def _duplex_callback(self, indata, outdata, frames, time, status):
+        """全双工回调：同一块内直接混入麦克风输入，无需排队和重采样。"""
+        self._run_block(outdata, frames, time, status, indata if self.mic_enabled else None)
+
+    def _run_block(self, outdata, frames, time, status, mic):
+        start = _time.perf_counter()
+        try:
+            self._fill(outdata, frames, time, mic)
+        finally:
+            elapsed = _time.perf_counter() - start
+            self.output_stats.record(elapsed, status)
+            load = elapsed * self.sample_rate / frames
+            self.callback_load += 0.05 * (load - self.callback_load)
+
+    def _note_round_trip(self, adc_time, time):
+        """用声卡给出的采集/播出时间戳更新往返延迟；时间戳不可用时忽略。"""
+        if not adc_time or time is None or not time.outputBufferDacTime:
+            return
+        value = time.outputBufferDacTime - adc_time
+        if not 0.0 < value < 1.0:
+            return
+        if self.round_trip_latency is None:
+            self.round_trip_latency = value
+        else:
+            self.round_trip_latency += 0.05 * (value - self.round_trip_latency)
+
+    def _drain_commands(self):
+        """在音频线程中执行挂载/卸载音源及排队下一首的命令。"""
+        commands = self._commands
+        while commands:
+            cmd, track = commands.popleft()
+            if cmd == "attach":
+                self.track = track
+                self.next_track = None
+            elif cmd == "detach" and self.track is track:
+                self.track = None
+                self.next_track = None
+            elif cmd == "queue":
+                current, nxt, fade = track
+                if self.track is current:
+                    self.next_track = nxt
+                    # 淡化不能长于当前歌曲剩余部分，否则开头就会叠加
+                    self._next_fade = min(fade, max(0, current.num_frames - current.position))
+
+    def _fill(self, outdata, frames, time=None, mic=None):
+        """填充一个输出块；只读取快照和命令队列，不等待任何锁。
+
+        mic 为全双工流本块的麦克风输入；为 None 时从双流模式的环形缓冲区中取。
+        """
+        self._drain_commands()
+        self._ensure_scratch(frames)
+        track = self.track
+        if track is None:
+            outdata.fill(0)
+        else:
+            n = track.render(outdata, frames)
+            if not n:
+                outdata.fill(0)
+            elif self.next_track is not None:
+                # 本块起始帧取渲染之后的位置倒推，块首执行过的跳转也已计入
+                self._render_next(outdata, frames, track, track.position - n, n)
+            if not track.playing:
+                # 播放到结尾的音源自动卸载，排队的下一首从同一块内接续，输出流继续运行
+                nxt = self.next_track
+                self.next_track = None
+                self.track = nxt
+                if nxt is not None:
+                    nxt.playing = True
+                    track.successor = nxt
+
+        adc_time = time.inputBufferAdcTime if mic is not None and time is not None else None
+        ring = self.mic_ring
+        if mic is None and self.mic_stream and ring is not None:
+            mic, adc_time = ring.read(frames)
+        if mic is not None:
+            # 不足一块的部分相当于补零，直接只叠加前 n 帧
+            n = min(len(mic), frames)
+            volume = self.mic_volume
+            if mic.shape[1] == 1:
+                # 音量为 1 时直接叠加输入列，省去一次相乘
+                scratch = mic[:n, 0]
+                if volume != 1.0:
+                    scratch = self._mic_scratch[:n]
+                    np.multiply(mic[:n, 0], volume, out=scratch)
+                for c in range(outdata.shape[1]):
+                    column = outdata[:n, c]
+                    np.add(column, scratch, out=column)
+            else:
+                scratch = mic[:n]
+                if volume != 1.0:
+                    scratch = self._scratch[:n]
+                    np.multiply(mic[:n], volume, out=scratch)
+                np.add(outdata[:n], scratch, out=outdata[:n])
+            self._note_round_trip(adc_time, time)
+
+    def _render_next(self, outdata, frames, track, start, n):
+        """在当前歌曲结尾处接入下一首：无淡化时从结束帧起接续，否则按等功率曲线交叉淡化。"""
+        nxt = self.next_track
+        fade = self._next_fade
+        # 本块中下一首开始的偏移：当前歌曲的淡出起点，或无淡化时的结束帧
+        offset = max(0, track.num_frames - fade - start)
+        if offset >= frames:
+            if nxt.position:
+                # 淡化开始前被跳转回去，下一首重新从头开始
+                nxt.position = 0
+            return
+        nxt.playing = True
+        if not fade:
+            if n < frames and not nxt.render(outdata[n:], frames - n):
+                outdata[n:].fill(0)
+            return
+        incoming = self._next_scratch[:frames]
+        incoming[:offset].fill(0)
+        if not nxt.render(incoming[offset:], frames - offset):
+            incoming[offset:].fill(0)
+        # t 从 0 到 1：淡出增益 cos(t·π/2)，淡入增益 sin(t·π/2)，总功率恒定
+        gain_out, gain_in = self._gain_out[:frames], self._gain_in[:frames]
+        np.add(self._steps[:frames], start - (track.num_frames - fade), out=gain_in)
+        np.multiply(gain_in, 0.5 * np.pi / fade, out=gain_in)
+        np.clip(gain_in, 0.0, 0.5 * np.pi, out=gain_in)
+        np.cos(gain_in, out=gain_out)
+        np.sin(gain_in, out=gain_in)
+        for c in range(outdata.shape[1]):
+            out_column, in_column = outdata[:, c], incoming[:, c]
+            np.multiply(out_column, gain_out, out=out_column)
+            np.multiply(in_column, gain_in, out=in_column)
+        np.add(outdata, incoming, out=outdata)
+
+    # ---------- 音源 ---------- #
+
+    def attach(self, track):
+        """开始播放 track；采样率或声道数与当前流不同时先重开音频流。"""
+        with self.lock:
+            if (self.stream is None or track.sample_rate != self.sample_rate
+                    or track.channels != self.channels):
+                self._close_streams()
+                self._commands.clear()
+                self.track = track
+                self.next_track = None
+                self._open(track.sample_rate, track.channels)
+                return
+            self._commands.append(("attach", track))
+
+    def detach(self, track):
+        """停止播放 track（若它仍是当前音源），输出流保持运行。"""
+        self._commands.append(("detach", track))
+
+    def queue_next(self, current, track, crossfade=0):
+        """让 track 在 current 播放结束的那一帧接着播放；track 为 None 时取消排队。
+
+        crossfade 为与 current 结尾重叠的帧数，0 表示无缝衔接。track 须与当前流的
+        采样率和声道数相同；current 已不是当前音源时命令被忽略。
+        """
+        if track is not None and (track.sample_rate != self.sample_rate
+                                  or track.channels != self.channels):
+            raise ValueError("下一首的采样率或声道数与当前输出流不同")
+        self._commands.append(("queue", (current, track, int(crossfade))))
+
+    # ---------- 设备 ---------- #
+
+    def _open(self, sample_rate, channels):
+        """按给定格式打开输出流（及麦克风），设备失效时依次回退。"""
+        self._close_streams()
+        self._suspended = False
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self._scratch = None
+        self._ensure_scratch(self.blocksize)
+        if self.mic_enabled and self.mic_device is not None and self._start_duplex():
+            return
+        try:
+            self._start_output(self.output_device)
+        except Exception:
+            if self.output_device is not None:
+                # 指定设备失效时回退到系统默认设备
+                try:
+                    self._start_output(None)
+                    self.output_device = None
+                except Exception:
+                    self.stream = None
+
+            # 尝试查找可用的输出设备
+            for info in (self.devices.devices if self.stream is None else ()):
+                if info.get("max_output_channels", 0) <= 0:
+                    continue
+                try:
+                    self._start_output(info["index"])
+                    self.output_device = info["index"]
+                    break
+                except Exception:
+                    self.stream = None
+                    continue
+
+            if self.stream is None:
+                self.track = None
+                raise
+        if self.mic_enabled:
+            self.start_mic(allow_duplex=False)
+
+    def _start_output(self, device):
+        self.devices.check_output(device, self.sample_rate, self.channels)
+        stream = sd.OutputStream(
+            samplerate=self.sample_rate,
+            channels=self.channels,
+            blocksize=self.blocksize,
+            dtype="float32",
+            callback=self._callback,
+            latency=self.latency,
+            device=device,
+        )
+        stream.start()
+        self.stream = stream
+
+    def _start_duplex(self):
+        """在麦克风与输出设备上打开一个全双工流，成功返回 True。
+
+        两个设备须属于同一音频接口（如同为 WASAPI），且麦克风支持输出采样率，
+        这样输入可以不经重采样、不经队列直接在同一回调中混音。
+        """
+        if not self.duplex or not self.mic_enabled or self.mic_device is None:
+            return False
+        try:
+            in_info = self.devices.query(self.mic_device, 'input')
+            out_info = self.devices.query(self.output_device, 'output')
+            if in_info['hostapi'] != out_info['hostapi']:
+                return False
+            mic_channels = min(in_info['max_input_channels'], self.channels)
+            if mic_channels != self.channels:
+                mic_channels = 1
+            self.devices.check_input(self.mic_device, self.sample_rate, mic_channels)
+            stream = sd.Stream(
+                samplerate=self.sample_rate,
+                channels=(mic_channels, self.channels),
+                blocksize=self.blocksize,
+                dtype="float32",
+                callback=self._duplex_callback,
+                latency=self.latency,
+                device=(self.mic_device, self.output_device),
+            )
+            stream.start()
+        except Exception:
+            return False
+        self.mic_channels = mic_channels
+        self.mic_input_sr = self.sample_rate
+        self.stream = stream
+        self.duplex_active = True
+        return True
+
+    def _close_streams(self):
+        if self.stream is not None:
+            try:
+                # 使用 abort 立即停止，避免残留音频
+                self.stream.abort()
+            except Exception:
+                self.stream.stop()
+            self.stream.close()
+            self.stream = None
+        self.duplex_active = False
+        self.stop_mic()
+
+    def refresh_devices(self):
+        """重新扫描音频硬件以发现热插拔的设备，设备列表有变化时返回 True。
+
+        PortAudio 重新初始化会使已打开的流失效，因此先关闭音频流，扫描后按原格式重开。
+        """
+        with self.lock:
+            reopen = self.stream is not None
+            self._close_streams()
+            try:
+                return self.devices.refresh(rescan=True)
+            finally:
+                if reopen:
+                    self._open(self.sample_rate, self.channels)
+
+    def refresh_devices_if_idle(self):
+        """供定时刷新使用：输出静音时重新扫描硬件，否则只刷新设备快照。
+
+        流已打开但没有在播放（未挂载音源或已暂停）且没开麦克风时，先关闭音频流再扫描，
+        之后保持关闭，由 resume_output 在恢复播放或开启麦克风时重开，不会每次扫描都重开声卡。
+        正在播放或开着麦克风时不打断输出，新插入的设备要等暂停或手动刷新后才会出现。
+        判断与扫描都在 self.lock 内完成，期间不会有其他线程打开流，扫描也就不会使其失效。
+        """
+        with self.lock:
+            if self.stream is not None or self.mic_stream is not None:
+                track = self.track
+                silent = track is None or track.paused or not track.playing
+                if not silent or self.mic_stream is not None or self.duplex_active:
+                    return self.devices.refresh()
+                self._close_streams()
+                self._suspended = True
+            return self.devices.refresh(rescan=True)
+
+    def resume_output(self):
+        """重开为扫描设备而关闭的音频流；流已打开或从未打开时不做任何事。"""
+        with self.lock:
+            if self._suspended and self.stream is None:
+                self._open(self.sample_rate, self.channels)
+
+    def close(self):
+        """关闭所有音频流，程序退出时调用。"""
+        with self.lock:
+            self.track = None
+            self._close_streams()
+
+    def change_output_device(self, device):
+        """切换到其他输出音频设备；这是除格式变化外唯一会重开输出流的操作。"""
+        with self.lock:
+            self.output_device = device
+            if self.stream is None:
+                return
+            self.round_trip_latency = None
+            try:
+                self._open(self.sample_rate, self.channels)
+            except Exception:
+                self.output_device = None
+                raise
+
+    def start_mic(self, device=None, allow_duplex=True):
+        """开始从指定麦克风采集音频。"""
+        with self.lock:
+            changed = device is not None and device != self.mic_device
+            if device is not None:
+                self.mic_device = device
+            if self._suspended and self.stream is None:
+                # 输出流重开时会按 mic_enabled 一并启动麦克风
+                self.resume_output()
+                return
+            if allow_duplex and self.duplex and self.stream is not None:
+                if self.duplex_active and not changed:
+                    return
+                # 全双工流的输入输出绑定在一起，开启或更换麦克风需要重开整个流
+                self.change_output_device(self.output_device)
+                return
+            if self.mic_stream:
+                self.stop_mic()
+            if self.mic_device is None or self.stream is None:
+                # 输出流打开时会按 mic_enabled 再启动麦克风
+                return
+            try:
+                info = self.devices.query(self.mic_device, 'input')
+                self.mic_channels = min(info['max_input_channels'], self.channels)
+                if self.mic_channels != self.channels:
+                    # 单声道可直接广播到所有输出声道，其他声道组合统一按单声道采集
+                    self.mic_channels = 1
+                target_sr = int(info.get('default_samplerate', self.sample_rate)) or self.sample_rate
+                if target_sr <= 0 or target_sr > 192000:
+                    target_sr = self.sample_rate
+                if target_sr > self.sample_rate:
+                    target_sr = self.sample_rate
+                self.mic_input_sr = target_sr
+                self._mic_resampler = None
+                if target_sr != self.sample_rate:
+                    self._mic_resampler = StreamingResampler(target_sr, self.sample_rate, self.mic_channels)
+                # 目标水位：一个麦克风块 + 一个输出块 + 少量余量，足以吸收两端回调的相位变化
+                mic_block = -(-self.blocksize * self.sample_rate // target_sr)
+                self.mic_ring = MicRingBuffer(
+                    capacity=4 * (mic_block + self.blocksize),
+                    channels=self.mic_channels,
+                    sample_rate=self.sample_rate,
+                    target=mic_block + self.blocksize + 128,
+                    max_block=self.blocksize,
+                )
+                self.mic_stream = sd.InputStream(
+                    device=self.mic_device,
+                    samplerate=self.mic_input_sr,
+                    channels=self.mic_channels,
+                    blocksize=self.blocksize,
+                    dtype='float32',
+                    callback=self._mic_callback,
+                    latency=self.latency
+                )
+                self.mic_stream.start()
+            except Exception:
+                # 麦克风启动失败时禁用功能避免死锁
+                self.mic_stream = None
+                self.mic_ring = None
+                self.mic_enabled = False
+                raise
+
+    def stop_mic(self):
+        """停止麦克风采集并清空缓存。"""
+        with self.lock:
+            if self.mic_stream:
+                self.mic_stream.stop()
+                self.mic_stream.close()
+                self.mic_stream = None
+                self.mic_ring = None
+
+    def set_mic_enabled(self, enabled, device=None):
+        """启用或关闭麦克风输入。"""
+        with self.lock:
+            self.mic_enabled = bool(enabled)
+            if self.mic_enabled:
+                self.start_mic(device or self.mic_device)
+            else:
+                self.stop_mic()
+
+    def set_mic_volume(self, vol):
+        """调整混入的麦克风音量。"""
+        self.mic_volume = float(vol)
+
+    def set_duplex(self, enabled):
+        """切换全双工模式，正在运行且已开启麦克风时立即重开音频流。"""
+        with self.lock:
+            self.duplex = bool(enabled)
+            self.round_trip_latency = None
+            if self.stream is not None and self.mic_enabled:
+                self.change_output_device(self.output_device)
+
+    def health(self):
+        """返回音频回调的健康统计，可直接序列化为 JSON。"""
+        ring = self.mic_ring
+        return {
+            "sample_rate": self.sample_rate,
+            "blocksize": self.blocksize,
+            "duplex": self.duplex_active,
+            # 声卡实际采用的延迟（秒），全双工流为 (输入, 输出)
+            "output_latency": getattr(self.stream, "latency", None),
+            "mic_latency": getattr(self.mic_stream, "latency", None),
+            "callback_load": self.callback_load,
+            "round_trip_ms": (self.round_trip_latency * 1000
+                              if self.round_trip_latency is not None else None),
+            "output": self.output_stats.snapshot(),
+            "mic": self.mic_stats.snapshot(),
+            "mic_ring": ring.stats() if ring is not None else None,
+        }
@@ -0,0 +1,135 @@
+"""将 Demucs 模型导出为 TorchScript 或 ONNX 计算图以减少 eager 调度开销。
+
+导出的文件保存在分离缓存旁的模型目录中，之后的运行直接加载。
+导出结果与 eager 输出的误差超过容差时放弃该后端，调用方回退到 eager。
+"""
+
+import hashlib
+import importlib
+import json
+import os
+
+import torch
+
+# 导出结果与 eager 输出允许的最大绝对误差
+EXPORT_TOLERANCE = 1e-3
+
+
+class ExportedModel(torch.nn.Module):
+    """包装导出的计算图，对 apply_model 暴露与原模型一致的属性。"""
+
+    def __init__(self, runner, eager, length):
+        """runner 接收 [batch, channels, length] 张量并返回各音轨结果。"""
+        super().__init__()
+        self.runner = runner
+        self.sources = list(eager.sources)
+        self.samplerate = eager.samplerate
+        self.audio_channels = eager.audio_channels
+        self.segment = eager.segment
+        self._length = length
+
+    def valid_length(self, length):
+        """导出的计算图只接受固定长度，apply_model 会据此补齐输入。"""
+        return self._length
+
+    def forward(self, mix):
+        return self.runner(mix)
+
+
+def _segment_length(model):
+    return int(float(model.segment) * model.samplerate)
+
+
+def _versions(backend):
+    """影响导出结果的库版本；任一变化都会重新导出并重新校验误差。"""
+    versions = {"torch": torch.__version__}
+    for module in ("demucs",) + (("onnxruntime",) if backend == "onnx" else ()):
+        try:
+            versions[module] = getattr(importlib.import_module(module), "__version__", None)
+        except ImportError:
+            versions[module] = None
+    return versions
+
+
+def _artifact_path(export_dir, name, device, backend, length):
+    versions = json.dumps(_versions(backend), sort_keys=True)
+    tag = hashlib.sha1(versions.encode("utf-8")).hexdigest()[:8]
+    ext = ".onnx" if backend == "onnx" else ".pt"
+    return os.path.join(export_dir, f"{name}-{device}-{length}-{tag}{ext}")
+
+
+def _torchscript_runner(path, eager, example, device):
+    if not os.path.exists(path):
+        traced = torch.jit.trace(eager, example, check_trace=False)
+        traced.save(path)
+    return torch.jit.load(path, map_location=device)
+
+
+def _onnx_runner(path, eager, example, device):
+    import onnxruntime as ort
+
+    if not os.path.exists(path):
+        torch.onnx.export(eager, example, path, opset_version=17,
+                          input_names=["mix"], output_names=["sources"])
+    providers = ["CUDAExecutionProvider"] if device == "cuda" else []
+    session = ort.InferenceSession(path, providers=providers + ["CPUExecutionProvider"])
+
+    def run(mix):
+        out = session.run(None, {"mix": mix.detach().cpu().numpy()})[0]
+        return torch.from_numpy(out).to(mix.device)
+
+    return run
+
+
+def max_abs_diff(eager, exported, example):
+    """在同一输入上比较两种后端输出的最大绝对误差。"""
+    with torch.inference_mode():
+        ref = eager(example)
+        out = exported(example)
+    return float((ref - out).abs().max())
+
+
+def load_exported(eager, name, device, backend, export_dir, tolerance=EXPORT_TOLERANCE):
+    """
+    导出或加载 eager 模型的计算图版本，返回 ExportedModel；
+    不支持、导出失败或误差超出容差时返回 None。
+    """
+    if backend not in ("torchscript", "onnx"):
+        return None
+    if type(eager).__name__ == "BagOfModels":
+        # 只含一个模型的模型包（如 htdemucs）与其中的模型等价，多模型包不导出
+        if len(eager.models) != 1:
+            return None
+        eager = eager.models[0]
+    if not hasattr(eager, "segment") or not hasattr(eager, "samplerate"):
+        return None
+    length = _segment_length(eager)
+    os.makedirs(export_dir, exist_ok=True)
+    path = _artifact_path(export_dir, name, device, backend, length)
+    meta_path = path + ".json"
+    torch.manual_seed(0)
+    example = torch.randn(1, eager.audio_channels, length, device=device)
+    try:
+        build = _onnx_runner if backend == "onnx" else _torchscript_runner
+        runner = build(path, eager, example, device)
+        exported = ExportedModel(runner, eager, length)
+        versions = _versions(backend)
+        meta = None
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        # 没有记录版本（旧版写入）或版本不符的结论不可信，重新比较
+        if meta is None or meta.get("versions") != versions:
+            meta = {"max_abs_diff": max_abs_diff(eager, exported, example),
+                    "tolerance": tolerance, "versions": versions}
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+        diff = meta["max_abs_diff"]
+    except Exception:
+        for p in (path, meta_path):
+            if os.path.exists(p):
+                os.remove(p)
+        return None
+    if diff > tolerance:
+        return None
+    return exported
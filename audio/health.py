@@ -0,0 +1,101 @@
+"""实时音频健康统计：回调耗时直方图、欠载/溢出计数，以及可选的 JSONL 会话日志。"""
+
+import bisect
+import json
+import os
+import threading
+import time
+
+from utils.settings import BASE_DIR
+
+# 回调耗时直方图的桶上界（微秒），最后一个桶收纳更慢的回调
+HISTOGRAM_BOUNDS_US = (25, 50, 100, 200, 400, 800, 1600, 3200, 6400, 12800, 25600)
+_BOUNDS_S = tuple(b / 1e6 for b in HISTOGRAM_BOUNDS_US)
+
+
+def default_log_dir():
+    """返回默认的健康日志目录（位于程序目录下）。"""
+    return os.path.join(BASE_DIR, "audio_health")
+
+
+class CallbackStats:
+    """单个音频回调的统计；record 只做几次整数加法，可在实时线程中调用。"""
+
+    def __init__(self):
+        """创建空的直方图和计数器。"""
+        self.reset()
+
+    def reset(self):
+        """清零所有统计。"""
+        self.histogram = [0] * (len(_BOUNDS_S) + 1)
+        self.blocks = 0
+        self.max_time = 0.0
+        self.underflows = 0
+        self.overflows = 0
+
+    def record(self, elapsed, status):
+        """记录一次回调的耗时（秒）与 PortAudio 状态标志。"""
+        self.histogram[bisect.bisect_left(_BOUNDS_S, elapsed)] += 1
+        self.blocks += 1
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if status:
+            if status.output_underflow or status.input_underflow:
+                self.underflows += 1
+            if status.output_overflow or status.input_overflow:
+                self.overflows += 1
+
+    def snapshot(self):
+        """返回可序列化的统计副本。"""
+        labels = [f"<={b}us" for b in HISTOGRAM_BOUNDS_US] + [f">{HISTOGRAM_BOUNDS_US[-1]}us"]
+        return {
+            "blocks": self.blocks,
+            "max_us": round(self.max_time * 1e6, 1),
+            "underflows": self.underflows,
+            "overflows": self.overflows,
+            "histogram": dict(zip(labels, self.histogram)),
+        }
+
+
+class HealthLogger:
+    """后台线程定期把健康统计追加写入 JSONL 文件，每次运行程序一个文件。
+
+    source 为无参可调用对象，返回要记录的字典；返回 None（例如未在播放）时跳过。
+    """
+
+    def __init__(self, source, path=None, interval=5.0):
+        """path 为空时在默认目录下按开始时间命名。"""
+        if path is None:
+            os.makedirs(default_log_dir(), exist_ok=True)
+            name = time.strftime("session-%Y%m%d-%H%M%S.jsonl")
+            path = os.path.join(default_log_dir(), name)
+        self.source = source
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """开始记录。"""
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """写入最后一条记录后停止。"""
+        self._stop.set()
+
+    def _write(self):
+        try:
+            data = self.source()
+        except Exception:
+            return
+        if data is None:
+            return
+        record = {"time": time.time(), **data}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self._write()
+        self._write()
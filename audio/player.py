@@ -1,284 +1,255 @@
-"""简单的音频播放引擎，支持混入麦克风声音。"""
-import sounddevice as sd
-import numpy as np
-import threading
+"""单首歌曲的播放状态，作为音源挂载到常驻的 AudioEngine 上播放。"""
 import collections
-from utils.audio_utils import resample_audio
+
+import numpy as np
+
+from audio.engine import AudioEngine
+from utils.audio_utils import sample_scale
+
+# 音频线程每块读取一次的音量快照；UI 线程整体替换而不是逐项修改
+MixParams = collections.namedtuple("MixParams", "vocal accomp")
+
+
+def _scale_into(out, data, gain):
+    """out = data * gain，不分配临时数组。
+
+    紧凑存储的数据先按类型转换复制到 out 再就地相乘：在 ufunc 中直接转换类型
+    会为每块分配转换缓冲区，copyto 不会。
+    """
+    if data.dtype != np.float32:
+        np.copyto(out, data, casting="unsafe")
+        data = out
+    elif gain == 1.0:
+        np.copyto(out, data)
+    if gain != 1.0:
+        np.multiply(data, np.float32(gain), out=out)
+
 
 class AudioPlayer:
-    """播放分离后的人声和伴奏，可选择混入麦克风。"""
+    """播放分离后的人声和伴奏；输出流和麦克风由 engine 管理。"""
+
+    def __init__(self, vocals, accomp, sample_rate, output_device=None, mic_device=None, mic_enabled=False, latency=0.05, progress=None, duplex=False, engine=None):
+        """初始化播放器并保存音频数据。
 
-    def __init__(self, vocals, accomp, sample_rate, output_device=None, mic_device=None, mic_enabled=False, latency=0.05):
-        """初始化播放器并保存音频数据及设备设置。"""
+        progress 为可选的 ProgressiveStems：分离尚未完成时只播放已就绪的部分。
+        accomp 为 None 时 vocals 视为原始混音，按原音量播放，之后可用 swap_sources 切换。
+        engine 为程序共用的 AudioEngine；为 None 时按设备参数创建一个独立的引擎，
+        此时 duplex 为 True 表示优先用一个全双工流同时采集麦克风和输出。
+        """
+        if engine is None:
+            engine = AudioEngine(output_device=output_device, mic_device=mic_device,
+                                 mic_enabled=mic_enabled, latency=latency, duplex=duplex)
+        self.engine = engine
         self.vocals = vocals
         self.accomp = accomp
-        self.mic_input_sr = sample_rate
+        self.progress = progress
         self.sample_rate = sample_rate
 
-        self.num_frames = min(len(vocals), len(accomp))
+        self.num_frames = len(vocals) if accomp is None else min(len(vocals), len(accomp))
         self.channels = vocals.shape[1]
         self.position = 0
-        self.blocksize = 1024
         self.vocal_volume = 1.0
         self.accomp_volume = 1.0
-        self.mic_volume = 1.0
+        self.params = MixParams(1.0, 1.0)
         self.playing = False
+        # 引擎在本曲结束时无缝接续的下一首，由音频线程在切换的那一块设置
+        self.successor = None
+        # paused 反映界面请求的状态，回调按命令队列中的顺序生效
         self.paused = False
-        self.stream = None
-        self.mic_stream = None
-        self.mic_queue = collections.deque()
-        self.mic_channels = self.channels
-        self.output_device = output_device
-        self.mic_device = mic_device
-        self.mic_enabled = mic_enabled
-        self.latency = latency
-        # 使用可重入锁，允许回调中嵌套调用
-        self.lock = threading.RLock()
-
-    def _mic_callback(self, indata, frames, time, status):
-        """处理麦克风音频并放入队列以供混音。"""
-        with self.lock:
-            data = indata.copy()
-            if self.mic_input_sr != self.sample_rate:
-                data = resample_audio(data, self.mic_input_sr, self.sample_rate)
-            if data.shape[1] == 1 and self.channels > 1:
-                data = np.repeat(data, self.channels, axis=1)
-            elif data.shape[1] > self.channels:
-                data = data[:, :self.channels]
-            self.mic_queue.append(data)
-            if len(self.mic_queue) > 5:
-                self.mic_queue.popleft()
-
-    def _callback(self, outdata, frames, time, status):
-        """主回调：混合人声、伴奏与麦克风数据。"""
-        with self.lock:
-            if not self.playing or self.paused:
-                outdata[:] = np.zeros((frames, self.channels), dtype='float32')
-                return
-
-            end = self.position + frames
-            if end >= self.num_frames:
-                self.playing = False
-                outdata[:] = np.zeros((frames, self.channels), dtype='float32')
-                raise sd.CallbackStop()
-
-            v_block = self.vocals[self.position:end]
-            a_block = self.accomp[self.position:end]
-            mixed = self.accomp_volume * a_block + self.vocal_volume * v_block
-
-            if self.mic_stream and self.mic_queue:
-                mic_block = self.mic_queue.popleft()
-                if mic_block.shape[0] < frames:
-                    pad = np.zeros((frames - mic_block.shape[0], self.channels), dtype='float32')
-                    mic_block = np.concatenate([mic_block, pad], axis=0)
-                if mic_block.shape[1] < self.channels:
-                    mic_block = np.repeat(mic_block, self.channels, axis=1)
-                elif mic_block.shape[1] > self.channels:
-                    mic_block = mic_block[:, :self.channels]
-                mixed += self.mic_volume * mic_block[:frames]
-
-            outdata[:len(mixed)] = mixed
-            self.position = end
+        self._paused = False
+        # 单生产者/单消费者命令队列：UI 线程追加，回调在块开始时取出执行
+        self._commands = collections.deque()
+        # 热切换：待切换的 (vocals, accomp, progress) 及交叉淡化进度
+        self._pending = None
+        self._xfade_len = 0
+        self._xfade_pos = 0
+        # 回调中使用的预分配缓冲区，避免实时线程每块都申请内存
+        self._scratch = None
+        self._mix_scratch = None
+        self._gain = None
+        self._ramp = None
+        self._ensure_scratch(engine.blocksize)
+
+    def _ensure_scratch(self, frames):
+        """按块长分配回调用的缓冲区；仅在宿主给出更大的块时重新分配。"""
+        if self._scratch is not None and self._scratch.shape[0] >= frames:
+            return
+        self._scratch = np.zeros((frames, self.channels), dtype=np.float32)
+        self._mix_scratch = np.zeros((frames, self.channels), dtype=np.float32)
+        # 一维增益逐声道相乘，避免广播时分配中间缓冲区
+        self._gain = np.zeros(frames, dtype=np.float32)
+        self._ramp = np.arange(frames, dtype=np.float32)
+
+    # ---------- 音频线程 ---------- #
+
+    def _drain_commands(self):
+        """在音频线程中依次执行界面发来的控制命令。"""
+        commands = self._commands
+        while commands:
+            cmd, arg = commands.popleft()
+            if cmd == "seek":
+                progress = self._active_progress()
+                if progress is not None:
+                    arg = progress.seek_target(arg)
+                self.position = arg
+            elif cmd == "pause":
+                self._paused = arg
+            elif cmd == "swap":
+                self._pending, self._xfade_len = arg
+                self._xfade_pos = 0
+
+    def _active_progress(self):
+        """返回限制跳转与输出的进度对象；数据已完整时返回 None。
+
+        热切换进行中以待切换的数据为准：淡化结束后由它接管播放，
+        旧数据尚未解码的部分是零，只在淡化的 0.1 秒内以渐弱的静音参与混合。
+        """
+        progress = self._pending[2] if self._pending is not None else self.progress
+        if progress is None or progress.finished:
+            return None
+        return progress
+
+    def render(self, outdata, frames):
+        """由引擎回调调用，把本块写入 outdata 并返回写入的帧数；返回 0 时不写入。
+
+        播放到结尾时写出剩余部分、其余补零，并把 playing 置为 False，
+        引擎据此在同一块内接上排队的下一首。
+        """
+        self._drain_commands()
+        if not self.playing or self._paused:
+            return 0
+
+        end = min(self.position + frames, self.num_frames)
+        progress = self._active_progress()
+        if progress is not None and not progress.covers(self.position, end):
+            # 分离或解码尚未追上播放位置，输出静音等待
+            return 0
+
+        n = end - self.position
+        if n <= 0:
+            self.playing = False
+            return 0
+        params = self.params
+        self._ensure_scratch(frames)
+        out = outdata[:n]
+        self._mix_into(out, self.vocals, self.accomp, self.position, end, params)
+        if self._pending is not None:
+            self._crossfade(out, self.position, end, params)
+        if n < frames:
+            outdata[n:].fill(0)
+        self.position = end
+        if end >= self.num_frames:
+            self.playing = False
+        return n
+
+    def _mix_into(self, out, vocals, accomp, start, end, params):
+        """按当前音量把一段人声与伴奏混合写入 out；accomp 为 None 时直接复制原始混音。
+
+        int16/float16 紧凑存储的数据把还原系数并入增益，只有本块在相乘时转换为 float32。
+        """
+        if accomp is None:
+            _scale_into(out, vocals[start:end], sample_scale(vocals))
+            return
+        scratch = self._scratch[:len(out)]
+        _scale_into(out, accomp[start:end], params.accomp * sample_scale(accomp))
+        _scale_into(scratch, vocals[start:end], params.vocal * sample_scale(vocals))
+        np.add(out, scratch, out=out)
+
+    def _crossfade(self, out, start, end, params):
+        """把旧数据与待切换数据按线性增益交叉淡化，淡化结束后完成切换。"""
+        vocals, accomp, progress = self._pending
+        n = len(out)
+        incoming = self._mix_scratch[:n]
+        self._mix_into(incoming, vocals, accomp, start, end, params)
+        # out += (incoming - out) * gain，gain 从 0 线性升到 1
+        gain = self._gain[:n]
+        np.add(self._ramp[:n], self._xfade_pos, out=gain)
+        np.multiply(gain, 1.0 / self._xfade_len, out=gain)
+        np.clip(gain, 0.0, 1.0, out=gain)
+        np.subtract(incoming, out, out=incoming)
+        for c in range(incoming.shape[1]):
+            column = incoming[:, c]
+            np.multiply(column, gain, out=column)
+        np.add(out, incoming, out=out)
+        self._xfade_pos += n
+        if self._xfade_pos >= self._xfade_len:
+            # 切换时已完整的数据不再保留进度对象，之后的跳转不再受限
+            if progress is not None and progress.finished:
+                progress = None
+            self.vocals, self.accomp, self.progress = vocals, accomp, progress
+            self.num_frames = min(len(vocals), len(accomp))
+            self._pending = None
+
+    # ---------- 界面线程 ---------- #
+
+    def swap_sources(self, vocals, accomp, progress=None, crossfade=0.1):
+        """在当前播放位置切换到新的人声/伴奏数据，并做短暂交叉淡化。
+
+        新数据必须与当前数据采样率相同、时间轴对齐。
+        """
+        xfade_len = max(1, int(crossfade * self.sample_rate))
+        self._commands.append(("swap", ((vocals, accomp, progress), xfade_len)))
+
+    def _rewind(self):
+        self._commands.clear()
+        self.successor = None
+        self.paused = False
+        self._paused = False
+        self.position = 0
 
     def play(self):
-        """从头开始播放音频。"""
+        """从头开始播放音频；引擎的输出流已打开且格式相同时不会重开声卡。"""
         if self.playing:
             return
+        self._rewind()
         self.playing = True
-        self.paused = False
-        self.position = 0
-        if self.mic_enabled and self.mic_device is not None:
-            self.start_mic(self.mic_device)
         try:
-            sd.check_output_settings(device=self.output_device,
-                                    samplerate=self.sample_rate,
-                                    channels=self.channels,
-                                    dtype="float32")
-            self.stream = sd.OutputStream(
-                samplerate=self.sample_rate,
-                channels=self.channels,
-                blocksize=self.blocksize,
-                dtype="float32",
-                callback=self._callback,
-                latency=self.latency,
-                device=self.output_device,
-            )
-            self.stream.start()
+            self.engine.attach(self)
         except Exception:
-            if self.output_device is not None:
-                # 指定设备失效时回退到系统默认设备
-                self.output_device = None
-                try:
-                    sd.check_output_settings(device=None,
-                                            samplerate=self.sample_rate,
-                                            channels=self.channels,
-                                            dtype="float32")
-                    self.stream = sd.OutputStream(
-                        samplerate=self.sample_rate,
-                        channels=self.channels,
-                        blocksize=self.blocksize,
-                        dtype="float32",
-                        callback=self._callback,
-                        latency=self.latency,
-                        device=self.output_device,
-                    )
-                    self.stream.start()
-                    return
-                except Exception:
-                    self.stream = None
-                    
-            # 尝试查找可用的输出设备
-            for idx, info in enumerate(sd.query_devices()):
-                if info.get("max_output_channels", 0) <= 0:
-                    continue
-                try:
-                    sd.check_output_settings(device=idx,
-                                            samplerate=self.sample_rate,
-                                            channels=self.channels,
-                                            dtype="float32")
-                    self.stream = sd.OutputStream(
-                        samplerate=self.sample_rate,
-                        channels=self.channels,
-                        blocksize=self.blocksize,
-                        dtype="float32",
-                        callback=self._callback,
-                        latency=self.latency,
-                        device=idx,
-                    )
-                    self.stream.start()
-                    self.output_device = idx
-                    break
-                except Exception:
-                    self.stream = None
-                    continue
-
-            if self.stream is None:
-                self.playing = False
-                self.stop_mic()
-                raise
+            self.playing = False
+            raise
+
+    def queue_next(self, track, crossfade=0.0):
+        """让 track 在本曲结束的那一帧开始播放，可选 crossfade 秒的等功率交叉淡化。
+
+        切换在音频回调中完成，无需轮询；切换后 self.successor 指向 track。
+        track 为 None 时取消已排队的下一首。
+        """
+        if track is not None:
+            track._rewind()
+            track.playing = False
+        self.engine.queue_next(self, track, int(crossfade * self.sample_rate))
 
     def pause(self):
         """暂停播放并保留当前位置。"""
-        with self.lock:
-            self.paused = True
+        self.paused = True
+        self._commands.append(("pause", True))
 
     def resume(self):
-        """在暂停后继续播放。"""
-        with self.lock:
-            self.paused = False
+        """在暂停后继续播放；暂停期间音频流为扫描设备被关闭时先重开。"""
+        self.paused = False
+        self._commands.append(("pause", False))
+        self.engine.resume_output()
 
     def stop(self):
-        """停止播放并重置所有状态。"""
+        """停止播放并从引擎上卸载；输出流保持打开供下一首使用。"""
+        self.engine.detach(self)
         self.playing = False
         self.paused = False
-        if self.stream:
-            try:
-                # 使用 abort 立即停止播放，避免残留音频
-                self.stream.abort()
-            except Exception:
-                # abort 不可用时退回到 stop
-                self.stream.stop()
-            self.stream.close()
-            self.stream = None
-            try:
-                # 清空缓冲区，保证完全停止
-                sd.stop()
-            except Exception:
-                pass
-        if self.mic_stream:
-            self.stop_mic()
+
+    def _publish_params(self):
+        # 整体替换引用是原子的，回调总能看到一组一致的音量
+        self.params = MixParams(self.vocal_volume, self.accomp_volume)
 
     def set_vocal_volume(self, vol):
         """设置人声轨道的音量。"""
-        with self.lock:
-            self.vocal_volume = float(vol)
+        self.vocal_volume = float(vol)
+        self._publish_params()
 
     def set_accomp_volume(self, vol):
         """设置伴奏轨道的音量。"""
-        with self.lock:
-            self.accomp_volume = float(vol)
-
-    def set_mic_volume(self, vol):
-        """调整混入的麦克风音量。"""
-        with self.lock:
-            self.mic_volume = float(vol)
-
-    def change_output_device(self, device):
-        """切换到其他输出音频设备。"""
-        with self.lock:
-            self.output_device = device
-            if self.stream:
-                was_running = self.playing or self.paused
-                self.stream.stop()
-                self.stream.close()
-                try:
-                    self.stream = sd.OutputStream(
-                        samplerate=self.sample_rate,
-                        channels=self.channels,
-                        blocksize=self.blocksize,
-                        dtype="float32",
-                        callback=self._callback,
-                        latency=self.latency,
-                        device=self.output_device
-                    )
-                    if was_running:
-                        self.stream.start()
-                except Exception:
-                    self.stream = None
-                    self.output_device = None
-                    raise
-
-    def start_mic(self, device=None):
-        """开始从指定麦克风采集音频。"""
-        with self.lock:
-            if device is not None:
-                self.mic_device = device
-            if self.mic_stream:
-                self.stop_mic()
-            if self.mic_device is None:
-                return
-            try:
-                info = sd.query_devices(self.mic_device, 'input')
-                self.mic_channels = min(info['max_input_channels'], self.channels)
-                target_sr = int(info.get('default_samplerate', self.sample_rate)) or self.sample_rate
-                if target_sr <= 0 or target_sr > 192000:
-                    target_sr = self.sample_rate
-                if target_sr > self.sample_rate:
-                    target_sr = self.sample_rate
-                self.mic_input_sr = target_sr
-                self.mic_stream = sd.InputStream(
-                    device=self.mic_device,
-                    samplerate=self.mic_input_sr,
-                    channels=self.mic_channels,
-                    blocksize=self.blocksize,
-                    dtype='float32',
-                    callback=self._mic_callback,
-                    latency=self.latency
-                )
-                self.mic_stream.start()
-            except Exception:
-                # 麦克风启动失败时禁用功能避免死锁
-                self.mic_stream = None
-                self.mic_enabled = False
-                raise
-
-    def stop_mic(self):
-        """停止麦克风采集并清空缓存。"""
-        with self.lock:
-            if self.mic_stream:
-                self.mic_stream.stop()
-                self.mic_stream.close()
-                self.mic_stream = None
-                self.mic_queue.clear()
-
-    def set_mic_enabled(self, enabled, device=None):
-        """启用或关闭麦克风输入。"""
-        with self.lock:
-            self.mic_enabled = bool(enabled)
-            if self.mic_enabled:
-                self.start_mic(device or self.mic_device)
-            else:
-                self.stop_mic()
+        self.accomp_volume = float(vol)
+        self._publish_params()
 
     def get_progress(self):
         """返回播放进度，范围 0 到 1。"""
@@ -287,8 +258,46 @@ class AudioPlayer:
     def get_current_time(self):
         """获取当前已播放时间（秒）。"""
         return self.position / self.sample_rate
-    
+
     def seek_to(self, percent):
-        """跳转到指定百分比的位置。"""
-        with self.lock:
-            self.position = int(self.num_frames * percent)
+        """跳转到指定百分比的位置；由音频回调在下一块开始时生效。"""
+        target = int(self.num_frames * percent)
+        if not self.playing:
+            self.position = target
+            return
+        self._commands.append(("seek", target))
+
+    # ---------- 转交给引擎的设备与麦克风操作 ---------- #
+
+    @property
+    def output_device(self):
+        """引擎当前使用的输出设备（回退后可能与请求的不同）。"""
+        return self.engine.output_device
+
+    @property
+    def duplex_active(self):
+        return self.engine.duplex_active
+
+    @property
+    def round_trip_latency(self):
+        return self.engine.round_trip_latency
+
+    @property
+    def callback_load(self):
+        return self.engine.callback_load
+
+    def set_mic_volume(self, vol):
+        """调整混入的麦克风音量。"""
+        self.engine.set_mic_volume(vol)
+
+    def set_mic_enabled(self, enabled, device=None):
+        """启用或关闭麦克风输入。"""
+        self.engine.set_mic_enabled(enabled, device)
+
+    def change_output_device(self, device):
+        """切换到其他输出音频设备。"""
+        self.engine.change_output_device(device)
+
+    def health(self):
+        """返回音频回调的健康统计，可直接序列化为 JSON。"""
+        return self.engine.health()
@@ -0,0 +1,111 @@
+"""预取规划：按待播列表、播放模式和收听历史预测接下来的几首，并统计预取命中率。"""
+
+import random
+import threading
+
+# 随机模式下，最近播放过的这么多首（不超过曲库的一半）不会再被抽到
+SHUFFLE_AVOID_RECENT = 20
+# 命中率按切歌方式分别统计：自动接续、手动下一首、手动上一首
+SWITCH_KINDS = ("auto", "next", "prev")
+
+
+class PrefetchPlanner:
+    """预测接下来 depth 首歌曲的路径，并维护随机模式预先抽好的播放顺序。
+
+    随机模式不在切歌时临时抽签：预取和实际切歌读取同一份计划，
+    因此预取好的歌曲就是接下来真正播放的歌曲。
+    """
+
+    def __init__(self, depth=3):
+        """depth 为预测的歌曲数（含紧接着的下一首），至少为 1。"""
+        self.depth = max(1, int(depth))
+        self.lock = threading.Lock()
+        self._shuffle = []
+        # 切歌方式 -> [命中次数, 未命中次数]
+        self._counts = {kind: [0, 0] for kind in SWITCH_KINDS}
+
+    # ---------- 预测 ---------- #
+
+    def predict(self, files, current, mode, queue=(), history=(), depth=None):
+        """按播放优先级返回接下来的最多 depth 首路径，不含当前歌曲。
+
+        files 为曲库路径列表，current 为当前路径，queue 为待播列表，
+        history 为播放历史路径（从旧到新）；mode 为“顺序”“循环”或“随机”。
+        """
+        depth = depth or self.depth
+        available = set(files)
+        plan = [path for path in queue if path in available][:depth]
+        if len(plan) < depth and files:
+            # 待播列表放完后按播放模式从最后一首接着往下排
+            anchor = plan[-1] if plan else current
+            # 当前歌曲放完才写入历史，随机补抽时同样要避开它
+            recent = list(history) + [current]
+            plan.extend(self._by_mode(files, anchor, current, mode, recent, depth - len(plan), plan))
+        return plan
+
+    def _by_mode(self, files, anchor, current, mode, history, count, taken):
+        try:
+            start = files.index(anchor)
+        except ValueError:
+            start = -1
+        if mode == "顺序":
+            return files[start + 1:start + 1 + count]
+        if mode == "循环":
+            n = len(files)
+            return [files[(start + k) % n] for k in range(1, min(count, n - 1 if n > 1 else 1) + 1)]
+        if mode == "随机":
+            # 随机计划与待播列表无关，只排除正在播放的歌曲；传入 anchor 会把待播列表的
+            # 最后一首从计划中删掉
+            return [p for p in self.shuffle_plan(files, current, history, count + len(taken))
+                    if p not in taken][:count]
+        return []
+
+    def shuffle_plan(self, files, current, history=(), count=1):
+        """返回随机模式接下来的 count 首，不足时从未近期播放过的歌曲中补抽。"""
+        with self.lock:
+            available = set(files)
+            plan = [p for p in self._shuffle if p in available and p != current]
+            if len(plan) < count:
+                recent = list(history)[-min(SHUFFLE_AVOID_RECENT, len(files) // 2):] if files else []
+                avoid = set(recent) | set(plan) | {current}
+                candidates = [p for p in files if p not in avoid]
+                if not candidates:
+                    # 曲库太小时放宽为只排除当前歌曲
+                    candidates = [p for p in files if p != current and p not in plan] or list(files)
+                random.shuffle(candidates)
+                plan.extend(candidates[:count - len(plan)])
+            self._shuffle = plan
+            return plan[:count]
+
+    def advance(self, path):
+        """歌曲开始播放后调用，把它从随机计划中移除。"""
+        with self.lock:
+            if path in self._shuffle:
+                self._shuffle.remove(path)
+
+    def reset(self):
+        """清空随机计划，例如曲库或播放模式改变后。"""
+        with self.lock:
+            self._shuffle = []
+
+    # ---------- 命中率 ---------- #
+
+    def record(self, kind, hit):
+        """记录一次切歌时数据是否已预取好。"""
+        counts = self._counts[kind]
+        counts[0 if hit else 1] += 1
+
+    def hit_rate(self):
+        """所有切歌方式合计的命中率，尚无记录时返回 None。"""
+        hits = sum(c[0] for c in self._counts.values())
+        total = hits + sum(c[1] for c in self._counts.values())
+        return hits / total if total else None
+
+    def stats(self):
+        """返回可直接序列化的命中率统计。"""
+        report = {"depth": self.depth}
+        for kind, (hits, misses) in self._counts.items():
+            total = hits + misses
+            report[kind] = {"hits": hits, "misses": misses,
+                            "hit_rate": round(hits / total, 3) if total else None}
+        return report
@@ -0,0 +1,187 @@
+"""麦克风回调与输出回调之间的环形缓冲区，带时钟漂移补偿。"""
+
+import math
+
+import numpy as np
+
+# 为跟踪漂移而允许的最大读取速率偏差（0.5%，远大于实际声卡时钟误差）
+MAX_RATIO_DEVIATION = 0.005
+# 用约 2 秒把缓冲水位拉回目标值，调整足够慢，听不出音高变化
+DRIFT_CORRECTION_SECONDS = 2.0
+
+
+class MicRingBuffer:
+    """单生产者/单消费者的样本级环形缓冲区。
+
+    麦克风回调调用 write，输出回调调用 read。两端各自只修改自己的计数器，
+    无需加锁。读取端按缓冲水位微调读取速率（线性插值的分数重采样），
+    使两个声卡时钟的漂移不会让延迟越积越大或出现断续。
+    """
+
+    def __init__(self, capacity, channels, sample_rate, target, max_block=4096):
+        """capacity 与 target 均以帧计；max_block 为单次读取的最大帧数，应取输出流的块长。
+
+        读取端的工作数组在这里一次分配好，read 在音频线程中从不重新分配。
+        """
+        self.capacity = int(capacity)
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.target = int(target)
+        # 单调递增的写入/读取帧数，生产者只改 _written，消费者只改 _read
+        self._written = 0
+        self._read = 0
+        # 最近一次写入块的 (起始帧号, 采集时间)，用于换算读取位置的采集时间
+        self._stamp = (0, 0.0)
+        self._frac = 0.0
+        self._fill_avg = float(self.target)
+        self._priming = True
+        self.ratio = 1.0
+        self.overruns = 0
+        self.overrun_frames = 0
+        self.underruns = 0
+        self.resyncs = 0
+        self.max_fill = 0
+        self.max_block = int(max_block)
+        # 缓冲区末尾镜像开头的 guard 帧，读取跨越边界时也是连续下标，无需逐点取模
+        # 单次读取不会超过缓冲的帧数，guard 不必大于容量
+        self._guard = min(self.capacity, int(max_block * (1 + MAX_RATIO_DEVIATION)) + 2)
+        self._buf = np.zeros((self.capacity + self._guard, channels), dtype=np.float32)
+        self._steps = np.arange(max_block, dtype=np.float32)
+        self._out = np.zeros((max_block, channels), dtype=np.float32)
+        # 每帧读取位置扣掉整数偏移后的小数部分，即插值权重
+        self._weight = np.zeros(max_block, dtype=np.float32)
+
+    @property
+    def fill(self):
+        """当前缓冲的帧数。"""
+        return self._written - self._read
+
+    def write(self, data, adc_time=0.0):
+        """写入一块 [frames, channels] 数据；空间不足时丢弃放不下的部分并计为溢出。"""
+        n = len(data)
+        space = self.capacity - (self._written - self._read)
+        if n > space:
+            self.overruns += 1
+            self.overrun_frames += n - space
+            n = space
+            if n <= 0:
+                return
+        cap = self.capacity
+        start = self._written % cap
+        first = min(n, cap - start)
+        self._buf[start:start + first] = data[:first]
+        if first < n:
+            self._buf[:n - first] = data[first:n]
+        if start < self._guard or first < n:
+            self._buf[cap:] = self._buf[:self._guard]
+        self._stamp = (self._written, adc_time)
+        self._written += n
+
+    def capture_time(self, frame):
+        """估算第 frame 帧的采集时间；声卡未提供时间戳时返回 0。"""
+        start, adc_time = self._stamp
+        if not adc_time:
+            return 0.0
+        return adc_time + (frame - start) / self.sample_rate
+
+    def read(self, frames):
+        """读取 frames 帧，返回预分配数组的视图（下次读取前有效）和首帧采集时间。
+
+        frames 超过 max_block 时只读取 max_block 帧，调用方按返回的长度混入。
+        数据不足时返回 None 并计为欠载，之后等水位回到目标值再恢复输出。
+        """
+        frames = min(frames, self.max_block)
+        fill = self._written - self._read
+        if self._priming:
+            if fill < self.target:
+                return None, 0.0
+            self._priming = False
+            self._fill_avg = float(fill)
+        if fill > self.target + 4 * frames + self.capacity // 4:
+            # 长时间卡顿后积压过多，直接丢弃到目标水位，避免延迟一直偏大
+            self._read = self._written - self.target
+            self._frac = 0.0
+            self.resyncs += 1
+            fill = self.target
+        if fill > self.max_fill:
+            self.max_fill = fill
+        self._fill_avg += 0.01 * (fill - self._fill_avg)
+        error = (self._fill_avg - self.target) / (DRIFT_CORRECTION_SECONDS * self.sample_rate)
+        self.ratio = 1.0 + max(-MAX_RATIO_DEVIATION, min(MAX_RATIO_DEVIATION, error))
+
+        end = self._frac + frames * self.ratio
+        needed = int(end) + 1
+        if needed > fill:
+            self.underruns += 1
+            self._priming = True
+            return None, 0.0
+
+        # 第 k 帧读取 base + k + frac + k·eps 处的样本。|eps| 不超过 0.5%，
+        # 整数偏移 floor(frac + k·eps) 在一块内只变化几次：按偏移把整块分成几段，
+        # 每段直接在缓冲区的连续切片上插值，不需要逐帧的下标数组
+        eps = self.ratio - 1.0
+        frac = self._frac
+        base = self._read % self.capacity
+        out = self._out[:frames]
+        buf = self._buf
+        if eps == 0.0 and frac == 0.0:
+            # 水位正好在目标值且读取位置在整数帧上：无需插值，直接复制
+            np.copyto(out, buf[base:base + frames])
+            return self._advance(end, out)
+        weight = self._weight[:frames]
+        if eps == 0.0:
+            weight.fill(frac)
+        else:
+            np.multiply(self._steps[:frames], eps, out=weight)
+            np.add(weight, frac, out=weight)
+        k0 = 0
+        while k0 < frames:
+            offset = math.floor(frac + k0 * eps)
+            if eps > 0:
+                k1 = math.ceil((offset + 1 - frac) / eps)
+            elif eps < 0:
+                k1 = math.floor((offset - frac) / eps) + 1
+            else:
+                k1 = frames
+            k1 = min(max(k1, k0 + 1), frames)
+            w = weight[k0:k1]
+            if offset:
+                np.subtract(w, offset, out=w)
+            # 下标已落在 [0, capacity + guard) 内：k + offset 不小于 0，且不超过 end
+            src = base + k0 + offset
+            cur, nxt = buf[src:src + k1 - k0], buf[src + 1:src + 1 + k1 - k0]
+            # cur + (nxt - cur) * w；逐声道运算，(n, 1) 广播到多列会分配中间缓冲区
+            for c in range(self.channels):
+                column = out[k0:k1, c]
+                np.subtract(nxt[:, c], cur[:, c], out=column)
+                np.multiply(column, w, out=column)
+                np.add(column, cur[:, c], out=column)
+            k0 = k1
+        return self._advance(end, out)
+
+    def _advance(self, end, out):
+        """读取位置前进到 end（相对当前读取帧的分数位置），返回 (out, 首帧采集时间)。"""
+        adc_time = self.capture_time(self._read + self._frac)
+        consumed = int(end)
+        self._frac = end - consumed
+        self._read += consumed
+        return out, adc_time
+
+    def reset(self):
+        """清空缓冲区并重新进入预充状态（仅在两端都停止时调用）。"""
+        self._read = self._written
+        self._frac = 0.0
+        self._priming = True
+
+    def stats(self):
+        """返回水位与溢出/欠载计数。"""
+        return {
+            "fill": self.fill,
+            "max_fill": self.max_fill,
+            "target": self.target,
+            "ratio": self.ratio,
+            "overruns": self.overruns,
+            "overrun_frames": self.overrun_frames,
+            "underruns": self.underruns,
+            "resyncs": self.resyncs,
+        }
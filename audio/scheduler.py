@@ -0,0 +1,234 @@
+"""统一调度所有分离任务：单线程按优先级逐段推理，支持中途取消。"""
+
+import itertools
+import threading
+
+from audio.separator import (
+    iter_separated_segments,
+    load_cached_converted,
+    open_cached_stream,
+    store_cached,
+)
+from audio.stream_buffer import ProgressiveStems
+
+# 数值越小优先级越高
+PRIORITY_CURRENT = 0
+PRIORITY_NEXT = 1
+PRIORITY_PREV = 2
+# 预取计划中下一首之后的歌曲
+PRIORITY_AHEAD = 3
+PRIORITY_BACKGROUND = 4
+
+
+class SeparationCancelled(Exception):
+    """任务在完成前被取消。"""
+
+
+def job_key(audio_path, device, profile=None, target_sr=None):
+    """相同文件、设备、档位与目标采样率的任务可以合并。"""
+    return (audio_path, device, profile, target_sr)
+
+
+class SeparationJob:
+    """一次分离任务，结果写入 ProgressiveStems，可在段与段之间取消。"""
+
+    def __init__(self, audio_path, device, priority, session_id, target_sr, seq, profile=None):
+        """记录任务参数，真正的解码与推理由调度线程执行。"""
+        self.audio_path = audio_path
+        self.device = device
+        self.profile = profile
+        self.priority = priority
+        self.session_id = session_id
+        self.target_sr = target_sr
+        self.seq = seq
+        self.stems = None
+        self.error = None
+        self.cancelled = False
+        self._segments = None
+        self._started = threading.Event()
+
+    @property
+    def key(self):
+        """相同文件、设备、档位与目标采样率的任务可以合并，见 job_key。"""
+        return job_key(self.audio_path, self.device, self.profile, self.target_sr)
+
+    def cancel(self):
+        """请求取消；正在运行的任务会在当前段结束后停止。"""
+        self.cancelled = True
+
+    def wait_started(self, timeout=None):
+        """等待结果缓冲区分配完成并返回它；任务失败时抛出异常。"""
+        self._started.wait(timeout)
+        if self.stems is None and self.error is not None:
+            raise self.error
+        return self.stems
+
+    def result(self, timeout=None):
+        """等待任务完成，返回 (vocals, accomp, sr)。"""
+        stems = self.wait_started(timeout)
+        if stems is None or not stems.wait_finished(timeout):
+            raise self.error or (stems.error if stems else None) or TimeoutError()
+        return stems.vocals, stems.accomp, stems.sample_rate
+
+    def _fail(self, error):
+        self.error = error
+        if self.stems is not None:
+            self.stems.finish(error)
+        self._started.set()
+
+
+class SeparationScheduler:
+    """只有一个推理线程：每次选出优先级最高的任务推进一段，避免多个任务争抢 torch 线程池。"""
+
+    def __init__(self, cache=None):
+        """创建调度器并启动后台推理线程。"""
+        self.cache = cache
+        # 前台与后台任务的 torch 算子内线程数（None 表示使用 torch 默认值）
+        self.foreground_threads = None
+        self.background_threads = None
+        # 返回 True 时暂缓推进后台任务，例如音频回调负载过高时
+        self.throttle = None
+        self._thread_limit = None
+        self._default_threads = None
+        self.jobs = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, audio_path, device, priority, session_id=None, target_sr=None, profile=None):
+        """提交任务；已有相同任务时复用它并提升优先级。
+
+        合并后的任务归属优先级最高的提交者所在的会话；后台提交（session_id 为 None）
+        不会把已属于某个会话的任务变成后台任务，否则它切歌时不会被取消。
+        """
+        with self._cond:
+            for job in self.jobs:
+                if job.key == job_key(audio_path, device, profile, target_sr) and not job.cancelled:
+                    if session_id is not None and (job.session_id is None or priority <= job.priority):
+                        job.session_id = session_id
+                    job.priority = min(job.priority, priority)
+                    return job
+            job = SeparationJob(audio_path, device, priority, session_id,
+                                target_sr, next(self._seq), profile)
+            self.jobs.append(job)
+            self._cond.notify()
+            return job
+
+    def cancel_stale(self, session_id, keep=None):
+        """取消所有属于旧会话的任务；session_id 为 None 的后台任务不受影响。
+
+        keep 为即将以新会话重新提交的任务键（job_key），完全相同的任务保留，
+        已分离的部分不浪费；同一文件但设备、档位或采样率不同的旧任务照常取消。
+        """
+        with self._cond:
+            for job in self.jobs:
+                if job.session_id is not None and job.session_id != session_id \
+                        and job.key != keep:
+                    job.cancel()
+
+    def cancel_background(self):
+        """取消所有后台优先级的任务。"""
+        with self._cond:
+            for job in self.jobs:
+                if job.priority >= PRIORITY_BACKGROUND:
+                    job.cancel()
+
+    def cancel_all(self):
+        """取消所有尚未完成的任务。"""
+        with self._cond:
+            for job in self.jobs:
+                job.cancel()
+
+    def _next_job(self):
+        with self._cond:
+            while True:
+                for job in [j for j in self.jobs if j.cancelled]:
+                    self.jobs.remove(job)
+                    job._fail(SeparationCancelled(job.audio_path))
+                if self.jobs:
+                    return min(self.jobs, key=lambda j: (j.priority, j.seq))
+                self._cond.wait()
+
+    def _finish(self, job):
+        with self._cond:
+            if job in self.jobs:
+                self.jobs.remove(job)
+
+    def _apply_threads(self, job):
+        """按任务优先级切换 torch 线程数，后台任务使用更小的上限。"""
+        if job.priority >= PRIORITY_BACKGROUND:
+            limit = self.background_threads
+        else:
+            limit = self.foreground_threads
+        if limit == self._thread_limit:
+            return
+        import torch
+
+        if self._default_threads is None:
+            self._default_threads = torch.get_num_threads()
+        torch.set_num_threads(limit or self._default_threads)
+        self._thread_limit = limit
+
+    def _throttled(self, job):
+        if job.priority < PRIORITY_BACKGROUND or self.throttle is None:
+            return False
+        try:
+            return bool(self.throttle())
+        except Exception:
+            return False
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if self._throttled(job):
+                # 暂停后台推理，有新任务提交时立即重新选择
+                with self._cond:
+                    self._cond.wait(0.5)
+                continue
+            try:
+                if job._segments is None:
+                    self._start(job)
+                else:
+                    self._step(job)
+            except Exception as e:
+                self._finish(job)
+                job._fail(e)
+
+    def _start(self, job):
+        # 命中时直接交付输出采样率的版本，转换在调度线程中完成并写回缓存
+        hit = load_cached_converted(job.audio_path, self.cache, job.profile, job.target_sr)
+        if hit is not None:
+            job.stems = ProgressiveStems.from_arrays(*hit)
+            self._finish(job)
+            job._started.set()
+            return
+        # 压缩层命中时在解码线程中全速解码（并转换采样率），调度线程不等待
+        stream = open_cached_stream(job.audio_path, self.cache, job.profile, job.target_sr, eager=True)
+        if stream is not None:
+            job.stems = stream
+            self._finish(job)
+            job._started.set()
+            return
+        self._apply_threads(job)
+        job._segments = iter_separated_segments(job.audio_path, job.device,
+                                                target_sr=job.target_sr,
+                                                profile=job.profile)
+        out_sr, total = next(job._segments)
+        job.stems = ProgressiveStems(total, 2, out_sr)
+        job._started.set()
+
+    def _step(self, job):
+        self._apply_threads(job)
+        try:
+            start, vocals, accomp = next(job._segments)
+        except StopIteration:
+            self._finish(job)
+            stems = job.stems
+            mapped = store_cached(self.cache, job.audio_path, stems.vocals,
+                                  stems.accomp, stems.sample_rate, job.profile)
+            if mapped is not None:
+                # 之后取结果的预加载拿到的是内存映射，整首的内存数组随当前播放器释放
+                stems.vocals, stems.accomp = mapped[0], mapped[1]
+            stems.finish()
+            return
+        job.stems.write(start, vocals, accomp)
@@ -1,29 +1,305 @@
 """借助 Demucs 模型将歌曲中的人声与伴奏分离的工具函数。"""
 
-import torch
-import torchaudio
-from demucs.pretrained import get_model
-from demucs.apply import apply_model
+import copy
+import os
+import threading
+import time
 
+from audio.decoder import open_audio
+from audio.stem_cache import default_cache_dir
+from audio.stream_buffer import ProgressiveStems, resample_progressive
+from utils.audio_utils import resample_audio
+
+# torch / demucs 在首次真正分离时才导入，缓存命中时无需加载
 _MODEL_CACHE = {}
+_MODEL_LOCK = threading.Lock()
+
+# 推理后端："eager"（默认）、"torchscript" 或 "onnx"；导出文件保存在 _EXPORT_DIR
+BACKENDS = ("eager", "torchscript", "onnx")
+_BACKEND = "eager"
+_EXPORT_DIR = None
+
+MODEL_NAME = "htdemucs"
+
+# 速度/质量档位：model 为 Demucs 预训练模型名，其余参数直接传给 apply_model。
+# fast 减小重叠并关闭随机平移；quality 使用微调模型并做多次平移平均。
+# segment 保持 None（模型训练长度约 7.8 秒）：HTDemucs 会把更短的分段补齐到训练长度，
+# 分段越短模型调用次数越多，反而更慢。
+# quantize 为 True 时在 CPU 上使用动态 int8 量化的模型副本，其他设备忽略该项。
+SEPARATION_PROFILES = {
+    "fast": {"model": "htdemucs", "shifts": 0, "overlap": 0.1, "segment": None, "quantize": False},
+    "fast_int8": {"model": "htdemucs", "shifts": 0, "overlap": 0.1, "segment": None, "quantize": True},
+    "balanced": {"model": "htdemucs", "shifts": 1, "overlap": 0.25, "segment": None, "quantize": False},
+    "quality": {"model": "htdemucs_ft", "shifts": 2, "overlap": 0.5, "segment": None, "quantize": False},
+}
+DEFAULT_PROFILE = "balanced"
+
+# 渐进分离时每段的大致长度（第一段更短，尽早开始播放），以及每段两侧额外送入模型、
+# 结果中丢弃的上下文。实际送入模型的长度取 apply_model 分窗步长的整数倍，
+# 不会为凑一小截多算一个窗口
+FIRST_SEGMENT_SECONDS = 10.0
+SEGMENT_SECONDS = 20.0
+CONTEXT_SECONDS = 1.0
+# 模型未声明分段长度时的默认值（HTDemucs 训练长度）
+DEFAULT_MODEL_SEGMENT = 7.8
+
+
+def get_profile(profile=None):
+    """返回档位参数字典；profile 可以是档位名、参数字典或 None（默认档位）。"""
+    base = SEPARATION_PROFILES[DEFAULT_PROFILE]
+    if isinstance(profile, dict):
+        return {**base, **profile}
+    return dict(SEPARATION_PROFILES.get(profile or DEFAULT_PROFILE, base))
+
+
+def _apply_kwargs(profile):
+    """由档位参数生成 apply_model 的关键字参数。"""
+    return {
+        "split": True,
+        "shifts": profile["shifts"],
+        "overlap": profile["overlap"],
+        "segment": profile["segment"],
+    }
+
+
+def configure_backend(backend="eager", export_dir=None):
+    """选择推理后端及导出计算图的保存目录；未知后端按 eager 处理。"""
+    global _BACKEND, _EXPORT_DIR
+    _BACKEND = backend if backend in BACKENDS else "eager"
+    _EXPORT_DIR = export_dir
 
 
-def _get_model(device: str):
-    """按设备缓存并返回 Demucs 模型实例。"""
-    model = _MODEL_CACHE.get(device)
+def _get_model(device: str, name: str = MODEL_NAME, quantize: bool = False,
+               backend: str = "eager"):
+    """按 (模型名, 设备, 精度, 后端) 缓存并返回 Demucs 模型实例。
+
+    quantize 仅对 CPU 生效：在 fp32 模型旁缓存一份动态 int8 量化的副本。
+    backend 非 eager 时首次使用会导出计算图，失败则回退到 eager 模型。
+    """
+    quantize = quantize and device == "cpu"
+    if quantize:
+        backend = "eager"
+    key = (name, device, "int8" if quantize else "fp32", backend)
+    model = _MODEL_CACHE.get(key)
     if model is None:
-        model = get_model(name="htdemucs").to(device)
-        model.eval()
-        _MODEL_CACHE[device] = model
+        fp32 = _get_model(device, name) if quantize or backend != "eager" else None
+        with _MODEL_LOCK:
+            # 加锁后再次检查，避免多个线程重复加载模型
+            model = _MODEL_CACHE.get(key)
+            if model is None:
+                import torch
+
+                if quantize:
+                    model = torch.ao.quantization.quantize_dynamic(
+                        copy.deepcopy(fp32),
+                        {torch.nn.Linear, torch.nn.LSTM},
+                        dtype=torch.qint8,
+                    )
+                elif backend != "eager":
+                    from audio.exported_model import load_exported
+
+                    export_dir = _EXPORT_DIR or os.path.join(default_cache_dir(), "_models")
+                    model = load_exported(fp32, name, device, backend, export_dir) or fp32
+                else:
+                    from demucs.pretrained import get_model
+
+                    model = get_model(name=name).to(device)
+                model.eval()
+                _MODEL_CACHE[key] = model
     return model
 
 
-def separate_audio_in_memory(audio_path, device):
+def _model_for(device, profile):
+    return _get_model(device, profile["model"], profile.get("quantize", False), _BACKEND)
+
+
+def set_cpu_threads(threads):
+    """显式设置 torch 的算子内线程数；threads 为 0 或 None 时保持默认。"""
+    if not threads:
+        return
+    import torch
+
+    torch.set_num_threads(int(threads))
+
+
+def warm_up(device, profile=None):
+    """提前导入 torch/demucs 并加载模型，失败时静默忽略。"""
+    try:
+        _model_for(device, get_profile(profile))
+    except Exception:
+        pass
+
+
+def _cache_key(cache, audio_path, profile, sr=None):
+    params = {k: v for k, v in profile.items() if k != "model"}
+    if sr is not None:
+        # 转换到其他采样率的副本单独成为一个条目，与原始结果并存
+        params["sr"] = int(sr)
+    return cache.make_key(audio_path, profile["model"], params)
+
+
+def _cached_keys(cache, audio_path, profile, target_sr):
+    """按优先级列出可用的缓存键：先是 target_sr 的副本，再是原始结果。"""
+    keys = [_cache_key(cache, audio_path, profile, target_sr)] if target_sr else []
+    keys.append(_cache_key(cache, audio_path, profile))
+    return keys
+
+
+def _promote(cache, key, stems, audio_path, profile, target_sr):
+    """在解码线程中把压缩层的结果写回原始缓存，并让 stems 改用内存映射的数据。
+
+    采样率与 target_sr 不同时顺带转换并缓存转换后的副本，stems 随之改为 target_sr。
+    """
+    try:
+        cache.put(key, stems.vocals, stems.accomp, stems.sample_rate)
+        mapped = cache.get(key)
+    except OSError:
+        mapped = None
+    if mapped is not None:
+        stems.vocals, stems.accomp = mapped[0], mapped[1]
+    if target_sr and stems.sample_rate != target_sr:
+        converted = load_cached_converted(audio_path, cache, profile, target_sr)
+        if converted is None:
+            converted = (resample_audio(stems.vocals, stems.sample_rate, target_sr),
+                         resample_audio(stems.accomp, stems.sample_rate, target_sr), target_sr)
+        stems.vocals, stems.accomp, stems.sample_rate = converted
+        stems.num_frames = min(len(stems.vocals), len(stems.accomp))
+
+
+def load_cached(audio_path, cache, profile=None, target_sr=None, archive=False):
+    """仅查询磁盘缓存，命中时返回 (vocals, accomp, sr)，否则返回 None。
+
+    给出 target_sr 时优先返回已转换到该采样率的副本；没有副本时返回原始结果，
+    其采样率可能与 target_sr 不同。archive 为 True 时还会查压缩层：命中后全速解码整首、
+    写回原始缓存并阻塞到完成，只能在可以等待数秒的线程中使用（不要在调度线程中）。
+    """
+    if cache is None:
+        return None
+    profile = get_profile(profile)
+    try:
+        keys = _cached_keys(cache, audio_path, profile, target_sr)
+        for key in keys:
+            hit = cache.get(key)
+            if hit is not None:
+                return hit
+    except OSError:
+        return None
+    stems = open_cached_stream(audio_path, cache, profile, target_sr, eager=True) if archive else None
+    if stems is not None and stems.wait_finished():
+        return stems.vocals, stems.accomp, stems.sample_rate
+    return None
+
+
+def open_cached_stream(audio_path, cache, profile=None, target_sr=None, eager=False):
+    """在压缩缓存层中查找并开始分块解码，返回 ChunkedStems；未命中时返回 None。
+
+    解码在独立线程中进行，完成后结果写回原始缓存（并转换到 target_sr），下次直接内存映射。
+    eager 为 True 时全速解码整首，否则边播放边按进度解码。原始缓存命中时应优先用 load_cached。
+    """
+    archive = getattr(cache, "archive", None)
+    if archive is None:
+        return None
+    profile = get_profile(profile)
+    try:
+        for key in _cached_keys(cache, audio_path, profile, target_sr):
+            stems = archive.open(
+                key, eager=eager,
+                on_finished=lambda s, key=key: _promote(cache, key, s, audio_path, profile, target_sr),
+            )
+            if stems is not None:
+                return stems
+    except OSError:
+        pass
+    return None
+
+
+def load_cached_converted(audio_path, cache, profile, target_sr):
+    """读取缓存并保证采样率为 target_sr，需要转换时把转换结果也写入缓存。
+
+    转换需要数秒，应在后台线程中调用；未命中时返回 None。
+    """
+    hit = load_cached(audio_path, cache, profile, target_sr)
+    if hit is None or not target_sr or hit[2] == target_sr:
+        return hit
+    vocals, accomp, sr = hit
+    vocals = resample_audio(vocals, sr, target_sr)
+    accomp = resample_audio(accomp, sr, target_sr)
+    key = _cache_key(cache, audio_path, get_profile(profile), target_sr)
+    try:
+        cache.put(key, vocals, accomp, target_sr)
+        mapped = cache.get(key)
+    except OSError:
+        mapped = None
+    # 写入成功时改用内存映射的副本，转换结果不必常驻内存
+    return mapped or (vocals, accomp, target_sr)
+
+
+def convert_progressive(audio_path, cache, profile, vocals, accomp, sr, target_sr, source=None):
+    """把采样率为 sr 的分离结果在后台逐段转换到 target_sr，立即返回 ProgressiveStems。
+
+    播放器可以边转换边播放，不必等整首转换完成；source 为仍在写入的源数据。
+    转换完成后写入 target_sr 的缓存副本并改用内存映射，下次直接读取。
+    """
+    def store(stems):
+        if cache is None:
+            return
+        key = _cache_key(cache, audio_path, get_profile(profile), target_sr)
+        try:
+            cache.put(key, stems.vocals, stems.accomp, target_sr)
+            mapped = cache.get(key)
+        except OSError:
+            return
+        if mapped is not None:
+            stems.vocals, stems.accomp = mapped[0], mapped[1]
+
+    return resample_progressive(vocals, accomp, sr, target_sr, source=source, on_finished=store)
+
+
+def is_cached(audio_path, cache, profile=None):
+    """判断磁盘缓存中是否已有该文件的分离结果，不读取数据。"""
+    if cache is None:
+        return False
+    try:
+        key = _cache_key(cache, audio_path, get_profile(profile))
+        archive = cache.archive
+        return cache.contains(key) or (archive is not None and archive.contains(key))
+    except OSError:
+        return False
+
+
+def store_cached(cache, audio_path, vocals, accomp, sr, profile=None):
+    """写入磁盘缓存，成功时返回内存映射的 (vocals, accomp, sr)，否则返回 None。"""
+    if cache is None:
+        return None
+    key = _cache_key(cache, audio_path, get_profile(profile))
+    try:
+        cache.put(key, vocals, accomp, sr)
+        return cache.get(key)
+    except OSError:
+        return None
+
+
+def separate_audio_in_memory(audio_path, device, cache=None, stats=None, profile=None):
     """
     使用 Demucs 在内存中分离音频，返回 (vocals, accompaniment, sample_rate)
     - audio_path: 音频文件路径
     - device: 'cpu' 或 'cuda'
+    - cache: 可选的 StemCache，命中时直接读取磁盘结果
+    - stats: 可选字典，写入 decode_time / inference_time / duration 等耗时信息
+    - profile: 速度/质量档位名或参数字典，见 SEPARATION_PROFILES
     """
+    profile = get_profile(profile)
+    hit = load_cached(audio_path, cache, profile, archive=True)
+    if hit is not None:
+        if stats is not None:
+            stats["cached"] = True
+        return hit
+
+    import torch
+    import torchaudio
+    from demucs.apply import apply_model
+
+    t0 = time.perf_counter()
     wav, sr = torchaudio.load(audio_path)
 
     # 如果是单声道，复制为双声道
@@ -31,22 +307,256 @@ def separate_audio_in_memory(audio_path, device):
         wav = wav.repeat(2, 1)
 
     wav = wav.to(torch.float32).to(device)
+    t1 = time.perf_counter()
 
     # 加载模型（仅首次加载）
-    model = _get_model(device)
+    model = _model_for(device, profile)
+    t2 = time.perf_counter()
 
-    with torch.no_grad():
+    with torch.inference_mode():
         sources = apply_model(
             model,
             wav[None],  # 添加 batch 维度
             device=device,
-            split=True,
-            overlap=0.25,
-            progress=False
+            progress=False,
+            **_apply_kwargs(profile),
         )[0]  # 去掉 batch
 
     vocals = sources[model.sources.index("vocals")]
     accomp = sources.sum(dim=0) - vocals  # 总和减去人声
 
     # 转置为 [samples, channels] 并转 numpy
-    return vocals.transpose(0, 1).cpu().numpy(), accomp.transpose(0, 1).cpu().numpy(), sr
+    vocals = vocals.transpose(0, 1).cpu().numpy()
+    accomp = accomp.transpose(0, 1).cpu().numpy()
+    if stats is not None:
+        stats.update(
+            cached=False,
+            decode_time=t1 - t0,
+            model_load_time=t2 - t1,
+            inference_time=time.perf_counter() - t2,
+            duration=wav.shape[1] / sr,
+        )
+    return store_cached(cache, audio_path, vocals, accomp, sr, profile) or (vocals, accomp, sr)
+
+
+def _window_stride(model, profile):
+    """返回 apply_model 分窗的 (步长, 随机平移的补齐长度)，单位为送入模型的采样点。"""
+    segment = profile["segment"]
+    if not segment:
+        models = getattr(model, "models", None) or [model]
+        segment = min(float(getattr(m, "segment", DEFAULT_MODEL_SEGMENT)) for m in models)
+    samplerate = getattr(model, "samplerate", 44100)
+    stride = max(1, int((1 - profile["overlap"]) * int(samplerate * float(segment))))
+    # shifts 大于 0 时 apply_model 先把输入延长最多半秒再分窗
+    shift = int(0.5 * samplerate) if profile["shifts"] else 0
+    return stride, shift
+
+
+def _segment_span(seconds, sr, ctx, stride, shift):
+    """产出约 seconds 秒（两侧各含 ctx 上下文）所需的输入长度，取分窗步长的整数倍。"""
+    windows = max(1, round((seconds * sr + 2 * ctx + shift) / stride))
+    return max(windows * stride - shift, 2 * ctx + 1)
+
+
+def iter_separated_segments(audio_path, device, target_sr=None, profile=None,
+                            segment_seconds=SEGMENT_SECONDS,
+                            context_seconds=CONTEXT_SECONDS,
+                            first_segment_seconds=FIRST_SEGMENT_SECONDS):
+    """
+    按时间顺序逐段分离音频，依次产出 (start, vocals, accomp)。
+    首次产出前先产出一次 (sr, total_frames) 供调用方分配缓冲区；
+    所有帧号均以输出采样率 target_sr 计。任意时刻只保留一段的四轨结果。
+
+    每段送入模型的长度是分窗步长的整数倍，逐段分离的模型调用次数与整首一次分离
+    只差各段上下文的部分。
+    """
+    import torch
+    import torchaudio.functional as F
+    from demucs.apply import apply_model
+
+    sr, total, read = open_audio(audio_path)
+    out_sr = target_sr or sr
+    ratio = out_sr / sr
+    yield out_sr, int(round(total * ratio))
+
+    profile = get_profile(profile)
+    model = _model_for(device, profile)
+    kwargs = _apply_kwargs(profile)
+    vocal_idx = model.sources.index("vocals")
+    stride, shift = _window_stride(model, profile)
+    ctx = min(int(context_seconds * sr), stride // 4)
+    span = _segment_span(first_segment_seconds, sr, ctx, stride, shift)
+    start = 0
+    while start < total:
+        lo = max(0, start - ctx)
+        hi = min(total, lo + span)
+        stop = hi if hi == total else hi - ctx
+        span = _segment_span(segment_seconds, sr, ctx, stride, shift)
+        wav = torch.from_numpy(read(lo, hi))
+        if wav.shape[0] == 1:
+            wav = wav.repeat(2, 1)
+        wav = wav.to(torch.float32).to(device)
+        with torch.inference_mode():
+            sources = apply_model(model, wav[None], device=device,
+                                  progress=False, **kwargs)[0]
+            vocals = sources[vocal_idx]
+            accomp = sources.sum(dim=0) - vocals
+            del sources
+            if out_sr != sr:
+                # 连同上下文一起重采样，边缘效应落在随后丢弃的部分
+                vocals = F.resample(vocals, sr, out_sr)
+                accomp = F.resample(accomp, sr, out_sr)
+        out_start = int(round(start * ratio))
+        a = out_start - int(round(lo * ratio))
+        b = a + int(round(stop * ratio)) - out_start
+        yield (out_start,
+               vocals[:, a:b].transpose(0, 1).cpu().numpy(),
+               accomp[:, a:b].transpose(0, 1).cpu().numpy())
+        start = stop
+
+
+def separate_audio_progressive(audio_path, device, target_sr=None, cache=None, profile=None):
+    """
+    在后台线程中逐段分离，立即返回 ProgressiveStems。
+    调用方可在第一段就绪后开始播放，其余部分在播放期间继续填充。
+    """
+    segments = iter_separated_segments(audio_path, device, target_sr=target_sr,
+                                       profile=profile)
+    out_sr, total = next(segments)
+    stems = ProgressiveStems(total, 2, out_sr)
+
+    def run():
+        try:
+            for start, vocals, accomp in segments:
+                stems.write(start, vocals, accomp)
+        except Exception as e:
+            stems.finish(e)
+            return
+        stems.finish()
+        store_cached(cache, audio_path, stems.vocals, stems.accomp, out_sr, profile)
+
+    threading.Thread(target=run, daemon=True).start()
+    return stems
+
+
+def _sdr(reference, estimate):
+    """以 reference 为基准计算 estimate 的信号失真比（dB）。"""
+    import numpy as np
+
+    noise = np.sum((reference - estimate) ** 2)
+    signal = np.sum(reference ** 2)
+    if noise == 0:
+        return float("inf")
+    return float(10 * np.log10(max(signal, 1e-12) / noise))
+
+
+def compare_cpu_acceleration(audio_path, seconds=10.0, name=MODEL_NAME, threads=None):
+    """
+    在一段测试音频上对比 fp32 与 int8 量化模型的 CPU 推理耗时，
+    并以 fp32 输出为基准报告 int8 结果的 SDR 偏差。
+    """
+    import torch
+    from demucs.apply import apply_model
+
+    set_cpu_threads(threads)
+    sr, total, read = open_audio(audio_path)
+    wav = torch.from_numpy(read(0, min(total, int(seconds * sr))))
+    if wav.shape[0] == 1:
+        wav = wav.repeat(2, 1)
+    wav = wav.to(torch.float32)[None]
+    kwargs = {"split": True, "shifts": 0, "overlap": 0.25}
+
+    results = {}
+    for label, quantize in (("fp32", False), ("int8", True)):
+        model = _get_model("cpu", name, quantize)
+        with torch.inference_mode():
+            # 预热一次，排除首次调用的额外开销
+            apply_model(model, wav[..., :sr], device="cpu", progress=False, **kwargs)
+            start = time.perf_counter()
+            sources = apply_model(model, wav, device="cpu", progress=False, **kwargs)[0]
+            elapsed = time.perf_counter() - start
+        vocals = sources[model.sources.index("vocals")]
+        accomp = sources.sum(dim=0) - vocals
+        results[label] = (elapsed, vocals.numpy(), accomp.numpy())
+
+    fp32_time, ref_v, ref_a = results["fp32"]
+    int8_time, est_v, est_a = results["int8"]
+    return {
+        "clip_seconds": wav.shape[-1] / sr,
+        "threads": torch.get_num_threads(),
+        "fp32_seconds": fp32_time,
+        "int8_seconds": int8_time,
+        "speedup": fp32_time / int8_time if int8_time else None,
+        "vocals_sdr_db": _sdr(ref_v, est_v),
+        "accomp_sdr_db": _sdr(ref_a, est_a),
+    }
+
+
+def compare_profiles(audio_path, seconds=30.0, device="cpu", profiles=("fast", "balanced"), threads=None):
+    """
+    在同一段音频上依次用各档位分离并计时（不含模型加载），返回 {档位: 秒数}。
+    用于确认快速档位确实比均衡档位快。
+    """
+    import torch
+    from demucs.apply import apply_model
+
+    if device == "cpu":
+        set_cpu_threads(threads)
+    sr, total, read = open_audio(audio_path)
+    wav = torch.from_numpy(read(0, min(total, int(seconds * sr))))
+    if wav.shape[0] == 1:
+        wav = wav.repeat(2, 1)
+    wav = wav.to(torch.float32)[None]
+
+    results = {"clip_seconds": wav.shape[-1] / sr}
+    for name in profiles:
+        profile = get_profile(name)
+        model = _model_for(device, profile)
+        kwargs = _apply_kwargs(profile)
+        with torch.inference_mode():
+            # 预热一次，排除首次调用的额外开销
+            apply_model(model, wav[..., :sr], device=device, progress=False, **kwargs)
+            start = time.perf_counter()
+            apply_model(model, wav, device=device, progress=False, **kwargs)
+            results[name] = time.perf_counter() - start
+    return results
+
+
+def compare_backends(audio_path, backend, seconds=10.0, device="cpu", name=MODEL_NAME, threads=None):
+    """
+    在一段真实音频上分别用 eager 模型与导出的计算图执行 apply_model（关闭随机平移），
+    返回两者耗时、各音轨输出的最大绝对误差以及是否在导出容差之内。
+    后端不可用或导出被拒绝时 exported 为 False。
+    """
+    import torch
+    from demucs.apply import apply_model
+
+    from audio.exported_model import EXPORT_TOLERANCE
+
+    if device == "cpu":
+        set_cpu_threads(threads)
+    sr, total, read = open_audio(audio_path)
+    wav = torch.from_numpy(read(0, min(total, int(seconds * sr))))
+    if wav.shape[0] == 1:
+        wav = wav.repeat(2, 1)
+    wav = wav.to(torch.float32)[None]
+    kwargs = {"split": True, "shifts": 0, "overlap": 0.25}
+
+    eager = _get_model(device, name)
+    exported = _get_model(device, name, backend=backend)
+    results = {"clip_seconds": wav.shape[-1] / sr, "backend": backend,
+               "exported": exported is not eager, "tolerance": EXPORT_TOLERANCE}
+    if exported is eager:
+        return results
+    outputs = {}
+    for label, model in (("eager", eager), (backend, exported)):
+        with torch.inference_mode():
+            # 预热一次，排除首次调用的额外开销
+            apply_model(model, wav[..., :sr], device=device, progress=False, **kwargs)
+            start = time.perf_counter()
+            outputs[label] = apply_model(model, wav, device=device, progress=False, **kwargs)[0].cpu()
+            results[f"{label}_seconds"] = time.perf_counter() - start
+    diff = float((outputs["eager"] - outputs[backend]).abs().max())
+    results["max_abs_diff"] = diff
+    results["within_tolerance"] = diff <= EXPORT_TOLERANCE
+    return results
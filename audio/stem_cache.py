@@ -0,0 +1,230 @@
+"""按内容哈希缓存分离结果的磁盘缓存，超出容量时按 LRU 淘汰。
+
+条目以原始 .npy 保存，读取时用内存映射打开：播放器直接从页缓存切片，
+准备多少首歌都几乎不占用进程内存。设置了 archive（CompressedStemCache）时，
+淘汰的条目先压缩转存到该层，而不是直接删除。
+"""
+
+import hashlib
+import json
+import os
+import queue
+import shutil
+import threading
+import uuid
+
+import numpy as np
+
+from utils.settings import BASE_DIR
+
+# 缓存格式版本，布局变化时递增以使旧条目失效
+CACHE_FORMAT = 1
+_HASH_CHUNK = 1 << 20
+_META_FILE = "meta.json"
+
+
+def default_cache_dir():
+    """返回默认的缓存目录（位于程序目录下）。"""
+    return os.path.join(BASE_DIR, "stem_cache")
+
+
+def prefetch(array, start=0, frames=None):
+    """把内存映射数组的一段提前换入页缓存，避免音频回调首次读到时等待磁盘。
+
+    每页只读一个元素；普通内存数组直接返回。
+    """
+    if not isinstance(array, np.memmap):
+        return
+    stop = len(array) if frames is None else min(len(array), start + frames)
+    step = max(1, 4096 // (array.strides[0] or 1))
+    float(array[start:stop:step].sum())
+
+
+class StemCache:
+    """以“文件哈希 + 模型名 + 分离参数”为键，在磁盘上保存人声与伴奏。"""
+
+    def __init__(self, cache_dir=None, max_bytes=4 * 1024 ** 3, archive=None):
+        """创建缓存目录并设置容量上限（字节，0 表示不设上限）；archive 为可选的压缩缓存层。"""
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = int(max_bytes)
+        self.archive = archive
+        self.lock = threading.Lock()
+        # path -> (size, mtime_ns, sha1)，避免重复计算同一文件的哈希
+        self._hash_memo = {}
+        # 等待压缩转存的条目目录，由后台线程逐个编码，不占用写入缓存的线程
+        self._demotions = queue.Queue()
+        self._demoter = None
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(".demote-"):
+                # 上次退出时尚未转存完的条目
+                self._queue_demotion(os.path.join(self.cache_dir, name))
+
+    def file_hash(self, path):
+        """计算音频文件内容的 SHA1，文件未变化时直接复用。"""
+        st = os.stat(path)
+        memo = self._hash_memo.get(path)
+        if memo and memo[0] == st.st_size and memo[1] == st.st_mtime_ns:
+            return memo[2]
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        self._hash_memo[path] = (st.st_size, st.st_mtime_ns, digest)
+        return digest
+
+    def make_key(self, audio_path, model_name, params):
+        """根据文件内容、模型名和分离参数生成缓存键。"""
+        payload = json.dumps(
+            {
+                "format": CACHE_FORMAT,
+                "file": self.file_hash(audio_path),
+                "model": model_name,
+                "params": params,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def contains(self, key):
+        """判断缓存中是否已有该条目。"""
+        return os.path.exists(os.path.join(self._entry_dir(key), _META_FILE))
+
+    def get(self, key, mmap=True):
+        """读取缓存条目，命中时返回 (vocals, accomp, sr)，否则返回 None。
+
+        mmap 为 True 时返回只读的 np.memmap，数据按需从磁盘换入；为 False 时整体读入内存。
+        """
+        entry = self._entry_dir(key)
+        meta_path = os.path.join(entry, _META_FILE)
+        mode = "r" if mmap else None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            vocals = np.load(os.path.join(entry, "vocals.npy"), mmap_mode=mode)
+            accomp = np.load(os.path.join(entry, "accomp.npy"), mmap_mode=mode)
+            # 更新访问时间，供 LRU 淘汰使用
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None
+        return vocals, accomp, int(meta["sr"])
+
+    def put(self, key, vocals, accomp, sr):
+        """写入一个缓存条目；先写临时目录再原子替换，避免读到半成品。"""
+        entry = self._entry_dir(key)
+        if self.contains(key):
+            return
+        tmp = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp)
+        try:
+            np.save(os.path.join(tmp, "vocals.npy"), np.ascontiguousarray(vocals, dtype=np.float32))
+            np.save(os.path.join(tmp, "accomp.npy"), np.ascontiguousarray(accomp, dtype=np.float32))
+            with open(os.path.join(tmp, _META_FILE), "w", encoding="utf-8") as f:
+                json.dump({"sr": int(sr), "frames": int(len(vocals))}, f)
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                # 其他线程或进程已写入同一条目
+                pass
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def _entries(self):
+        """列出所有条目及其大小与最近访问时间。"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            entry = os.path.join(self.cache_dir, name)
+            meta_path = os.path.join(entry, _META_FILE)
+            if name.startswith(".") or not os.path.isfile(meta_path):
+                continue
+            try:
+                size = sum(
+                    os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry)
+                )
+                entries.append((os.path.getmtime(meta_path), size, entry))
+            except OSError:
+                continue
+        return entries
+
+    def total_bytes(self):
+        """返回缓存当前占用的字节数。"""
+        return sum(size for _, size, _ in self._entries())
+
+    def _queue_demotion(self, pending):
+        """把已改名为 .demote-<键> 的条目交给后台线程转存，没有 archive 时直接删除。"""
+        if self.archive is None:
+            shutil.rmtree(pending, ignore_errors=True)
+            return
+        self._demotions.put(pending)
+        if self._demoter is None:
+            self._demoter = threading.Thread(target=self._demote_loop, daemon=True)
+            self._demoter.start()
+
+    def _demote_loop(self):
+        while True:
+            pending = self._demotions.get()
+            self._demote(pending)
+            shutil.rmtree(pending, ignore_errors=True)
+
+    def _demote(self, pending):
+        """把条目压缩转存到 archive；失败时只是少一份压缩副本。"""
+        key = os.path.basename(pending)[len(".demote-"):]
+        if self.archive.contains(key):
+            return
+        try:
+            with open(os.path.join(pending, _META_FILE), "r", encoding="utf-8") as f:
+                sr = int(json.load(f)["sr"])
+            vocals = np.load(os.path.join(pending, "vocals.npy"), mmap_mode="r")
+            accomp = np.load(os.path.join(pending, "accomp.npy"), mmap_mode="r")
+            self.archive.put(key, vocals, accomp, sr)
+        except (OSError, ValueError, RuntimeError):
+            pass
+        # 释放映射，Windows 上之后才能删除
+        vocals = accomp = None
+
+    def _remove(self, entry):
+        """先把条目改名再删除，有 archive 时改为交给后台转存。
+
+        条目仍被内存映射（Windows 上无法改名）时保留并返回 False。
+        """
+        if self.archive is not None:
+            pending = os.path.join(self.cache_dir, f".demote-{os.path.basename(entry)}")
+            try:
+                os.replace(entry, pending)
+            except OSError:
+                return False
+            self._queue_demotion(pending)
+            return True
+        trash = os.path.join(self.cache_dir, f".trash-{uuid.uuid4().hex}")
+        try:
+            os.replace(entry, trash)
+        except OSError:
+            return False
+        shutil.rmtree(trash, ignore_errors=True)
+        return True
+
+    def evict(self):
+        """删除最久未使用的条目，直到总大小不超过上限；正在播放的条目跳过。
+
+        有 archive 时被淘汰的条目改名后由后台线程压缩转存，本方法不等待编码。
+        """
+        with self.lock:
+            for name in os.listdir(self.cache_dir):
+                if name.startswith(".trash-"):
+                    # 之前因文件仍被映射而没删干净的条目
+                    shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            if not self.max_bytes:
+                return
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            for _, size, entry in entries:
+                if total <= self.max_bytes:
+                    break
+                if self._remove(entry):
+                    total -= size
@@ -0,0 +1,177 @@
+"""边分离（或边解码）边播放时使用的增长型音频缓冲区。"""
+
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from utils.audio_utils import StreamingResampler
+
+# 超过这么长（秒）的缓冲区映射到临时文件：已写入的部分由页缓存承担、可被系统回收，
+# 常驻内存不随时长增长，例如一小时的现场录音
+FILE_BACKED_SECONDS = 15 * 60
+
+
+def _allocate(num_frames, channels, sample_rate):
+    """分配一轨全长缓冲区，未写入部分为静音；较长时映射到溢出目录下的临时文件。"""
+    if num_frames > FILE_BACKED_SECONDS * sample_rate:
+        from audio.buffers import default_spill_dir
+
+        try:
+            os.makedirs(default_spill_dir(), exist_ok=True)
+            # 临时文件在关闭后自动删除，映射本身持有文件句柄
+            with tempfile.TemporaryFile(dir=default_spill_dir()) as f:
+                return np.memmap(f, dtype=np.float32, mode="w+", shape=(num_frames, channels))
+        except OSError:
+            pass
+    return np.zeros((num_frames, channels), dtype=np.float32)
+
+
+# 边转换边播放时每段转换的时长（秒）；StreamingResampler 按段构造下标数组，段太长会占用大量内存
+RESAMPLE_CHUNK_SECONDS = 1.0
+
+
+class _ProgressiveBuffer:
+    """记录从头开始已就绪的帧数，并允许其他线程等待进度。"""
+
+    def __init__(self, num_frames, sample_rate):
+        self.num_frames = num_frames
+        self.sample_rate = sample_rate
+        self.ready = 0  # 从头开始连续可播放的帧数
+        self.finished = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def _advance(self, end):
+        with self._cond:
+            self.ready = max(self.ready, end)
+            self._cond.notify_all()
+
+    def covers(self, start, end):
+        """判断 [start, end) 是否已可播放；播放器每块调用一次，不得阻塞。"""
+        return end <= self.ready
+
+    def seek_target(self, frame):
+        """返回跳转到 frame 时实际可到达的位置：写入完成前不允许跳到尚未就绪的部分。"""
+        if self.finished:
+            return frame
+        return min(frame, self.ready)
+
+    def finish(self, error=None):
+        """标记写入结束；出错时记录异常。"""
+        with self._cond:
+            self.error = error
+            self.finished = True
+            if error is None:
+                self.ready = self.num_frames
+            self._cond.notify_all()
+
+    def wait_for(self, frames, timeout=None):
+        """阻塞直到至少 frames 帧就绪或写入结束，返回是否已满足。"""
+        frames = min(frames, self.num_frames)
+        with self._cond:
+            self._cond.wait_for(lambda: self.ready >= frames or self.finished, timeout)
+            return self.ready >= frames
+
+    def wait_finished(self, timeout=None):
+        """阻塞直到写入结束，返回是否成功完成。"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.finished, timeout)
+            return self.finished and self.error is None
+
+
+class ProgressiveStems(_ProgressiveBuffer):
+    """预分配整首歌的人声与伴奏数组，分离线程按段写入，播放器读取已就绪部分。
+
+    超过 FILE_BACKED_SECONDS 的歌曲改用临时文件映射，内存占用与时长无关。
+    """
+
+    def __init__(self, num_frames, channels, sample_rate):
+        """按总帧数分配缓冲区，未写入部分保持静音。"""
+        super().__init__(num_frames, sample_rate)
+        self.vocals = _allocate(num_frames, channels, sample_rate)
+        self.accomp = _allocate(num_frames, channels, sample_rate)
+
+    @classmethod
+    def from_arrays(cls, vocals, accomp, sample_rate):
+        """用已完成的分离结果构造一个已结束的缓冲区。"""
+        stems = cls.__new__(cls)
+        _ProgressiveBuffer.__init__(stems, min(len(vocals), len(accomp)), sample_rate)
+        stems.vocals = vocals
+        stems.accomp = accomp
+        stems.finish()
+        return stems
+
+    def write(self, start, vocals, accomp):
+        """写入从 start 开始的一段结果并唤醒等待者。"""
+        n = max(0, min(len(vocals), len(accomp), self.num_frames - start))
+        self.vocals[start:start + n] = vocals[:n]
+        self.accomp[start:start + n] = accomp[:n]
+        self._advance(start + n)
+
+
+class ProgressiveAudio(_ProgressiveBuffer):
+    """单轨版本，用于边解码边播放原始混音。"""
+
+    def __init__(self, num_frames, channels, sample_rate):
+        """按总帧数分配缓冲区，未写入部分保持静音。"""
+        super().__init__(num_frames, sample_rate)
+        self.data = _allocate(num_frames, channels, sample_rate)
+
+    def write(self, start, data):
+        """写入从 start 开始的一段音频并唤醒等待者。"""
+        n = max(0, min(len(data), self.num_frames - start))
+        self.data[start:start + n] = data[:n]
+        self._advance(start + n)
+
+
+def resample_progressive(vocals, accomp, sample_rate, target_sr, source=None, on_finished=None):
+    """在后台线程中把人声/伴奏逐段转换到 target_sr，立即返回 ProgressiveStems。
+
+    source 为仍在写入的 _ProgressiveBuffer（例如边解码的压缩缓存）时按其进度读取。
+    on_finished(stems) 在全部写完、标记结束之前于转换线程中调用，可用来写入缓存。
+    """
+    channels = vocals.shape[1]
+    total = min(len(vocals), len(accomp))
+    stems = ProgressiveStems(-(-total * int(target_sr) // int(sample_rate)), channels, target_sr)
+
+    def run():
+        try:
+            resamplers = [StreamingResampler(sample_rate, target_sr, channels) for _ in range(2)]
+            # 扣掉滤波器延迟，使转换结果与原数据时间轴对齐
+            pos = -round(resamplers[0].delay * target_sr / sample_rate)
+            chunk = max(1, int(RESAMPLE_CHUNK_SECONDS * sample_rate))
+            start = 0
+            while start < total:
+                end = min(start + chunk, total)
+                if source is not None and not source.wait_for(end) and source.error is not None:
+                    stems.finish(source.error)
+                    return
+                blocks = [r.process(data[start:end]) for r, data in zip(resamplers, (vocals, accomp))]
+                pos = _write_resampled(stems, pos, blocks)
+                start = end
+            # 末尾补零，把滤波器中剩余的样本推出来
+            pad = np.zeros((resamplers[0].taps, channels), dtype=np.float32)
+            _write_resampled(stems, pos, [r.process(pad) for r in resamplers])
+            if on_finished is not None:
+                on_finished(stems)
+        except Exception as e:
+            stems.finish(e)
+            return
+        stems.finish()
+
+    threading.Thread(target=run, daemon=True).start()
+    return stems
+
+
+def _write_resampled(stems, pos, blocks):
+    """把一段转换结果写到 pos，丢弃 pos 之前（滤波器延迟）的部分，返回下一段的位置。"""
+    vocals, accomp = blocks
+    if pos < 0:
+        drop = min(-pos, len(vocals))
+        vocals, accomp = vocals[drop:], accomp[drop:]
+        pos += drop
+    if len(vocals):
+        stems.write(pos, vocals, accomp)
+    return pos + len(vocals)
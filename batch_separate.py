@@ -0,0 +1,238 @@
+"""无界面批量分离工具：多进程预先分离整个曲库并输出耗时报告。
+
+示例：
+    python batch_separate.py D:/Music -j 4 --report report.json
+中途中断后以相同参数重新运行即可续跑，已写入缓存的歌曲会被跳过。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from audio.separator import (
+    BACKENDS,
+    SEPARATION_PROFILES,
+    compare_backends,
+    compare_cpu_acceleration,
+    compare_profiles,
+    configure_backend,
+    is_cached,
+    separate_audio_in_memory,
+)
+from audio.stem_cache import StemCache, default_cache_dir
+from utils.settings import load_settings
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+AUDIO_EXTENSIONS = (".mp3", ".flac")
+
+_WORKER = {}
+
+
+def collect_files(inputs, list_file=None):
+    """展开目录与文件列表，返回去重后的音频文件路径。"""
+    paths = list(inputs)
+    if list_file:
+        with open(list_file, "r", encoding="utf-8") as f:
+            paths.extend(line.strip() for line in f if line.strip())
+    files, seen = [], set()
+    for p in paths:
+        if os.path.isdir(p):
+            for root, _, names in os.walk(p):
+                for name in sorted(names):
+                    if name.lower().endswith(AUDIO_EXTENSIONS):
+                        files.append(os.path.join(root, name))
+        elif os.path.isfile(p):
+            files.append(p)
+    result = []
+    for f in files:
+        key = os.path.abspath(f)
+        if key not in seen:
+            seen.add(key)
+            result.append(key)
+    return result
+
+
+def peak_rss_mb():
+    """返回当前进程启动以来的峰值常驻内存（MB），平台不支持时返回 None。
+
+    这是整个进程生命周期的最大值，包含模型和此前处理过的歌曲，不是单首歌曲的增量。
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _init_worker(device, threads, cache_dir, max_bytes, profile, backend):
+    """子进程初始化：划分 torch 线程并打开共享的磁盘缓存。"""
+    import torch
+
+    configure_backend(backend, os.path.join(cache_dir, "_models"))
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    _WORKER["device"] = device
+    _WORKER["profile"] = profile
+    _WORKER["cache"] = StemCache(cache_dir, max_bytes)
+
+
+def _separate_one(path):
+    """在子进程中分离一首歌并返回耗时记录。"""
+    stats = {}
+    start = time.perf_counter()
+    record = {"path": path, "pid": os.getpid()}
+    try:
+        separate_audio_in_memory(path, _WORKER["device"], cache=_WORKER["cache"],
+                                 stats=stats, profile=_WORKER["profile"])
+    except Exception as e:
+        record.update(status="error", error=repr(e))
+        return record
+    wall = time.perf_counter() - start
+    duration = stats.get("duration")
+    record.update(
+        status="cached" if stats.get("cached") else "ok",
+        duration=duration,
+        decode_time=stats.get("decode_time"),
+        model_load_time=stats.get("model_load_time"),
+        inference_time=stats.get("inference_time"),
+        wall_time=wall,
+        # 实时系数：处理耗时 / 音频时长，小于 1 表示快于实时
+        rtf=wall / duration if duration else None,
+        # 工作进程至此为止的峰值内存，含模型；同一进程后续歌曲只会持平或更高
+        worker_peak_rss_mb=peak_rss_mb(),
+    )
+    return record
+
+
+def _summary(records):
+    done = [r for r in records if r.get("status") == "ok"]
+    audio = sum(r["duration"] for r in done)
+    wall = sum(r["wall_time"] for r in done)
+    rss = [r["worker_peak_rss_mb"] for r in done if r.get("worker_peak_rss_mb") is not None]
+    return {
+        "tracks_ok": len(done),
+        "tracks_error": sum(1 for r in records if r.get("status") == "error"),
+        "audio_seconds": audio,
+        "worker_seconds": wall,
+        "mean_rtf": wall / audio if audio else None,
+        "max_worker_peak_rss_mb": max(rss) if rss else None,
+    }
+
+
+def _write_report(path, report):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def main(argv=None):
+    """命令行入口。"""
+    settings = load_settings()
+    cpu = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description="批量分离人声与伴奏，结果写入播放器使用的分离缓存。")
+    parser.add_argument("inputs", nargs="*", help="音乐文件或文件夹")
+    parser.add_argument("--list", dest="list_file", help="每行一个路径的文件列表")
+    parser.add_argument("-j", "--workers", type=int, default=1, help="工作进程数")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="每个进程的 torch 线程数（默认按 CPU 核数平均分配）")
+    parser.add_argument("--device", default="cpu", help="cpu 或 cuda")
+    parser.add_argument("--profile", choices=sorted(SEPARATION_PROFILES),
+                        help="速度/质量档位（默认使用该设备在播放器中的设置）")
+    parser.add_argument("--backend", choices=BACKENDS,
+                        default=settings.get("separation_backend", "eager"),
+                        help="推理后端，导出失败时自动回退到 eager")
+    parser.add_argument("--cache-dir", default=settings.get("stem_cache_dir") or None,
+                        help="分离缓存目录（默认与播放器相同）")
+    # 批量处理的目的就是把结果留在缓存里，默认不设上限，避免后面的歌曲把前面的淘汰掉
+    parser.add_argument("--cache-max-mb", type=int, default=0,
+                        help="缓存容量上限（MB），默认 0 表示不设上限")
+    parser.add_argument("--report", default="separation_report.json", help="JSON 报告路径")
+    parser.add_argument("--compare-int8", metavar="CLIP",
+                        help="仅在给定音频上对比 fp32 与 int8 的 CPU 推理速度和 SDR 偏差")
+    parser.add_argument("--compare-backend", metavar="CLIP",
+                        help="仅在给定音频上对比 eager 与 --backend 导出计算图的输出误差，超出容差时返回 1")
+    parser.add_argument("--compare-profiles", metavar="CLIP",
+                        help="仅在给定音频上对比 fast 与 balanced 档位的分离耗时，fast 不更快时返回 1")
+    args = parser.parse_args(argv)
+
+    if args.compare_backend:
+        configure_backend("eager", os.path.join(args.cache_dir or default_cache_dir(), "_models"))
+        result = compare_backends(args.compare_backend, args.backend, device=args.device,
+                                  threads=args.threads or None)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0 if result.get("within_tolerance") else 1
+
+    if args.compare_profiles:
+        result = compare_profiles(args.compare_profiles, device=args.device,
+                                  threads=args.threads or None)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0 if result["fast"] < result["balanced"] else 1
+
+    if args.compare_int8:
+        result = compare_cpu_acceleration(args.compare_int8, threads=args.threads or None)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+
+    files = collect_files(args.inputs, args.list_file)
+    if not files:
+        parser.error("没有找到可处理的音乐文件")
+    workers = max(1, args.workers)
+    threads = args.threads or max(1, cpu // workers)
+    cache = StemCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+    profile = args.profile or (settings.get("separation_profiles") or {}).get(args.device)
+
+    # 续跑：沿用已有报告中的记录，并跳过已在缓存中的歌曲
+    records = {}
+    if os.path.exists(args.report):
+        try:
+            with open(args.report, "r", encoding="utf-8") as f:
+                records = {r["path"]: r for r in json.load(f).get("tracks", [])}
+        except (OSError, ValueError, KeyError):
+            records = {}
+    pending = [f for f in files if not is_cached(f, cache, profile)]
+    print(f"共 {len(files)} 首，待处理 {len(pending)} 首，{workers} 个进程 × {threads} 线程")
+
+    report = {
+        "device": args.device,
+        "profile": profile,
+        "backend": args.backend,
+        "workers": workers,
+        "threads_per_worker": threads,
+        "tracks": list(records.values()),
+        "summary": _summary(records.values()),
+    }
+    started = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(args.device, threads, cache.cache_dir, cache.max_bytes, profile, args.backend),
+    ) as pool:
+        futures = [pool.submit(_separate_one, path) for path in pending]
+        for n, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            records[record["path"]] = record
+            rtf = record.get("rtf")
+            print(f"[{n}/{len(pending)}] {record['status']} "
+                  f"{os.path.basename(record['path'])}"
+                  + (f" RTF={rtf:.2f}" if rtf else ""))
+            report["tracks"] = list(records.values())
+            report["summary"] = _summary(records.values())
+            report["elapsed_seconds"] = time.perf_counter() - started
+            _write_report(args.report, report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
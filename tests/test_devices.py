@@ -0,0 +1,21 @@
+"""重新扫描音频硬件的封装。"""
+
+import pytest
+
+sd = pytest.importorskip("sounddevice")
+
+from audio import devices  # noqa: E402
+
+
+def test_reinitialize_calls_portaudio(monkeypatch):
+    calls = []
+    monkeypatch.setattr(sd, "_terminate", lambda: calls.append("terminate"), raising=False)
+    monkeypatch.setattr(sd, "_initialize", lambda: calls.append("initialize"), raising=False)
+    assert devices.reinitialize_portaudio()
+    assert calls == ["terminate", "initialize"]
+
+
+def test_reinitialize_without_private_api_skips_rescan(monkeypatch):
+    monkeypatch.delattr(sd, "_terminate", raising=False)
+    monkeypatch.delattr(sd, "_initialize", raising=False)
+    assert not devices.reinitialize_portaudio()
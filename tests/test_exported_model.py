@@ -0,0 +1,90 @@
+"""导出计算图与 eager 输出的误差校验。"""
+
+import json
+import os
+
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from audio import exported_model  # noqa: E402
+from audio.exported_model import EXPORT_TOLERANCE, load_exported, max_abs_diff  # noqa: E402
+
+
+class TinySeparator(torch.nn.Module):
+    """具备 apply_model 所需属性的最小模型，避免测试下载 Demucs 权重。"""
+
+    def __init__(self):
+        super().__init__()
+        torch.manual_seed(0)
+        self.sources = ["vocals", "accompaniment"]
+        self.samplerate = 8000
+        self.audio_channels = 2
+        self.segment = 0.5
+        self.conv = torch.nn.Conv1d(2, 4, kernel_size=5, padding=2)
+
+    def forward(self, mix):
+        out = self.conv(mix)
+        return out.view(mix.shape[0], len(self.sources), self.audio_channels, -1)
+
+
+def _meta_files(export_dir):
+    return sorted(name for name in os.listdir(export_dir) if name.endswith(".json"))
+
+
+def _example(model):
+    torch.manual_seed(1)
+    return torch.randn(1, model.audio_channels, int(model.segment * model.samplerate))
+
+
+def test_torchscript_matches_eager(tmp_path):
+    eager = TinySeparator().eval()
+    exported = load_exported(eager, "tiny", "cpu", "torchscript", str(tmp_path))
+    assert exported is not None
+    assert max_abs_diff(eager, exported, _example(eager)) <= EXPORT_TOLERANCE
+
+    (meta_name,) = _meta_files(tmp_path)
+    with open(tmp_path / meta_name, encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["max_abs_diff"] <= EXPORT_TOLERANCE
+    assert meta["versions"] == exported_model._versions("torchscript")
+
+
+def test_out_of_tolerance_falls_back(tmp_path):
+    eager = TinySeparator().eval()
+    assert load_exported(eager, "tiny", "cpu", "torchscript", str(tmp_path), tolerance=-1.0) is None
+
+
+def test_stale_versions_are_verified_again(tmp_path):
+    eager = TinySeparator().eval()
+    assert load_exported(eager, "tiny", "cpu", "torchscript", str(tmp_path)) is not None
+    (meta_name,) = _meta_files(tmp_path)
+    meta_path = tmp_path / meta_name
+
+    # 旧版本记录的结论（即使超出容差）不再可信，必须重新比较而不是直接拒绝
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump({"max_abs_diff": 1.0, "tolerance": EXPORT_TOLERANCE,
+                   "versions": {"torch": "0.0"}}, f)
+    assert load_exported(eager, "tiny", "cpu", "torchscript", str(tmp_path)) is not None
+    with open(meta_path, encoding="utf-8") as f:
+        meta = json.load(f)
+    assert meta["versions"] == exported_model._versions("torchscript")
+    assert meta["max_abs_diff"] <= EXPORT_TOLERANCE
+
+
+def test_version_change_exports_again(tmp_path, monkeypatch):
+    eager = TinySeparator().eval()
+    assert load_exported(eager, "tiny", "cpu", "torchscript", str(tmp_path)) is not None
+    versions = exported_model._versions("torchscript")
+
+    # 升级库后导出文件换一个名字，重新导出并记录新版本下的误差
+    upgraded = dict(versions, torch=versions["torch"] + "+upgraded")
+    monkeypatch.setattr(exported_model, "_versions", lambda backend: dict(upgraded))
+    assert load_exported(eager, "tiny", "cpu", "torchscript", str(tmp_path)) is not None
+    metas = _meta_files(tmp_path)
+    assert len(metas) == 2
+    recorded = []
+    for name in metas:
+        with open(tmp_path / name, encoding="utf-8") as f:
+            recorded.append(json.load(f)["versions"])
+    assert upgraded in recorded and versions in recorded
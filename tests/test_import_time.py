@@ -0,0 +1,21 @@
+"""界面模块的导入耗时与延迟加载。"""
+
+import pytest
+
+# audio.benchmarks 经由音频引擎导入 sounddevice
+pytest.importorskip("sounddevice")
+
+from audio.benchmarks import DEFERRED_MODULES, IMPORT_TIME_BUDGET, measure_import_time  # noqa: E402
+
+
+def test_ui_import_defers_torch_and_fits_budget():
+    try:
+        result = measure_import_time()
+    except RuntimeError as e:
+        # 子进程缺少界面依赖（如 ttkbootstrap）时无法测量
+        if "ModuleNotFoundError" in str(e):
+            pytest.skip(str(e).splitlines()[-1])
+        raise
+    assert "torch" in DEFERRED_MODULES
+    assert result["loaded"] == []
+    assert result["seconds"] <= IMPORT_TIME_BUDGET
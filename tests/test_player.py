@@ -0,0 +1,63 @@
+"""热切换到分离结果后的跳转与输出。"""
+
+import types
+
+import numpy as np
+
+from audio.player import AudioPlayer
+from audio.stream_buffer import ProgressiveAudio, ProgressiveStems
+
+SR = 8000
+BLOCK = 256
+
+
+def _player_on_partial_decode():
+    original = ProgressiveAudio(4 * SR, 2, SR)
+    original.write(0, np.full((SR, 2), 0.5, dtype=np.float32))
+    engine = types.SimpleNamespace(blocksize=BLOCK)
+    player = AudioPlayer(original.data, None, SR, progress=original, engine=engine)
+    player.playing = True
+    return player, original
+
+
+def _render(player, blocks=1):
+    out = np.zeros((BLOCK, 2), dtype=np.float32)
+    for _ in range(blocks):
+        player.render(out, BLOCK)
+    return out
+
+
+def test_seek_is_free_after_swap_to_complete_stems():
+    player, original = _player_on_partial_decode()
+    player.seek_to(0.75)
+    _render(player)
+    # 原曲只解码了第一秒，跳转被限制在已就绪的位置
+    assert player.position <= original.ready + BLOCK
+
+    stems = np.full((4 * SR, 2), 0.25, dtype=np.float32)
+    player.swap_sources(stems, stems, None, crossfade=0.01)
+    _render(player)
+    # 待切换的数据已完整，淡化期间即可跳到原曲尚未解码的部分
+    player.seek_to(0.75)
+    _render(player, 2)
+    assert player._pending is None
+    assert player.progress is None
+    assert player.position == 3 * SR + 2 * BLOCK
+
+    player.seek_to(0.875)
+    out = _render(player)
+    assert player.position == int(3.5 * SR) + BLOCK
+    assert np.allclose(out, 0.5)
+
+
+def test_swap_to_finished_progress_drops_it():
+    player, _ = _player_on_partial_decode()
+    stems = ProgressiveStems(4 * SR, 2, SR)
+    stems.write(0, np.ones((4 * SR, 2), np.float32), np.ones((4 * SR, 2), np.float32))
+    stems.finish()
+    player.swap_sources(stems.vocals, stems.accomp, stems, crossfade=0.01)
+    _render(player, 2)
+    assert player.progress is None
+    player.seek_to(0.75)
+    _render(player)
+    assert player.position == 3 * SR + BLOCK
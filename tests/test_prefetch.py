@@ -0,0 +1,24 @@
+"""预取规划的随机模式预测。"""
+
+from audio.prefetch import PrefetchPlanner
+
+
+def test_shuffle_prediction_with_queue_keeps_plan_and_skips_current():
+    files = [f"{i}.flac" for i in range(10)]
+    planner = PrefetchPlanner(depth=4)
+    shuffled = planner.shuffle_plan(files, "0.flac", count=5)
+    queued = shuffled[0]
+
+    plan = planner.predict(files, "0.flac", "随机", queue=[queued])
+    assert plan[0] == queued
+    assert "0.flac" not in plan
+    assert len(set(plan)) == len(plan) == 4
+    # 待播列表的最后一首仍留在随机计划中，预测不会把它删掉
+    assert planner.shuffle_plan(files, "0.flac", count=5) == shuffled
+
+
+def test_shuffle_prediction_matches_actual_order():
+    files = [f"{i}.flac" for i in range(10)]
+    planner = PrefetchPlanner(depth=3)
+    predicted = planner.predict(files, "0.flac", "随机")
+    assert predicted == planner.shuffle_plan(files, "0.flac", count=3)
@@ -0,0 +1,58 @@
+"""调度器的任务合并与取消。"""
+
+import pytest
+
+from audio.scheduler import (
+    PRIORITY_BACKGROUND,
+    PRIORITY_CURRENT,
+    PRIORITY_NEXT,
+    PRIORITY_PREV,
+    SeparationScheduler,
+    job_key,
+)
+
+
+@pytest.fixture
+def scheduler():
+    """持有调度锁，推理线程在测试期间取不到任务。"""
+    scheduler = SeparationScheduler()
+    with scheduler._cond:
+        yield scheduler
+
+
+def test_background_merge_keeps_session(scheduler):
+    job = scheduler.submit("a.flac", "cpu", PRIORITY_NEXT, session_id="A", target_sr=48000)
+    merged = scheduler.submit("a.flac", "cpu", PRIORITY_BACKGROUND, target_sr=48000)
+    assert merged is job
+    assert job.session_id == "A"
+    assert job.priority == PRIORITY_NEXT
+
+    scheduler.cancel_stale("B")
+    assert job.cancelled
+
+
+def test_merge_takes_session_of_highest_priority(scheduler):
+    job = scheduler.submit("a.flac", "cpu", PRIORITY_BACKGROUND, target_sr=48000)
+    scheduler.submit("a.flac", "cpu", PRIORITY_NEXT, session_id="A", target_sr=48000)
+    assert job.session_id == "A"
+    assert job.priority == PRIORITY_NEXT
+
+    # 优先级更低的其他会话提交不接管任务
+    scheduler.submit("a.flac", "cpu", PRIORITY_PREV, session_id="B", target_sr=48000)
+    assert job.session_id == "A"
+    scheduler.submit("a.flac", "cpu", PRIORITY_CURRENT, session_id="B", target_sr=48000)
+    assert job.session_id == "B"
+    assert job.priority == PRIORITY_CURRENT
+
+
+def test_cancel_stale_keeps_only_matching_key(scheduler):
+    same = scheduler.submit("a.flac", "cpu", PRIORITY_NEXT, session_id="A", target_sr=48000)
+    other_rate = scheduler.submit("a.flac", "cpu", PRIORITY_NEXT, session_id="A", target_sr=44100)
+    other_file = scheduler.submit("b.flac", "cpu", PRIORITY_PREV, session_id="A", target_sr=48000)
+    background = scheduler.submit("c.flac", "cpu", PRIORITY_BACKGROUND, target_sr=48000)
+
+    scheduler.cancel_stale("B", keep=job_key("a.flac", "cpu", None, 48000))
+    assert not same.cancelled
+    assert other_rate.cancelled
+    assert other_file.cancelled
+    assert not background.cancelled
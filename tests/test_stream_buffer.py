@@ -0,0 +1,50 @@
+"""边转换边播放的采样率转换。"""
+
+import threading
+
+import numpy as np
+
+from audio.stream_buffer import ProgressiveStems, resample_progressive
+
+
+def _sine(frames, sample_rate, freq=440.0):
+    return np.sin(2 * np.pi * freq * np.arange(frames) / sample_rate).astype(np.float32)
+
+
+def test_resample_progressive_is_time_aligned():
+    sr, target = 44100, 48000
+    data = np.stack([_sine(2 * sr, sr)] * 2, axis=1)
+    stored = []
+    stems = resample_progressive(data, data * 0.5, sr, target, on_finished=stored.append)
+    assert stems.wait_finished(timeout=30)
+    assert stored == [stems]
+    assert stems.num_frames == 2 * target
+    expected = _sine(2 * target, target)
+    # 滤波器延迟已扣除，剩余误差只来自不足一个样本的相位差
+    assert np.abs(stems.vocals[:, 0] - expected)[100:-100].max() < 0.05
+    assert np.abs(stems.accomp[:, 1] - 0.5 * expected)[100:-100].max() < 0.05
+
+
+def test_resample_progressive_follows_source():
+    sr, target = 48000, 44100
+    source = ProgressiveStems(3 * sr, 1, sr)
+    stems = resample_progressive(source.vocals, source.accomp, sr, target, source=source)
+    # 源数据尚未写入时不会转换出任何帧
+    assert not stems.wait_for(1, timeout=0.2)
+
+    block = _sine(3 * sr, sr)[:, None]
+    writer = threading.Thread(target=lambda: (source.write(0, block, block), source.finish()))
+    writer.start()
+    assert stems.wait_finished(timeout=30)
+    writer.join()
+    assert stems.error is None
+    assert np.abs(stems.vocals[100:-100, 0] - _sine(3 * target, target)[100:-100]).max() < 0.05
+
+
+def test_resample_progressive_propagates_source_error():
+    source = ProgressiveStems(48000, 2, 48000)
+    stems = resample_progressive(source.vocals, source.accomp, 48000, 44100, source=source)
+    error = RuntimeError("decode failed")
+    source.finish(error)
+    assert not stems.wait_finished(timeout=30)
+    assert stems.error is error
@@ -1,6 +1,7 @@
 """提供上一首、下一首及暂停逻辑的混入类。"""
 
 import threading
+from tkinter import messagebox
 
 
 class ControlMixin:
@@ -10,7 +11,11 @@ class ControlMixin:
         """在暂停和继续之间切换播放状态。"""
         if self.player:
             if self.player.paused:
-                self.player.resume()
+                try:
+                    self.player.resume()
+                except Exception as e:
+                    messagebox.showerror("音频设备错误", str(e))
+                    return
                 self.pause_button.config(text="⏸ 暂停")
                 if hasattr(self, "pause_button_lyrics"):
                     self.pause_button_lyrics.config(text="⏸ 暂停")
@@ -24,67 +29,33 @@ class ControlMixin:
         """播放上一次播放过的歌曲（如果有）。"""
         if not self.music_files:
             return
+        prev_index = None
         if self.play_history:
             entry = self.play_history.pop()
             path = entry["path"] if isinstance(entry, dict) else entry
             if path in self.music_files:
                 prev_index = self.music_files.index(path)
-                if self.player:
-                    self.player.stop()
-                    self.player = None
-                self.current_index = prev_index
-                if self.prev_audio_data and self.prev_audio_data[0] == prev_index:
-                    _, vocals, accomp, sr = self.prev_audio_data
-                    threading.Thread(
-                        target=lambda: self.play_song(
-                            prev_index,
-                            (vocals, accomp, sr),
-                            update_history=False,
-                            resume=False,
-                            keep_current_as_next=True,
-                        ),
-                        daemon=True,
-                    ).start()
-                else:
-                    threading.Thread(
-                        target=lambda: self.play_song(
-                            prev_index,
-                            update_history=False,
-                            resume=False,
-                            keep_current_as_next=True,
-                        ),
-                        daemon=True,
-                    ).start()
-                return
-        prev_index = self.get_prev_index()
         if prev_index is None:
-            return
+            prev_index = self.get_prev_index()
+            if prev_index is None:
+                return
         if self.player:
             self.player.stop()
             self.player = None
         self.current_index = prev_index
-        if self.prev_audio_data and self.prev_audio_data[0] == prev_index:
-            _, vocals, accomp, sr = self.prev_audio_data
-            threading.Thread(
-                target=lambda: self.play_song(
-                    prev_index,
-                    (vocals, accomp, sr),
-                    update_history=False,
-                    resume=False,
-                    keep_current_as_next=True,
-                ),
-                daemon=True,
-            ).start()
-        else:
-            threading.Thread(
-                target=lambda: self.play_song(
-                    prev_index,
-                    update_history=False,
-                    resume=False,
-                    keep_current_as_next=True,
-                ),
-                daemon=True,
-            ).start()
+        # 上一首槽位之外，预取计划的 ahead: 槽位里也可能已准备好这首
+        prepared = self.take_prepared(prev_index, "prev_audio_data")
+        self.prefetch.record("prev", prepared is not None)
+        threading.Thread(
+            target=lambda: self.play_song(
+                prev_index,
+                prepared,
+                update_history=False,
+                resume=False,
+                keep_current_as_next=True,
+            ),
+            daemon=True,
+        ).start()
 
     def play_next_song_manual(self):
         """手动跳到下一首歌曲。"""
@@ -95,19 +66,13 @@ class ControlMixin:
                 self.player.stop()
                 self.player = None
             self.current_index = next_index
-            if self.next_audio_data and self.next_audio_data[0] == next_index:
-                _, vocals, accomp, sr = self.next_audio_data
-                threading.Thread(
-                    target=lambda: self.play_song(
-                        next_index, (vocals, accomp, sr), resume=False
-                    ),
-                    daemon=True,
-                ).start()
-            else:
-                threading.Thread(
-                    target=lambda: self.play_song(next_index, resume=False),
-                    daemon=True,
-                ).start()
+            # 下一首槽位之外，预取计划的 ahead: 槽位里也可能已准备好这首，不必再分离一遍
+            prepared = self.take_prepared(next_index, "next_audio_data")
+            self.prefetch.record("next", prepared is not None)
+            threading.Thread(
+                target=lambda: self.play_song(next_index, prepared, resume=False),
+                daemon=True,
+            ).start()
 
     def seek_relative(self, seconds):
         """相对当前时间快进或快退指定秒数。"""
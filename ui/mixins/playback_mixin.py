@@ -1,22 +1,61 @@
 """包含预加载及自动播放下一曲等核心播放逻辑的混入类。"""
 
 import os
-import random
 import threading
 import time
 import uuid
 from tkinter import messagebox
 import tkinter as tk
-import sounddevice as sd
 
-from utils.audio_utils import resample_audio
-from audio.separator import separate_audio_in_memory
+from audio.separator import convert_progressive, load_cached, open_cached_stream
+from audio.scheduler import (
+    PRIORITY_CURRENT,
+    PRIORITY_NEXT,
+    PRIORITY_PREV,
+    PRIORITY_AHEAD,
+    SeparationCancelled,
+    job_key,
+)
 from audio.player import AudioPlayer
+from audio.decoder import decode_progressive
+from audio.stem_cache import prefetch
+from audio.buffers import AHEAD_PREFIX
+
+# 分离结果领先播放位置至少这么多秒后才从原曲切换，避免切换后立即断流
+SWAP_MARGIN_SECONDS = 2.0
+# 缓存的分离结果以内存映射打开，开始播放前在后台预读这么多秒，其余部分交给系统预读
+PREFETCH_SECONDS = 30.0
 
 
 class PlaybackMixin:
     """提供播放相关方法的混入类。"""
 
+    # 当前/下一首/上一首的 (索引, 人声, 伴奏, 采样率) 统一存放在内存预算管理器中，
+    # 赋值时按预算把暂不需要的歌曲溢出到磁盘
+    @property
+    def current_audio_data(self):
+        return self.buffers.get("current")
+
+    @current_audio_data.setter
+    def current_audio_data(self, data):
+        self.buffers.put("current", data)
+
+    @property
+    def next_audio_data(self):
+        return self.buffers.get("next")
+
+    @next_audio_data.setter
+    def next_audio_data(self, data):
+        self.buffers.put("next", data)
+
+    @property
+    def prev_audio_data(self):
+        return self.buffers.get("prev")
+
+    @prev_audio_data.setter
+    def prev_audio_data(self, data):
+        self.buffers.put("prev", data)
+
     def play_song(self, index, preloaded=None, update_history=True, resume=True, keep_current_as_next=False):
         """播放指定索引的歌曲，可使用预加载的音频数据。"""
         if not self.play_lock.acquire(blocking=False):
@@ -25,15 +64,23 @@ class PlaybackMixin:
             self.auto_next_enabled = True
             self.session_id = str(uuid.uuid4())
             current_session = self.session_id
+            # 无论新歌是否命中缓存，旧会话的分离任务都不再需要，立即让出推理线程
+            keep = job_key(self.music_files[index], self.device_choice.get(), self.current_profile(),
+                           self.get_output_samplerate(self.get_selected_output_index(), None))
+            self.scheduler.cancel_stale(current_session, keep=keep)
             self.next_audio_data = None
             old_data = self.current_audio_data
             if update_history and self.audio_path:
                 self.play_history.append({"path": self.audio_path, "time": time.time()})
                 if len(self.play_history) > self.history_limit:
                     self.play_history = self.play_history[-self.history_limit:]
-            if self.player:
-                self.player.stop()
+            with self.track_lock:
+                # 引擎可能刚接续到排队的下一首、界面还没同步，一并停掉
+                for track in (self.player, self.queued_next and self.queued_next[0]):
+                    if track:
+                        track.stop()
                 self.player = None
+                self.queued_next = None
             if old_data:
                 if keep_current_as_next:
                     self.next_audio_data = old_data
@@ -41,6 +88,7 @@ class PlaybackMixin:
                     self.prev_audio_data = old_data
             self.current_audio_data = None
             self.current_index = index
+            self.prefetch.advance(self.music_files[index])
 
             self.audio_path = self.music_files[index]
             song_name = os.path.basename(self.audio_path)
@@ -50,36 +98,91 @@ class PlaybackMixin:
             if hasattr(self, "pause_button_lyrics"):
                 self.pause_button_lyrics.config(state=tk.NORMAL)
 
+            mic_dev = None if not self.mic_enabled.get() else self.get_selected_mic_index()
+            out_dev = self.get_selected_output_index()
+            progress = None
+            swap_job = None
+            stream = None
+            # 渐进分离完成时提示；压缩缓存解码与采样率转换完成时不提示
+            announce = False
+            if not preloaded:
+                # 优先读取已转换到输出采样率的副本；只有原始结果时在下面边转换边播放，
+                # 转换结果写回缓存，下次直接内存映射
+                preloaded = load_cached(self.audio_path, self.stem_cache, self.current_profile(),
+                                        self.get_output_samplerate(out_dev, None))
+            if not preloaded:
+                stream = open_cached_stream(self.audio_path, self.stem_cache, self.current_profile(),
+                                            target_sr=self.get_output_samplerate(out_dev, None))
             if preloaded:
                 vocals, accomp, sr = preloaded
+                self.prefetch_stems(vocals, accomp, sr, background=True)
                 self.lyrics_box.insert("end", "✅ 使用缓存播放\n")
+            elif stream is not None:
+                self.lyrics_box.insert("end", "✅ 使用压缩缓存播放\n")
+                progress = stream
+                if stream.error is not None:
+                    raise stream.error
+                vocals, accomp, sr = stream.vocals, stream.accomp, stream.sample_rate
+            elif self.instant_playback:
+                # 先边解码边播放原曲，分离结果追上后再无缝切换
+                target = self.get_output_samplerate(out_dev, None)
+                swap_job = self.scheduler.submit(
+                    self.audio_path, self.device_choice.get(), PRIORITY_CURRENT,
+                    session_id=current_session, target_sr=target,
+                    profile=self.current_profile(),
+                )
+                self.lyrics_box.insert("end", "🎵 先播放原曲，人声分离完成后自动切换...\n")
+                progress = decode_progressive(self.audio_path, target_sr=target)
+                progress.wait_for(1)
+                if progress.error is not None:
+                    raise progress.error
+                vocals, accomp, sr = progress.data, None, progress.sample_rate
             else:
                 self.lyrics_box.insert("end", "🎶 正在分离人声...\n")
                 self.show_toast("正在分离中...")
-                device = self.device_choice.get()
-                vocals, accomp, sr = separate_audio_in_memory(self.audio_path, device=device)
+                # 目标采样率与预加载一致，便于复用正在进行的预加载任务
+                job = self.scheduler.submit(
+                    self.audio_path, self.device_choice.get(), PRIORITY_CURRENT,
+                    session_id=current_session,
+                    target_sr=self.get_output_samplerate(out_dev, None),
+                    profile=self.current_profile(),
+                )
+                try:
+                    progress = job.wait_started()
+                    if self.progressive_separation:
+                        progress.wait_for(1)
+                    else:
+                        progress.wait_finished()
+                except SeparationCancelled:
+                    return
+                if progress.error is not None:
+                    if isinstance(progress.error, SeparationCancelled):
+                        return
+                    raise progress.error
                 if self.session_id != current_session:
                     return
-                self.lyrics_box.insert("end", "✅ 分离完成，开始播放\n")
-                self.show_toast("分离完成")
+                if progress.finished:
+                    self.lyrics_box.insert("end", "✅ 分离完成，开始播放\n")
+                    self.show_toast("分离完成")
+                vocals, accomp, sr = progress.vocals, progress.accomp, progress.sample_rate
+                if progress.finished:
+                    progress = None
+                announce = True
 
-            mic_dev = None if not self.mic_enabled.get() else self.get_selected_mic_index()
-            out_dev = self.get_selected_output_index()
-            try:
-                dev_info = sd.query_devices(out_dev, 'output') if out_dev is not None else sd.query_devices(None, 'output')
-                target_sr = int(dev_info.get('default_samplerate', sr)) or sr
-                if target_sr <= 0 or target_sr > 192000:
-                    target_sr = sr
-            except Exception:
-                target_sr = sr
-            if sr != target_sr:
-                vocals = resample_audio(vocals, sr, target_sr)
-                accomp = resample_audio(accomp, sr, target_sr)
-                sr = target_sr
-            self.player = AudioPlayer(vocals, accomp, sr, output_device=out_dev, mic_device=mic_dev, mic_enabled=self.mic_enabled.get(), latency=0.03)
-            self.player.set_mic_volume(self.mic_volume.get())
-            self.player.set_vocal_volume(self.vocal_volume.get())
-            self.player.set_accomp_volume(self.accomp_volume.get())
+            target_sr = self.get_output_samplerate(out_dev, sr)
+            if sr != target_sr and accomp is not None:
+                # 缓存结果或预加载数据是其他采样率：后台逐段转换，首段就绪即开始播放，
+                # 不在界面线程中等待整首转换。压缩缓存解码完成时自己会写入转换后的副本
+                progress = convert_progressive(self.audio_path, self.stem_cache if stream is None else None,
+                                               self.current_profile(), vocals, accomp, sr, target_sr,
+                                               source=progress)
+                progress.wait_for(1)
+                if progress.error is not None:
+                    raise progress.error
+                vocals, accomp, sr = progress.vocals, progress.accomp, target_sr
+                announce = False
+            self.configure_audio_engine(out_dev, mic_dev)
+            self.player = self.create_player(vocals, accomp, sr, progress)
             try:
                 self.player.play()
             except Exception as e:
@@ -90,7 +193,20 @@ class PlaybackMixin:
             if self.player.output_device is None and out_dev is not None:
                 self.output_device.set("默认")
                 self.persist_settings()
-            self.current_audio_data = (index, vocals, accomp, sr)
+            self.set_stem_sliders_enabled(swap_job is None)
+            if swap_job is not None:
+                player = self.player
+                threading.Thread(
+                    target=lambda: self.swap_to_stems(current_session, index, swap_job, player),
+                    daemon=True,
+                ).start()
+            elif progress is None:
+                self.current_audio_data = (index, vocals, accomp, sr)
+            else:
+                threading.Thread(
+                    target=lambda: self.finish_progressive(current_session, index, progress, announce),
+                    daemon=True,
+                ).start()
 
             lrc_path = os.path.splitext(self.audio_path)[0] + ".lrc"
             self.load_and_display_lyrics(lrc_path, self.player)
@@ -104,13 +220,104 @@ class PlaybackMixin:
 
             threading.Thread(target=lambda: self.preload_next_song(current_session), daemon=True).start()
             threading.Thread(target=lambda: self.preload_prev_song(current_session), daemon=True).start()
-            threading.Thread(target=lambda: self.monitor_and_play_next(current_session), daemon=True).start()
+            threading.Thread(target=lambda: self.preload_ahead(current_session), daemon=True).start()
         except Exception as e:
             messagebox.showerror("出错", str(e))
         finally:
             self.play_lock.release()
             self.persist_settings()
 
+    def configure_audio_engine(self, out_dev, mic_dev):
+        """输出流尚未打开（首次播放或上次打开失败）时按界面选择配置引擎的设备。
+
+        打开后一直复用，设备变化由 on_output_device_change 等处理。
+        """
+        engine = self.audio_engine
+        if engine.stream is None:
+            engine.output_device = out_dev
+            engine.mic_device = mic_dev
+            engine.mic_enabled = self.mic_enabled.get()
+            engine.duplex = self.duplex_mic.get()
+        engine.set_mic_volume(self.mic_volume.get())
+
+    def create_player(self, vocals, accomp, sr, progress=None, owner="player"):
+        """创建挂在共用音频引擎上的播放器并套用当前音量，其数据计入内存预算。"""
+        player = AudioPlayer(vocals, accomp, sr, progress=progress, engine=self.audio_engine)
+        self.buffers.track(owner, vocals, accomp)
+        player.set_vocal_volume(self.vocal_volume.get())
+        player.set_accomp_volume(self.accomp_volume.get())
+        return player
+
+    def swap_to_stems(self, session_id, index, job, player):
+        """等分离结果领先播放位置后，从原曲无缝切换到人声/伴奏混音。"""
+        try:
+            stems = job.wait_started()
+        except SeparationCancelled:
+            return
+        except Exception as e:
+            self.lyrics_box.insert("end", f"⚠️ 分离失败，继续播放原曲：{e}\n")
+            return
+        if stems.sample_rate != player.sample_rate:
+            # 缓存命中时结果可能是其他采样率：边分离边转换，转换结果领先播放位置后再切换
+            stems = convert_progressive(self.music_files[index], self.stem_cache, self.current_profile(),
+                                        stems.vocals, stems.accomp, stems.sample_rate,
+                                        player.sample_rate, source=stems)
+        margin = int(SWAP_MARGIN_SECONDS * stems.sample_rate)
+        # 每写完一段都会唤醒一次，重新按最新的播放位置判断
+        while session_id == self.session_id and self.player is player and player.playing:
+            if stems.wait_for(player.position + margin, timeout=1.0):
+                break
+        if session_id != self.session_id or self.player is not player or not player.playing:
+            return
+        if stems.error is not None:
+            if not isinstance(stems.error, SeparationCancelled):
+                self.lyrics_box.insert("end", f"⚠️ 分离失败，继续播放原曲：{stems.error}\n")
+            return
+        vocals, accomp = stems.vocals, stems.accomp
+        player.swap_sources(vocals, accomp, None if stems.finished else stems)
+        self.buffers.track("stems", vocals, accomp)
+        self.set_stem_sliders_enabled(True)
+        self.lyrics_box.insert("end", "✅ 已切换到人声分离播放\n")
+        if stems.wait_finished() and session_id == self.session_id:
+            self.current_audio_data = (index, vocals, accomp, player.sample_rate)
+
+    def prefetch_stems(self, vocals, accomp, sr, background=False):
+        """预读内存映射的分离结果开头部分，background 为 True 时在后台线程中进行。"""
+        def run():
+            frames = int(PREFETCH_SECONDS * sr)
+            for data in (vocals, accomp):
+                try:
+                    prefetch(data, 0, frames)
+                except (OSError, ValueError):
+                    return
+        if background:
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            run()
+
+    def set_stem_sliders_enabled(self, enabled):
+        """启用或禁用人声/伴奏音量滑块（播放原曲时无法单独调节）。"""
+        state = tk.NORMAL if enabled else tk.DISABLED
+        for name in ("vol_slider", "accomp_slider"):
+            if hasattr(self, name):
+                getattr(self, name).config(state=state)
+
+    def finish_progressive(self, session_id, index, progress, announce=True):
+        """等待渐进分离（或解码、转换）完成后登记为当前歌曲的完整数据；announce 为 True 时提示分离完成。"""
+        ok = progress.wait_finished()
+        if session_id != self.session_id:
+            return
+        if ok:
+            self.current_audio_data = (index, progress.vocals, progress.accomp, progress.sample_rate)
+            if announce:
+                self.lyrics_box.insert("end", "✅ 分离完成\n")
+        elif not isinstance(progress.error, SeparationCancelled):
+            self.lyrics_box.insert("end", f"⚠️ 分离中断：{progress.error}\n")
+
+    def get_output_samplerate(self, out_dev, fallback):
+        """从设备注册表读取输出设备的默认采样率，失败时返回 fallback。"""
+        return self.devices.default_samplerate(out_dev, "output", fallback)
+
     def preload_next_song(self, session_id):
         """在后台线程预加载下一首歌曲。"""
         next_index = self.get_next_index(peek=True)
@@ -118,17 +325,58 @@ class PlaybackMixin:
             return
         if self.prev_audio_data and self.prev_audio_data[0] == next_index:
             self.next_audio_data = self.prev_audio_data
+            self.queue_next_track(session_id)
             return
         if self.next_audio_data and self.next_audio_data[0] == next_index:
+            self.queue_next_track(session_id)
             return
         next_path = self.music_files[next_index]
+        ahead = self.buffers.get(AHEAD_PREFIX + next_path)
+        if ahead is not None:
+            # 上一轮预取计划已准备好这首
+            self.next_audio_data = (next_index, *ahead[1:])
+            self.buffers.put(AHEAD_PREFIX + next_path, None)
+            self.queue_next_track(session_id)
+            return
         try:
-            device = self.device_choice.get()
-            vocals, accomp, sr = separate_audio_in_memory(next_path, device=device)
+            job = self.scheduler.submit(
+                next_path, self.device_choice.get(), PRIORITY_NEXT,
+                session_id=session_id,
+                target_sr=self.get_output_samplerate(self.get_selected_output_index(), None),
+                profile=self.current_profile(),
+            )
+            vocals, accomp, sr = job.result()
             if session_id == self.session_id:
                 self.next_audio_data = (next_index, vocals, accomp, sr)
         except Exception:
             self.next_audio_data = None
+            return
+        self.queue_next_track(session_id)
+
+    def reconvert_preloaded(self, session_id):
+        """输出设备改变后，在后台把预加载的上一首/下一首转换到新设备的采样率。
+
+        有分离缓存时转换结果按采样率写入缓存，之后切回同一采样率时直接读取。
+        """
+        target_sr = self.get_output_samplerate(self.get_selected_output_index(), None)
+        if not target_sr:
+            return
+        for name in ("next_audio_data", "prev_audio_data"):
+            data = getattr(self, name)
+            if not data or data[3] == target_sr or session_id != self.session_id:
+                continue
+            index, vocals, accomp, sr = data
+            converted = load_cached(self.music_files[index], self.stem_cache,
+                                    self.current_profile(), target_sr)
+            if converted is None or converted[2] != target_sr:
+                stems = convert_progressive(self.music_files[index], self.stem_cache,
+                                            self.current_profile(), vocals, accomp, sr, target_sr)
+                if not stems.wait_finished():
+                    continue
+                converted = (stems.vocals, stems.accomp, target_sr)
+            # 转换期间已被替换（切歌或重新预加载）时丢弃结果
+            if getattr(self, name) is data and session_id == self.session_id:
+                setattr(self, name, (index, *converted))
 
     def preload_prev_song(self, session_id):
         """预加载上一首历史歌曲。"""
@@ -142,72 +390,164 @@ class PlaybackMixin:
             return
         prev_path = self.music_files[prev_index]
         try:
-            device = self.device_choice.get()
-            vocals, accomp, sr = separate_audio_in_memory(prev_path, device=device)
+            job = self.scheduler.submit(
+                prev_path, self.device_choice.get(), PRIORITY_PREV,
+                session_id=session_id,
+                target_sr=self.get_output_samplerate(self.get_selected_output_index(), None),
+                profile=self.current_profile(),
+            )
+            vocals, accomp, sr = job.result()
             if session_id == self.session_id:
                 self.prev_audio_data = (prev_index, vocals, accomp, sr)
         except Exception:
             self.prev_audio_data = None
 
-    def monitor_and_play_next(self, session_id):
-        """监视播放结束并自动开始下一首。"""
-        while self.player and self.player.playing and session_id == self.session_id:
-            time.sleep(0.5)
-        if session_id != self.session_id:
-            return
-        if not self.auto_next_enabled:
-            return
-        if self.next_audio_data:
-            index, vocals, accomp, sr = self.next_audio_data
-            if self.current_audio_data:
-                self.prev_audio_data = self.current_audio_data
-                if self.audio_path:
-                    self.play_history.append({"path": self.audio_path, "time": time.time()})
-                    if len(self.play_history) > self.history_limit:
-                        self.play_history = self.play_history[-self.history_limit:]
-            self.current_index = index
-            self.audio_path = self.music_files[index]
-            self.current_file_label.config(text=f"当前播放：{os.path.basename(self.audio_path)}")
-            self.lyrics_box.delete("1.0", "end")
-            self.lyrics_box.insert("end", "✅ 自动播放下一首\n")
+    def history_paths(self):
+        """播放历史中的路径，从旧到新。"""
+        return [item["path"] for item in self.play_history if isinstance(item, dict)]
 
-            if self.player:
-                self.player.stop()
+    def predict_upcoming(self):
+        """按预取计划返回接下来几首的路径，第一首即自动接续的下一首。"""
+        return self.prefetch.predict(self.music_files, self.audio_path, self.play_mode.get(),
+                                     self.future_queue, self.history_paths())
 
-            mic_dev = None if not self.mic_enabled.get() else self.get_selected_mic_index()
-            out_dev = self.get_selected_output_index()
+    def take_prepared(self, index, slot):
+        """返回已为 index 准备好的 (人声, 伴奏, 采样率)，没有时返回 None。
+
+        先查 slot（"next_audio_data" 或 "prev_audio_data"），再查预取计划的 ahead: 槽位；
+        取用 ahead: 槽位后将其清空，数据随后登记为当前歌曲。
+        """
+        data = getattr(self, slot)
+        if data and data[0] == index:
+            return data[1:]
+        name = AHEAD_PREFIX + self.music_files[index]
+        ahead = self.buffers.get(name)
+        if ahead is None:
+            return None
+        self.buffers.put(name, None)
+        return ahead[1:]
+
+    def is_prepared(self, path):
+        """判断当前/下一首/上一首槽位中是否已有该歌曲的数据。"""
+        for data in (self.current_audio_data, self.next_audio_data, self.prev_audio_data):
+            if data and 0 <= data[0] < len(self.music_files) and self.music_files[data[0]] == path:
+                return True
+        return False
+
+    def preload_ahead(self, session_id):
+        """按预取计划在后台准备下一首之后的几首，放入 ahead: 槽位。
+
+        按计划的先后提交分离任务；超出内存预算时这些槽位最先溢出到磁盘。
+        """
+        upcoming = self.predict_upcoming()[1:]
+        wanted = {AHEAD_PREFIX + path for path in upcoming}
+        for name in self.buffers.names(AHEAD_PREFIX):
+            if name not in wanted:
+                self.buffers.put(name, None)
+        target_sr = self.get_output_samplerate(self.get_selected_output_index(), None)
+        for path in upcoming:
+            name = AHEAD_PREFIX + path
+            if session_id != self.session_id:
+                return
+            if self.buffers.get(name) is not None or self.is_prepared(path):
+                continue
             try:
-                dev_info = sd.query_devices(out_dev, 'output') if out_dev is not None else sd.query_devices(None, 'output')
-                target_sr = int(dev_info.get('default_samplerate', sr)) or sr
-                if target_sr <= 0 or target_sr > 192000:
-                    target_sr = sr
+                job = self.scheduler.submit(
+                    path, self.device_choice.get(), PRIORITY_AHEAD,
+                    session_id=session_id, target_sr=target_sr,
+                    profile=self.current_profile(),
+                )
+                vocals, accomp, sr = job.result()
             except Exception:
-                target_sr = sr
-            if sr != target_sr:
-                vocals = resample_audio(vocals, sr, target_sr)
-                accomp = resample_audio(accomp, sr, target_sr)
-                sr = target_sr
-            self.player = AudioPlayer(vocals, accomp, sr, output_device=out_dev, mic_device=mic_dev, mic_enabled=self.mic_enabled.get(), latency=0.03)
-            self.player.set_mic_volume(self.mic_volume.get())
-            self.player.set_vocal_volume(self.vocal_volume.get())
-            self.player.set_accomp_volume(self.accomp_volume.get())
+                continue
+            if session_id == self.session_id and path in self.music_files:
+                self.buffers.put(name, (self.music_files.index(path), vocals, accomp, sr))
+
+    def queue_next_track(self, session_id):
+        """把预加载好的下一首排进音频引擎，在当前歌曲结束的那一帧无缝接续。
+
+        当前歌曲已经放完（预加载没赶上）时直接开始播放下一首。
+        """
+        data, player = self.next_audio_data, self.player
+        if not data or player is None or session_id != self.session_id or not self.auto_next_enabled:
+            return
+        queued = self.queued_next
+        if queued is not None and queued[1] == data[0] and queued[0].sample_rate == player.sample_rate:
+            return
+        index, vocals, accomp, sr = data
+        progress = None
+        if sr != player.sample_rate:
+            # 预加载后输出设备变了：后台逐段转换，排队时不等整首转换完成
+            progress = convert_progressive(self.music_files[index], self.stem_cache, self.current_profile(),
+                                           vocals, accomp, sr, player.sample_rate)
+            vocals, accomp, sr = progress.vocals, progress.accomp, player.sample_rate
+        else:
+            self.prefetch_stems(vocals, accomp, sr)
+        track = self.create_player(vocals, accomp, sr, progress, owner="queued")
+        with self.track_lock:
+            # 引擎已接续到之前排队的一首时不再替换，交给 on_track_advanced 接管
+            if session_id != self.session_id or self.player is not player or player.successor is not None:
+                return
+            self.queued_next = (track, index, vocals, accomp, sr)
+            if player.playing or player.paused:
+                player.queue_next(track, self.crossfade_seconds)
+                return
+            if player.position < player.num_frames:
+                return
             try:
-                self.player.play()
+                track.play()
             except Exception as e:
                 messagebox.showerror("音频设备错误", str(e))
-                self.player.stop()
-                self.player = None
                 return
-            if self.player.output_device is None and out_dev is not None:
-                self.output_device.set("默认")
-                self.persist_settings()
+            player.successor = track
+            self.on_track_advanced(player, late=True)
+        if not self.update_loop_running:
+            threading.Thread(target=self.update_progress_loop, daemon=True).start()
+
+    def on_track_advanced(self, player, late=False):
+        """音频引擎已从 player 接续到排队的下一首，同步界面和预加载状态。
+
+        late 为 True 表示预加载没赶上，当前歌曲放完后才开始播放下一首，计为预取未命中。
+        """
+        with self.track_lock:
+            track = player.successor
+            queued = self.queued_next
+            if self.player is not player or queued is None or queued[0] is not track:
+                # 接续到的不是当前排队的下一首（已被切歌或重新排队替换）：不接管它，
+                # 停掉这个无人认领的音源，旧 player 按正常结束处理
+                player.successor = None
+                if track is not None and track is not self.player:
+                    track.stop()
+                return
+            # 确认匹配后再一并切换播放器、索引与当前数据
+            _, index, vocals, accomp, sr = queued
+            previous_path, previous_data = self.audio_path, self.current_audio_data
+            self.queued_next = None
+            self.player = track
+            self.current_index = index
+            self.audio_path = self.music_files[index]
             self.current_audio_data = (index, vocals, accomp, sr)
-            self.progress_var.set(0)
-            if not self.update_loop_running:
-                threading.Thread(target=self.update_progress_loop, daemon=True).start()
-            threading.Thread(target=lambda: self.preload_next_song(self.session_id), daemon=True).start()
-            threading.Thread(target=lambda: self.preload_prev_song(self.session_id), daemon=True).start()
-            threading.Thread(target=lambda: self.monitor_and_play_next(self.session_id), daemon=True).start()
+            self.next_audio_data = None
+        self.prefetch.record("auto", not late)
+        self.prefetch.advance(self.audio_path)
+        if previous_data:
+            self.prev_audio_data = previous_data
+        if previous_path:
+            self.play_history.append({"path": previous_path, "time": time.time()})
+            if len(self.play_history) > self.history_limit:
+                self.play_history = self.play_history[-self.history_limit:]
+        self.current_file_label.config(text=f"当前播放：{os.path.basename(self.audio_path)}")
+        self.lyrics_box.delete("1.0", "end")
+        self.lyrics_box.insert("end", "✅ 自动播放下一首\n")
+        self.load_and_display_lyrics(os.path.splitext(self.audio_path)[0] + ".lrc", track)
+        self.set_stem_sliders_enabled(True)
+        self.buffers.track("player", vocals, accomp)
+        self.buffers.track("queued")
+        self.progress_var.set(0)
+        session_id = self.session_id
+        threading.Thread(target=lambda: self.preload_next_song(session_id), daemon=True).start()
+        threading.Thread(target=lambda: self.preload_prev_song(session_id), daemon=True).start()
+        threading.Thread(target=lambda: self.preload_ahead(session_id), daemon=True).start()
 
     def get_next_index(self, peek=False, queue_only=False):
         """根据播放模式和队列返回下一首的索引。"""
@@ -228,12 +568,10 @@ class PlaybackMixin:
         elif mode == "循环":
             return (self.current_index + 1) % len(self.music_files)
         elif mode == "随机":
-            if self.next_audio_data:
-                return self.next_audio_data[0]
-            candidates = list(range(len(self.music_files)))
-            if len(candidates) > 1:
-                candidates.remove(self.current_index)
-            return random.choice(candidates)
+            # 与预取读取同一份随机计划，预加载的就是接下来真正播放的歌曲
+            plan = self.prefetch.shuffle_plan(self.music_files, self.audio_path,
+                                              self.history_paths() + [self.audio_path])
+            return self.music_files.index(plan[0]) if plan else None
         return None
 
     def get_prev_index(self):
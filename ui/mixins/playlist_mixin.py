@@ -30,6 +30,8 @@ class PlaylistMixin:
         self.music_files = list(self.all_music_files)
         self.refresh_file_listbox()
         self.update_queue_listbox()
+        if self.preseparation_enabled.get():
+            self.start_preseparation()
 
     def refresh_file_listbox(self):
         """刷新列表框以显示可播放的歌曲。"""
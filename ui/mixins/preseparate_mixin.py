@@ -0,0 +1,72 @@
+"""空闲时在后台逐首预分离整个曲库的混入类。"""
+
+import collections
+import os
+import threading
+
+from audio.separator import is_cached
+from audio.scheduler import PRIORITY_BACKGROUND, SeparationCancelled
+
+
+class PreseparateMixin:
+    """按待播列表、常听歌曲、其余曲库的顺序预先分离并写入磁盘缓存。"""
+
+    def preseparation_plan(self):
+        """依次产出待预分离的文件路径，已产出过的不再重复。"""
+        seen = set()
+        counts = collections.Counter(
+            item["path"] for item in self.play_history if isinstance(item, dict)
+        )
+        most_played = [path for path, _ in counts.most_common()]
+        for path in list(self.future_queue) + most_played + list(self.all_music_files):
+            if path in seen or not os.path.isfile(path):
+                continue
+            seen.add(path)
+            yield path
+
+    def preseparation_throttled(self):
+        """音频回调负载过高时返回 True，让后台推理暂停。"""
+        player = self.player
+        return player is not None and player.callback_load > self.preseparation_max_load
+
+    def toggle_preseparation(self, *args):
+        """根据复选框状态开启或停止后台预分离。"""
+        self.persist_settings()
+        if self.preseparation_enabled.get():
+            self.start_preseparation()
+        else:
+            self.scheduler.cancel_background()
+
+    def start_preseparation(self):
+        """启动后台预分离线程（已在运行时忽略）。"""
+        if self.preseparation_running or self.stem_cache is None:
+            return
+        self.preseparation_running = True
+        threading.Thread(target=self.preseparation_loop, daemon=True).start()
+
+    def preseparation_loop(self):
+        """逐首提交后台分离任务，每次只排队一首，结果由调度器写入缓存。
+
+        任务被取消（合并到的播放任务随切歌取消，或设备、档位改变）时重新提交同一首，
+        只有关闭预分离才退出。
+        """
+        try:
+            for path in self.preseparation_plan():
+                while (self.preseparation_enabled.get()
+                       and not is_cached(path, self.stem_cache, self.current_profile())):
+                    job = self.scheduler.submit(
+                        path, self.device_choice.get(), PRIORITY_BACKGROUND,
+                        target_sr=self.get_output_samplerate(self.get_selected_output_index(), None),
+                        profile=self.current_profile(),
+                    )
+                    try:
+                        job.result()
+                    except SeparationCancelled:
+                        continue
+                    except Exception:
+                        pass
+                    break
+                if not self.preseparation_enabled.get():
+                    break
+        finally:
+            self.preseparation_running = False
@@ -13,7 +13,13 @@ class ProgressMixin:
     def update_progress_loop(self):
         """后台循环，定时刷新进度和时间标签。"""
         self.update_loop_running = True
-        while self.player and (self.player.playing or self.player.paused):
+        while self.player:
+            if self.player.successor is not None:
+                # 引擎已在音频回调中无缝切到下一首，这里只同步界面
+                self.on_track_advanced(self.player)
+                continue
+            if not (self.player.playing or self.player.paused):
+                break
             current = self.player.get_current_time()
             total = self.player.num_frames / self.player.sample_rate
             if not self.dragging:
@@ -25,6 +31,17 @@ class ProgressMixin:
                 self.time_label_lyrics.config(
                     text=f"{self.format_time(current)} / {self.format_time(total)}"
                 )
+            rtt = self.player.round_trip_latency if self.player else None
+            if rtt is not None and hasattr(self, "latency_label"):
+                mode = "全双工" if self.player.duplex_active else "双流"
+                self.latency_label.config(text=f"{mode} 往返 {rtt * 1000:.0f} ms")
+            if hasattr(self, "buffer_label"):
+                usage = self.buffers.usage()
+                text = f"音频内存 {usage['ram_mb']:.0f}/{usage['budget_mb']:.0f} MB"
+                rate = self.prefetch.hit_rate()
+                if rate is not None:
+                    text += f" · 预取命中 {rate:.0%}"
+                self.buffer_label.config(text=text)
             time.sleep(0.2)
         self.update_loop_running = False
 
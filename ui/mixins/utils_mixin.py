@@ -2,16 +2,19 @@
 
 import os
 import threading
+import tkinter as tk
 from tkinter import filedialog, messagebox
-import torch
-import torchaudio
-import sounddevice as sd
 try:
     import soundfile as sf
 except Exception:
     sf = None
 
+from utils.audio_utils import to_float32
 from utils.settings import save_settings
+from audio.separator import DEFAULT_PROFILE, warm_up
+
+# 界面上显示的档位名称
+PROFILE_LABELS = {"fast": "快速", "fast_int8": "快速 int8", "balanced": "均衡", "quality": "高质量"}
 
 
 class UtilsMixin:
@@ -28,34 +31,59 @@ class UtilsMixin:
 
     def change_volume(self, val):
         """人声音量滑块变化时的回调。"""
-        if self.player:
-            self.player.set_vocal_volume(float(val))
+        for player in (self.player, self.queued_next and self.queued_next[0]):
+            if player:
+                player.set_vocal_volume(float(val))
         if hasattr(self, "vocal_label"):
             self.vocal_label.config(text=f"🎤 人声 {int(float(val)*100)}%")
         self.persist_settings()
 
     def change_accomp_volume(self, val):
         """伴奏音量滑块变化时的回调。"""
-        if self.player:
-            self.player.set_accomp_volume(float(val))
+        for player in (self.player, self.queued_next and self.queued_next[0]):
+            if player:
+                player.set_accomp_volume(float(val))
         if hasattr(self, "accomp_label"):
             self.accomp_label.config(text=f"🎶 伴奏 {int(float(val)*100)}%")
         self.persist_settings()
 
+    def warm_up_separator(self):
+        """窗口显示后在后台预先导入 torch 并加载当前档位的模型。"""
+        device, profile = self.device_choice.get(), self.current_profile()
+        threading.Thread(target=lambda: warm_up(device, profile), daemon=True).start()
+
+    def current_profile(self):
+        """返回当前分离设备所选的速度/质量档位名。"""
+        return self.separation_profiles.get(self.device_choice.get(), DEFAULT_PROFILE)
+
+    def on_separation_device_change(self, *args):
+        """切换分离设备时显示该设备保存的档位。"""
+        label = PROFILE_LABELS.get(self.current_profile(), PROFILE_LABELS[DEFAULT_PROFILE])
+        if self.profile_choice.get() != label:
+            self.profile_choice.set(label)
+        self.persist_settings()
+
+    def on_profile_change(self, *args):
+        """为当前分离设备保存所选档位。"""
+        for name, label in PROFILE_LABELS.items():
+            if label == self.profile_choice.get():
+                self.separation_profiles[self.device_choice.get()] = name
+                break
+        self.persist_settings()
+
     def change_mic_volume(self, *args):
         """根据变量变动更新麦克风音量。"""
-        if self.player:
-            self.player.set_mic_volume(float(self.mic_volume.get()))
+        self.audio_engine.set_mic_volume(float(self.mic_volume.get()))
         self.persist_settings()
 
 
     def on_mic_device_change(self, *args):
         """处理麦克风设备切换。"""
         self.persist_settings()
-        if self.player and self.mic_enabled.get():
+        if self.mic_enabled.get():
             mic_dev = self.get_selected_mic_index()
             try:
-                self.player.set_mic_enabled(True, mic_dev)
+                self.audio_engine.set_mic_enabled(True, mic_dev)
                 self.show_toast("已切换麦克风")
             except Exception as e:
                 messagebox.showerror("麦克风错误", str(e))
@@ -64,28 +92,39 @@ class UtilsMixin:
     def toggle_mic(self, *args):
         """根据复选框状态启用或禁用麦克风。"""
         self.persist_settings()
-        if self.player:
-            if self.mic_enabled.get():
-                mic_dev = self.get_selected_mic_index()
-                try:
-                    self.player.set_mic_enabled(True, mic_dev)
-                    self.player.set_mic_volume(float(self.mic_volume.get()))
-                except Exception as e:
-                    messagebox.showerror("麦克风错误", str(e))
-                    self.mic_enabled.set(False)
-            else:
-                self.player.set_mic_enabled(False)
+        engine = self.audio_engine
+        if self.mic_enabled.get():
+            mic_dev = self.get_selected_mic_index()
+            try:
+                engine.set_mic_enabled(True, mic_dev)
+                engine.set_mic_volume(float(self.mic_volume.get()))
+            except Exception as e:
+                messagebox.showerror("麦克风错误", str(e))
+                self.mic_enabled.set(False)
+        else:
+            engine.set_mic_enabled(False)
+
+    def toggle_duplex_mic(self, *args):
+        """切换全双工麦克风模式，输出流已打开时立即重开。"""
+        self.persist_settings()
+        try:
+            self.audio_engine.set_duplex(self.duplex_mic.get())
+        except Exception as e:
+            messagebox.showerror("输出设备错误", str(e))
+        self.latency_label.config(text="")
 
     def on_output_device_change(self, *args):
         """切换用户选择的输出设备。"""
         self.persist_settings()
-        if self.player:
+        if self.audio_engine.stream is not None:
             out_dev = self.get_selected_output_index()
             try:
-                self.player.change_output_device(out_dev)
+                self.audio_engine.change_output_device(out_dev)
                 self.show_toast("已切换输出设备")
             except Exception as e:
                 messagebox.showerror("输出设备错误", str(e))
+        session_id = self.session_id
+        threading.Thread(target=lambda: self.reconvert_preloaded(session_id), daemon=True).start()
 
     def export_vocals(self):
         """将当前歌曲的人声导出到文件。"""
@@ -116,7 +155,12 @@ class UtilsMixin:
     def save_audio_file(self, path, data, sr):
         """使用 torchaudio 或 soundfile 将音频写入磁盘。"""
         error = None
+        # 紧凑存储的数据先还原为 float32
+        data = to_float32(data)
         try:
+            import torch
+            import torchaudio
+
             tensor = torch.from_numpy(data.T)
             torchaudio.save(path, tensor, sr)
         except Exception as e:
@@ -132,12 +176,57 @@ class UtilsMixin:
         else:
             messagebox.showerror("导出错误", str(error))
 
+    def populate_device_maps(self):
+        """按注册表缓存重建设备标签映射，返回 (输出设备标签, 输入设备标签)。"""
+        self.output_device_map.clear()
+        self.input_device_map.clear()
+        output_devs = []
+        for label, idx in self.devices.labels("output"):
+            output_devs.append(label)
+            self.output_device_map[label] = idx
+        if not output_devs:
+            output_devs = ["默认"]
+            self.output_device_map["默认"] = None
+        if self.output_device.get() not in output_devs:
+            self.output_device.set("默认")
+
+        input_devs = []
+        for label, idx in self.devices.labels("input"):
+            input_devs.append(label)
+            self.input_device_map[label] = idx
+        if not input_devs:
+            input_devs = ["无"]
+            self.input_device_map["无"] = None
+        if self.mic_device.get() not in input_devs:
+            self.mic_device.set("无")
+        return output_devs, input_devs
+
+    def refresh_device_menus(self):
+        """设备列表变化后重建输出设备与麦克风下拉菜单。"""
+        output_devs, input_devs = self.populate_device_maps()
+        for widget, var, labels in ((self.output_menu, self.output_device, output_devs),
+                                    (self.mic_menu, self.mic_device, input_devs)):
+            menu = widget["menu"]
+            menu.delete(0, "end")
+            for label in labels:
+                menu.add_command(label=label, command=tk._setit(var, label))
+
+    def refresh_audio_devices(self):
+        """重新扫描音频硬件（会短暂重开音频流），发现插拔的设备后更新菜单。"""
+        try:
+            changed = self.audio_engine.refresh_devices()
+        except Exception as e:
+            messagebox.showerror("输出设备错误", str(e))
+            return
+        self.refresh_device_menus()
+        self.show_toast("设备列表已更新" if changed else "设备列表无变化")
+
     def get_selected_mic_index(self):
         """返回当前选中的麦克风设备索引。"""
         idx = self.input_device_map.get(self.mic_device.get())
         if idx is not None:
             try:
-                sd.query_devices(idx, "input")
+                self.devices.query(idx, "input")
             except Exception:
                 self.mic_device.set("无")
                 self.persist_settings()
@@ -149,7 +238,7 @@ class UtilsMixin:
         idx = self.output_device_map.get(self.output_device.get())
         if idx is not None:
             try:
-                sd.query_devices(idx, "output")
+                self.devices.query(idx, "output")
             except Exception:
                 self.output_device.set("默认")
                 self.persist_settings()
@@ -160,12 +249,16 @@ class UtilsMixin:
         """将当前界面设置保存到磁盘。"""
         settings = {
             "device": self.device_choice.get(),
+            "separation_profiles": self.separation_profiles,
+            "cpu_threads": self.scheduler.foreground_threads or 0,
+            "separation_backend": self.separation_backend,
             "play_mode": self.play_mode.get(),
             "music_folder": self.music_folder,
             "output_device": self.output_device.get(),
             "mic_device": self.mic_device.get(),
             "mic_volume": self.mic_volume.get(),
             "mic_enabled": self.mic_enabled.get(),
+            "duplex_mic": self.duplex_mic.get(),
             "vocal_volume": self.vocal_volume.get(),
             "accomp_volume": self.accomp_volume.get(),
             "lyric_font_size": self.lyrics_font_size.get(),
@@ -173,12 +266,42 @@ class UtilsMixin:
             "history": self.play_history,
             "theme": self.theme_choice.get(),
             "language": self.language_choice.get(),
+            "stem_cache_enabled": self.stem_cache_enabled,
+            "stem_cache_dir": self.stem_cache_dir,
+            "stem_cache_max_mb": self.stem_cache_max_mb,
+            "stem_archive_enabled": self.stem_archive_enabled,
+            "stem_archive_dir": self.stem_archive_dir,
+            "stem_archive_max_mb": self.stem_archive_max_mb,
+            "progressive_separation": self.progressive_separation,
+            "instant_playback": self.instant_playback,
+            "idle_preseparation": self.preseparation_enabled.get(),
+            "preseparation_threads": self.preseparation_threads,
+            "preseparation_max_load": self.preseparation_max_load,
+            "audio_health_log": self.audio_health_log,
+            "crossfade_seconds": self.crossfade_seconds,
+            "device_refresh_seconds": self.device_refresh_seconds,
+            "audio_buffer_budget_mb": self.buffer_budget_mb,
+            "stem_storage": self.stem_storage,
+            "prefetch_depth": self.prefetch_depth,
         }
         save_settings(settings)
 
     def on_close(self):
         """处理窗口关闭事件并保存设置。"""
         self.persist_settings()
+        self.scheduler.cancel_all()
+        if self.health_logger:
+            self.health_logger.stop()
+        self.devices.stop_monitor()
         if self.player:
             self.player.stop()
+        self.audio_engine.close()
         self.root.destroy()
+
+    def audio_health_snapshot(self):
+        """返回当前播放器的健康统计及歌曲名，未在播放时返回 None。"""
+        player = self.player
+        if not player or not (player.playing or player.paused):
+            return None
+        return {"song": os.path.basename(self.audio_path or ""), **player.health(),
+                "buffers": self.buffers.usage(), "prefetch": self.prefetch.stats()}
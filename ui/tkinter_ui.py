@@ -12,14 +12,24 @@ import platform
 import sounddevice as sd
 
 from utils.settings import load_settings
+from audio.stem_cache import StemCache
+from audio.compressed_cache import CompressedStemCache
+from audio.engine import AudioEngine
+from audio.devices import default_registry
+from audio.buffers import AudioBufferManager
+from audio.prefetch import PrefetchPlanner
+from audio.health import HealthLogger
+from audio.scheduler import SeparationScheduler
+from audio.separator import DEFAULT_PROFILE, configure_backend
 
 from .mixins.playlist_mixin import PlaylistMixin
 from .mixins.playback_mixin import PlaybackMixin
-from .mixins.utils_mixin import UtilsMixin
+from .mixins.utils_mixin import UtilsMixin, PROFILE_LABELS
 from .mixins.control_mixin import ControlMixin
 from .mixins.progress_mixin import ProgressMixin
 from .mixins.lyrics_mixin import LyricsMixin
 from .mixins.search_mixin import SearchMixin
+from .mixins.preseparate_mixin import PreseparateMixin
 
 
 class PlayerApp(
@@ -29,6 +39,7 @@ class PlayerApp(
     ProgressMixin,
     LyricsMixin,
     SearchMixin,
+    PreseparateMixin,
     UtilsMixin,
 ):
     """主窗口类，由多个 mixin 组合而成。"""
@@ -65,10 +76,16 @@ class PlayerApp(
                     sd.default.device = (in_dev if in_dev >= 0 else cur_in,
                                         out_dev if out_dev >= 0 else cur_out)
                     break
+        # 设备列表与能力只在这里枚举一次，之后按需或定时刷新
+        self.devices = default_registry()
 
         self.audio_path      = None
         self.player          = None
         self.device_choice   = tk.StringVar(value=settings.get("device", "cuda"))
+        self.separation_profiles = dict(settings.get("separation_profiles") or {})
+        self.profile_choice  = tk.StringVar(value=PROFILE_LABELS.get(
+            self.separation_profiles.get(self.device_choice.get(), DEFAULT_PROFILE),
+            PROFILE_LABELS[DEFAULT_PROFILE]))
         self.play_mode       = tk.StringVar(value=settings.get("play_mode", "顺序"))
         self.music_folder    = settings.get("music_folder", "")
         self.output_device   = tk.StringVar(value=settings.get("output_device", "默认"))
@@ -78,12 +95,21 @@ class PlayerApp(
         self.vocal_volume    = tk.DoubleVar(value=settings.get("vocal_volume", 1.0))
         self.accomp_volume   = tk.DoubleVar(value=settings.get("accomp_volume", 1.0))
         self.mic_enabled     = tk.BooleanVar(value=settings.get("mic_enabled", False))
+        self.duplex_mic      = tk.BooleanVar(value=settings.get("duplex_mic", False))
         self.lyrics_font_size = tk.IntVar(value=settings.get("lyric_font_size", 14))
         self.update_loop_running = False
         self.dragging            = False
         self.music_files, self.all_music_files = [], []
         self.current_index       = -1
+        # 已准备音频数据的内存预算，超出时把上一首/下一首溢出到磁盘
+        self.buffer_budget_mb    = int(settings.get("audio_buffer_budget_mb", 1024))
+        self.stem_storage        = settings.get("stem_storage", "float32")
+        self.buffers             = AudioBufferManager(self.buffer_budget_mb * 1024 * 1024,
+                                                      compact=self.stem_storage)
         self.next_audio_data = self.prev_audio_data = self.current_audio_data = None
+        # 预测并预取接下来 prefetch_depth 首（含下一首），随机模式的播放顺序也由它预先抽好
+        self.prefetch_depth      = int(settings.get("prefetch_depth", 3))
+        self.prefetch            = PrefetchPlanner(self.prefetch_depth)
         self.future_queue        = list(settings.get("queue", []))
         raw_hist = list(settings.get("history", []))
         self.play_history        = []
@@ -94,6 +120,59 @@ class PlayerApp(
                 self.play_history.append({'path': item, 'time': 0})
         self.history_limit       = 100
         self.session_id          = None
+        self.progressive_separation = bool(settings.get("progressive_separation", True))
+        self.instant_playback = bool(settings.get("instant_playback", True))
+
+        # ——— 分离结果磁盘缓存 ——— #
+        self.stem_cache_enabled  = bool(settings.get("stem_cache_enabled", True))
+        self.stem_cache_dir      = settings.get("stem_cache_dir", "")
+        self.stem_cache_max_mb   = int(settings.get("stem_cache_max_mb", 4096))
+        # 原始缓存淘汰的歌曲压缩转存到第二层，供曲库中不常听的歌曲使用
+        self.stem_archive_enabled = bool(settings.get("stem_archive_enabled", True))
+        self.stem_archive_dir    = settings.get("stem_archive_dir", "")
+        self.stem_archive_max_mb = int(settings.get("stem_archive_max_mb", 16384))
+        self.stem_cache          = None
+        if self.stem_cache_enabled:
+            archive = None
+            if self.stem_archive_enabled:
+                try:
+                    archive = CompressedStemCache(self.stem_archive_dir or None,
+                                                  self.stem_archive_max_mb * 1024 * 1024)
+                except (ImportError, OSError):
+                    archive = None
+            try:
+                self.stem_cache = StemCache(self.stem_cache_dir or None,
+                                            self.stem_cache_max_mb * 1024 * 1024,
+                                            archive=archive)
+            except OSError:
+                self.stem_cache = None
+        self.separation_backend  = settings.get("separation_backend", "eager")
+        configure_backend(self.separation_backend,
+                          os.path.join(self.stem_cache.cache_dir, "_models")
+                          if self.stem_cache else None)
+        # 所有分离任务（当前、下一首、上一首）统一由调度器串行推理
+        self.scheduler           = SeparationScheduler(cache=self.stem_cache)
+
+        # ——— 空闲时预分离整个曲库 ——— #
+        self.preseparation_enabled  = tk.BooleanVar(value=settings.get("idle_preseparation", False))
+        self.preseparation_threads  = int(settings.get("preseparation_threads", 2))
+        self.preseparation_max_load = float(settings.get("preseparation_max_load", 0.5))
+        self.preseparation_running  = False
+        self.scheduler.background_threads = self.preseparation_threads or None
+        self.scheduler.foreground_threads = int(settings.get("cpu_threads", 0)) or None
+        self.scheduler.throttle = self.preseparation_throttled
+
+        # ——— 常驻音频引擎：输出流在首次播放时打开，之后切歌只替换音源 ——— #
+        self.audio_engine = AudioEngine(latency=0.03, duplex=self.duplex_mic.get(),
+                                        devices=self.devices)
+        # 已排进引擎的下一首 (播放器, 索引, 人声, 伴奏, 采样率)；0 秒为无缝衔接
+        self.queued_next = None
+        self.crossfade_seconds = max(0.0, float(settings.get("crossfade_seconds", 0.0)))
+
+        # ——— 音频健康日志：定期把回调统计写入 audio_health/ 下的 JSONL ——— #
+        self.audio_health_log = bool(settings.get("audio_health_log", False))
+        self.health_logger = (HealthLogger(self.audio_health_snapshot).start()
+                              if self.audio_health_log else None)
 
         # ========= 全局快捷键 ========= #
         root.bind('<space>', lambda e: self.toggle_pause())
@@ -164,35 +243,8 @@ class PlayerApp(
         audio_frame = ttk.Labelframe(ctrl_tab, text="音频设置")
         audio_frame.grid(row=1, column=0, sticky="ew", padx=2, pady=2)
 
-        # 查询设备信息
-        self.output_device_map.clear()
-        self.input_device_map.clear()
-        all_devices = list(enumerate(sd.query_devices()))
-        hostapis    = sd.query_hostapis()
-
-        output_devs = []
-        for i, dev in all_devices:
-            if dev['max_output_channels'] > 0:
-                label = f"{i}: {dev['name']} ({hostapis[dev['hostapi']]['name']})"
-                output_devs.append(label)
-                self.output_device_map[label] = i
-        if not output_devs:
-            output_devs = ["默认"]
-            self.output_device_map["默认"] = None
-        if self.output_device.get() not in output_devs:
-            self.output_device.set("默认")
-
-        input_devs = []
-        for i, dev in all_devices:
-            if dev['max_input_channels'] > 0:
-                label = f"{i}: {dev['name']} ({hostapis[dev['hostapi']]['name']})"
-                input_devs.append(label)
-                self.input_device_map[label] = i
-        if not input_devs:
-            input_devs = ["无"]
-            self.input_device_map["无"] = None
-        if self.mic_device.get() not in input_devs:
-            self.mic_device.set("无")
+        # 设备信息取自注册表的缓存
+        output_devs, input_devs = self.populate_device_maps()
 
         # --- 行1：分离方式 + 播放模式 ---
         row1 = ttk.Frame(audio_frame)
@@ -213,6 +265,22 @@ class PlayerApp(
         )
         option_menu1.pack(side="left", padx=4)
 
+        ttk.Label(row1, text="分离质量：").pack(side="left", padx=4)
+        option_menu5 = tk.OptionMenu(row1, self.profile_choice, *PROFILE_LABELS.values())
+        option_menu5.config(
+            bg="#3498DB",        # 背景色（淡蓝色）
+            fg="white",          # 字体颜色
+            activebackground="#48A2DE",
+            activeforeground="white",
+            highlightthickness=0,
+            relief="flat"
+        )
+        option_menu5["menu"].config(
+            bg="white",          # 下拉菜单背景
+            fg="black"           # 下拉菜单文字颜色
+        )
+        option_menu5.pack(side="left", padx=4)
+
         ttk.Label(row1, text="播放模式：").pack(side="left", padx=4)
         option_menu2 = tk.OptionMenu(row1, self.play_mode, "顺序", "循环", "随机")
         option_menu2.config(
@@ -230,6 +298,7 @@ class PlayerApp(
         option_menu2.pack(side="left", padx=4)
         ttk.Label(row1, text="输出设备：").pack(side="left", padx=4)
         option_menu3 = tk.OptionMenu(row1, self.output_device, *output_devs)
+        self.output_menu = option_menu3
         option_menu3.config(
             bg="#3498DB",        # 背景色（淡蓝色）
             fg="white",          # 字体颜色
@@ -243,12 +312,15 @@ class PlayerApp(
             fg="black"           # 下拉菜单文字颜色
         )
         option_menu3.pack(side="left", padx=4)
+        ttk.Button(row1, text="⟳", width=2, command=self.refresh_audio_devices,
+                   bootstyle="info-outline").pack(side="left", padx=2)
 
         # --- 行3：麦克风 + 音量 ---
         row2 = ttk.Frame(audio_frame)
         row2.pack(pady=4)
         ttk.Label(row2, text="麦克风：").pack(side="left", padx=4)
         option_menu4 = tk.OptionMenu(row2, self.mic_device, *input_devs)
+        self.mic_menu = option_menu4
         option_menu4.config(
             bg="#3498DB",        # 背景色（淡蓝色）
             fg="white",          # 字体颜色
@@ -272,22 +344,37 @@ class PlayerApp(
            command=lambda val: self.mic_volume.set(float(val)),
            length=140, variable=self.mic_volume,
            bootstyle="info").pack(side="left", padx=4)
+        tk.Checkbutton(row2, text="低延迟全双工", variable=self.duplex_mic,
+                    font=("Microsoft YaHei", 10)).pack(side="left", padx=4)
+        self.latency_label = ttk.Label(row2, text="", font=("Microsoft YaHei", 10))
+        self.latency_label.pack(side="left", padx=4)
 
+        # --- 行3：后台预分离 ---
+        row3 = ttk.Frame(audio_frame)
+        row3.pack(pady=4)
+        tk.Checkbutton(row3, text="空闲时预分离整个曲库", variable=self.preseparation_enabled,
+                    font=("Microsoft YaHei", 10)).pack(side="left", padx=4)
+        self.buffer_label = ttk.Label(row3, text="", font=("Microsoft YaHei", 10))
+        self.buffer_label.pack(side="left", padx=8)
 
 
         # —— 状态持久化 —— #
-        self.device_choice.trace_add("write", lambda *_: self.persist_settings())
+        self.device_choice.trace_add("write", lambda *_: self.on_separation_device_change())
+        self.profile_choice.trace_add("write", lambda *_: self.on_profile_change())
         self.play_mode.trace_add("write",  lambda *_: self.persist_settings())
+        self.play_mode.trace_add("write",  lambda *_: self.prefetch.reset())
         self.output_device.trace_add("write", lambda *_: self.on_output_device_change())
         self.mic_device.trace_add("write",   lambda *_: self.on_mic_device_change())
         self.mic_volume.trace_add("write",   lambda *_: self.change_mic_volume())
         self.mic_enabled.trace_add("write",  lambda *_: self.toggle_mic())
+        self.duplex_mic.trace_add("write",   lambda *_: self.toggle_duplex_mic())
         self.vocal_volume.trace_add("write", lambda *_: self.change_volume(
             self.vocal_volume.get()))
         self.accomp_volume.trace_add("write", lambda *_: self.change_accomp_volume(
             self.accomp_volume.get()))
         self.theme_choice.trace_add("write",   lambda *_: self.persist_settings())
         self.language_choice.trace_add("write", lambda *_: self.persist_settings())
+        self.preseparation_enabled.trace_add("write", lambda *_: self.toggle_preseparation())
 
         # 播放控制按钮行
         ctrl_btn_row = ttk.Frame(ctrl_tab)
@@ -437,8 +524,20 @@ class PlayerApp(
 
         # =============== 其余运行控制变量 =============== #
         self.play_lock         = threading.Lock()  # 防止重复播放
+        self.track_lock        = threading.RLock() # 切换 player 与排队的下一首时持有
         self.auto_next_enabled = True              # 控制是否启用自动播放下一首
 
+        # 窗口显示后再在后台加载 torch 与分离模型
+        self.root.after(1000, self.warm_up_separator)
+
+        # 定时刷新设备列表；正在播放或开着麦克风时只刷新快照，暂停或空闲时才重新扫描硬件
+        self.device_refresh_seconds = float(settings.get("device_refresh_seconds", 10.0))
+        self.devices.start_monitor(
+            self.device_refresh_seconds,
+            on_change=lambda _: self.root.after(0, self.refresh_device_menus),
+            refresh=self.audio_engine.refresh_devices_if_idle,
+        )
 
 
 
+
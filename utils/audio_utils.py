@@ -1,14 +1,130 @@
 """提供基础音频处理的辅助函数。"""
 
+import math
+
 import numpy as np
-import torch
-import torchaudio.functional as F
+
+# 紧凑存储可选的样本类型，float32 表示不压缩
+COMPACT_DTYPES = ("float32", "float16", "int16")
+# 压缩时每次处理的帧数，限制临时数组的大小
+_COMPACT_CHUNK = 1 << 18
+
+
+class ScaledArray(np.ndarray):
+    """以 int16/float16 保存的音频，样本乘以 scale 还原为浮点值。
+
+    切片得到的视图保留 scale；播放时把 scale 并入音量增益，只在混音时逐块转换。
+    """
+
+    def __new__(cls, data, scale=1.0):
+        obj = np.asarray(data).view(cls)
+        obj.scale = float(scale)
+        return obj
+
+    def __array_finalize__(self, obj):
+        self.scale = getattr(obj, "scale", 1.0)
+
+
+def sample_scale(data) -> float:
+    """返回音频数据的还原系数，普通浮点数组为 1。"""
+    return getattr(data, "scale", 1.0)
+
+
+def compact_audio(data: np.ndarray, dtype: str) -> np.ndarray:
+    """把浮点音频转换为 dtype（float16 或 int16）的 ScaledArray，内存减半。
+
+    int16 按整段峰值确定 scale，峰值映射到 32767；dtype 为 float32 时原样返回。
+    """
+    if dtype not in ("float16", "int16") or isinstance(data, ScaledArray):
+        return data
+    out = np.empty(data.shape, dtype=dtype)
+    if dtype == "float16":
+        for start in range(0, len(data), _COMPACT_CHUNK):
+            out[start:start + _COMPACT_CHUNK] = data[start:start + _COMPACT_CHUNK]
+        return ScaledArray(out, 1.0)
+    peak = max((float(np.abs(data[start:start + _COMPACT_CHUNK]).max(initial=0.0))
+                for start in range(0, len(data), _COMPACT_CHUNK)), default=0.0)
+    scale = (peak or 1.0) / 32767.0
+    for start in range(0, len(data), _COMPACT_CHUNK):
+        chunk = data[start:start + _COMPACT_CHUNK] * (1.0 / scale)
+        np.rint(chunk, out=chunk)
+        out[start:start + _COMPACT_CHUNK] = chunk
+    return ScaledArray(out, scale)
+
+
+def to_float32(data: np.ndarray) -> np.ndarray:
+    """还原为普通 float32 数组；已是 float32 时不复制。"""
+    scale = sample_scale(data)
+    data = np.asarray(data)
+    if scale == 1.0:
+        return data if data.dtype == np.float32 else data.astype(np.float32)
+    return np.multiply(data, np.float32(scale), dtype=np.float32)
+
 
 def resample_audio(data: np.ndarray, orig_sr: int, new_sr: int) -> np.ndarray:
     """将 numpy 音频数据重新采样到指定采样率。"""
     if orig_sr == new_sr:
         return data
+    data = to_float32(data)
+    # torch 体积较大，首次需要重采样时才导入，避免拖慢程序启动
+    import torch
+    import torchaudio.functional as F
+
     tensor = torch.from_numpy(data.T)
     resampled = F.resample(tensor, orig_sr, new_sr)
     return resampled.T.numpy()
 
+
+
+class StreamingResampler:
+    """逐块重采样的有状态重采样器，用于麦克风等实时小块数据。
+
+    预先计算多相滤波器系数，并在块之间保留输入历史与相位，
+    块边界处没有滤波器状态重置带来的咔哒声；纯 NumPy 实现，无需导入 torch。
+    """
+
+    def __init__(self, orig_sr: int, new_sr: int, channels: int = 1,
+                 zero_crossings: int = 8, rolloff: float = 0.94, beta: float = 8.0):
+        """按整数比 new_sr/orig_sr 设计 Kaiser 窗 sinc 多相滤波器。"""
+        g = math.gcd(int(orig_sr), int(new_sr))
+        self.up = int(new_sr) // g
+        self.down = int(orig_sr) // g
+        self.channels = channels
+        # 降采样时截止频率随之降低，需要按比例增加每相抽头数
+        taps = int(math.ceil(2 * zero_crossings * max(1.0, self.down / self.up)))
+        length = self.up * taps
+        cutoff = 0.5 * rolloff / max(self.up, self.down)
+        n = np.arange(length) - (length - 1) / 2
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta) * self.up
+        # phases[p, j] = kernel[p + j * up]，对应输入 x[n - j] 的权重
+        self.phases = kernel.reshape(taps, self.up).T.astype(np.float32)
+        self.taps = taps
+        self._offsets = np.arange(taps - 1, -1, -1)[None, :]
+        self.reset()
+
+    @property
+    def delay(self) -> float:
+        """滤波器引入的固定延迟（输入采样点数）。"""
+        return (self.up * self.taps - 1) / (2 * self.up)
+
+    def reset(self):
+        """清空历史数据，下一块从头开始。"""
+        self._history = np.zeros((self.taps - 1, self.channels), dtype=np.float32)
+        # 下一个输出点相对当前块首个输入样本的位置，以 1/up 个输入样本为单位
+        self._pos = 0
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """重采样一块 [frames, channels] 数据并返回新数组，输出长度随相位累计变化。"""
+        frames = len(block)
+        up, down = self.up, self.down
+        buf = np.concatenate([self._history, block.astype(np.float32, copy=False)], axis=0)
+        count = max(0, (frames * up - 1 - self._pos) // down + 1)
+        pos = self._pos + np.arange(count) * down
+        base = pos // up
+        # buf 中 x[m] 位于 m + taps - 1，idx[k, j] 即 x[n - j]；history 保证下标不越界
+        idx = base[:, None] + self._offsets
+        weights = self.phases[pos % up]
+        out = np.einsum("kt,ktc->kc", weights, buf[idx])
+        self._pos += count * down - frames * up
+        self._history = buf[len(buf) - (self.taps - 1):]
+        return out
@@ -15,6 +15,7 @@ DEFAULT_SETTINGS = {
     "mic_device": None,
     "mic_volume": 1.0,
     "mic_enabled": False,
+    "duplex_mic": False,
     "vocal_volume": 1.0,
     "accomp_volume": 1.0,
     "lyric_font_size": 14,
@@ -22,6 +23,26 @@ DEFAULT_SETTINGS = {
     "history": [],
     "theme": "flatly",
     "language": "中文",
+    "stem_cache_enabled": True,
+    "stem_cache_dir": "",
+    "stem_cache_max_mb": 4096,
+    "stem_archive_enabled": True,
+    "stem_archive_dir": "",
+    "stem_archive_max_mb": 16384,
+    "progressive_separation": True,
+    "instant_playback": True,
+    "idle_preseparation": False,
+    "preseparation_threads": 2,
+    "preseparation_max_load": 0.5,
+    "separation_profiles": {"cpu": "balanced", "cuda": "balanced"},
+    "cpu_threads": 0,
+    "separation_backend": "eager",
+    "audio_health_log": False,
+    "crossfade_seconds": 0.0,
+    "device_refresh_seconds": 10.0,
+    "audio_buffer_budget_mb": 1024,
+    "stem_storage": "float32",
+    "prefetch_depth": 3,
 }
 
 def load_settings():